@@ -0,0 +1,114 @@
+"""Benchmark the download -> extract pipeline end to end against a local mock of the EUMETSAT API.
+
+Runs `download.py` over the date range against `MockApi`, in a scratch dir, then reports products/min,
+bytes/s and the latency percentiles of each stage from its metrics.
+
+Any args after `--` are passed on to `download.py`, e.g.
+    python bench_ingest.py --product_mb 250 --bandwidth_mbps 40 -- --dl 4 --ep 8 --async_dl
+
+Extraction needs a real product to load, pass one with `--sample <file>.nat`. With the default random
+`.nat` files every extract fails at the load stage, so only the download side is measured.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from absl import flags, app, logging
+
+from eumetsat.pipeline.mock_api import MockApi, MockConfig
+
+flags.DEFINE_string("st", default="2020-01-01", help="Start Date")
+flags.DEFINE_string("et", default="2020-01-02", help="End Date")
+flags.DEFINE_multi_integer("mins", default=[0], help="Minutes of hour to download, any combination of 0, 15, 30, 45")
+flags.DEFINE_list("sats", default=["MSG4"], help="Satellites the mock has products for")
+flags.DEFINE_float("product_mb", default=10, help="Size of the random .nat files in MB")
+flags.DEFINE_string("sample", default=None, help="Real .nat file to serve for every product")
+flags.DEFINE_float("latency", default=0, help="Seconds before each mock response")
+flags.DEFINE_float("bandwidth_mbps", default=None, help="MB/s of each transfer, none for no limit")
+flags.DEFINE_float("fail_rate", default=0, help="Fraction of transfers that fail")
+flags.DEFINE_float("throttle_rate", default=0, help="Fraction of requests answered with a 429")
+flags.DEFINE_string("work_dir", default=None, help="Scratch dir for the run, a temp dir if not set")
+flags.DEFINE_string("report", default=None, help="File to write the results to as json")
+
+FLAGS = flags.FLAGS
+
+DOWNLOAD = os.path.join(os.path.dirname(os.path.abspath(__file__)), "download.py")
+
+
+def summarise(metrics: dict, wall: float) -> dict:
+    """Reduce a metrics snapshot to the headline numbers."""
+    def counter(name, **labels):
+        return sum(c["value"] for c in metrics["counters"]
+                   if c["name"] == name and labels.items() <= c["labels"].items())
+
+    def count(name, **labels):
+        return sum(s["count"] for s in metrics["summaries"]
+                   if s["name"] == name and labels.items() <= s["labels"].items())
+
+    downloaded = count("download_seconds")
+    extracted = count("extract_seconds", stage="save")
+    return {
+        "wall_seconds": wall,
+        "downloaded": downloaded,
+        "extracted": extracted,
+        "downloaded_per_min": downloaded / wall * 60,
+        "extracted_per_min": extracted / wall * 60,
+        "download_bytes_per_second": counter("download_bytes") / wall,
+        "failures": {stage: counter("failures", stage=stage) for stage in ("search", "download", "extract")},
+        "throttled": counter("throttled"),
+        "latency": [{"name": s["name"], "labels": s["labels"], "count": s["count"], **s["quantiles"]}
+                    for s in metrics["summaries"]],
+    }
+
+
+def main(argv):
+    download_args = argv[1:]
+    work_dir = FLAGS.work_dir or tempfile.mkdtemp(prefix="bench_ingest_")
+    os.makedirs(work_dir, exist_ok=True)
+    config = MockConfig(sats=tuple(FLAGS.sats), product_bytes=int(FLAGS.product_mb * 1e6), sample=FLAGS.sample,
+                        latency=FLAGS.latency, fail_rate=FLAGS.fail_rate, throttle_rate=FLAGS.throttle_rate,
+                        bandwidth=FLAGS.bandwidth_mbps * 1e6 if FLAGS.bandwidth_mbps else None)
+    api = MockApi(config).start()
+    logging.info(f"Mock API on {api.url}, working in {work_dir}")
+
+    key_path = os.path.join(work_dir, "eumetsat.key")
+    with open(key_path, "w") as f:
+        json.dump({"username": "bench", "password": "bench"}, f)
+    metrics_path = os.path.join(work_dir, "metrics.json")
+    cmd = [sys.executable, DOWNLOAD, f"--api_base={api.url}", f"--key_path={key_path}",
+           f"--st={FLAGS.st}", f"--et={FLAGS.et}", *[f"--mins={m}" for m in FLAGS.mins],
+           f"--dl_base_path={os.path.join(work_dir, 'shm')}", f"--ext_base_path={os.path.join(work_dir, 'ext')}",
+           f"--metrics_path={metrics_path}", "--metrics_interval=5", "--sink=null", "--catalogue",
+           "--nosearch_cache", *download_args]
+    logging.info(" ".join(cmd))
+
+    start = time.monotonic()
+    try:
+        subprocess.run(cmd, check=True)
+    finally:
+        wall = time.monotonic() - start
+        api.stop()
+
+    with open(metrics_path) as f:
+        results = summarise(json.load(f), wall)
+    results["requests"] = api.requests
+
+    logging.info(f"{results['downloaded']} downloaded, {results['extracted']} extracted in {wall:.1f}s")
+    logging.info(f"{results['downloaded_per_min']:.1f} downloads/min, {results['extracted_per_min']:.1f} extracts/min, "
+                 f"{results['download_bytes_per_second'] / 1e6:.1f} MB/s")
+    logging.info(f"Failures {results['failures']}, throttled {results['throttled']:.0f}, requests {api.requests}")
+    for s in sorted(results["latency"], key=lambda s: (s["name"], sorted(s["labels"].items()))):
+        labels = ",".join(f"{k}={v}" for k, v in sorted(s["labels"].items()))
+        logging.info(f"{s['name']:>28} {labels:<24} n={s['count']:<5} "
+                     f"p50={s['0.5']:.3g} p90={s['0.9']:.3g} p99={s['0.99']:.3g}")
+
+    if FLAGS.report:
+        with open(FLAGS.report, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -1,23 +1,47 @@
+import asyncio
 import json
 import os
-import random
+import queue
 import re
 import shutil
+import socket
+import threading
 import time
 import zipfile
+from contextlib import ExitStack
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from functools import reduce
 from multiprocessing import Process, JoinableQueue
+from typing import Callable, Optional
 
+import aiohttp
+import dask
+import numpy as np
 import pandas as pd
 import requests
+import tensorstore
 from absl import flags, app, logging
 from hemera.standard_logger import build_logger
 from satpy import Scene
+from satpy.writers import get_enhanced_image
 
 import eumetsat.utils
-
+from eumetsat.datasets.utils import FileNameProps, get_n5_spec
+from eumetsat.pipeline.catalogue import SLOT_SECONDS, Catalogue, gap_ranges, slot_index
+from eumetsat.pipeline import journal as J
+from eumetsat.pipeline.journal import Journal, JournalReader
+from eumetsat.pipeline.leases import Lease, Leases, split_range
+from eumetsat.pipeline.metrics import Metrics, MetricsReporter
+from eumetsat.pipeline.ratelimit import TOO_MANY_REQUESTS, RateLimiter, retry_after
+from eumetsat.pipeline.resample import ResampleCache, crop_scene
+from eumetsat.pipeline.scheduler import Scheduler, WorkerPool
+from eumetsat.pipeline.search import ProductSearch, SearchCache, SearchError, product_sat, select_products
+from eumetsat.pipeline.transfer import DownloadError, Transfer, backoff, download_async
+from eumetsat.pipeline.zip_source import nat_source
+
+flags.DEFINE_string("api_base", default="https://api.eumetsat.int", help="Base URL of the EUMETSAT API")
+flags.DEFINE_string("key_path", default="./eumetsat.key", help="Json file with the API username and password")
 flags.DEFINE_integer('dl', default=1, help="Number of download procs to run")
 flags.DEFINE_integer('ep', default=1, help="Number of extractor procs to run")
 flags.DEFINE_string('st', default="2020-01-01", help="Start Date")
@@ -26,6 +50,48 @@ flags.DEFINE_string("dl_base_path", default="/dev/shm", help="Temp download path
 flags.DEFINE_string("ext_base_path", default=".", help="Path to save extracted files")
 flags.DEFINE_multi_integer("mins", default=[0], help="Minutes of hour to download, any combination of 0, 15, 30, 45")
 flags.DEFINE_integer("chunk_size", default=1024, help="Download chunk size in Kb")
+flags.DEFINE_boolean("async_dl", default=False, help="Use asyncio download procs, each running many concurrent transfers")
+flags.DEFINE_integer("inflight", default=4, help="Max concurrent transfers per async download proc")
+flags.DEFINE_integer("retries", default=5, help="Number of times to retry (resume) a failed download")
+flags.DEFINE_float("backoff", default=5, help="Base retry backoff in seconds, doubled on each retry")
+flags.DEFINE_integer("extract_batch", default=1, help="Max products each extractor takes off the queue and computes "
+                                                       "in one dask pass")
+flags.DEFINE_integer("dask_threads", default=None, help="Dask threads per extractor, defaults to one per core")
+flags.DEFINE_boolean("zip_in_place", default=False, help="Read the .nat file from the zip rather than unzipping it")
+flags.DEFINE_boolean("catalogue", default=False, help="Use the extracted slot catalogue to find gaps rather than the filesystem")
+flags.DEFINE_boolean("catalogue_scan", default=False, help="Add existing pngs in the date range to the catalogue before starting")
+flags.DEFINE_boolean("crop", default=False, help="Crop the scene to the area before it is calibrated and resampled, "
+                                                   "full disk HRV is on a stacked area and is not cropped")
+flags.DEFINE_float("crop_margin", default=1., help="Degrees of margin to keep around the area when cropping")
+flags.DEFINE_enum("sink", default="png", enum_values=["png", "tensorstore", "null"],
+                  help="Write extracted images as pngs, straight into the TensorStore at ts_path, "
+                       "or not at all (for benchmarking)")
+flags.DEFINE_string("ts_path", default=None, help="Path of the TensorStore to write to, named as per FileNameProps")
+flags.DEFINE_string("resample_cache", default="EUMETSAT/RESAMPLE_CACHE",
+                    help="Dir, relative to ext_base_path, to cache resampling coefficients in. Empty to disable")
+flags.DEFINE_string("metrics_path", default=None, help="File to write pipeline metrics snapshots to, none to disable")
+flags.DEFINE_enum("metrics_format", default="json", enum_values=["json", "prom"], help="Metrics snapshot format")
+flags.DEFINE_float("metrics_interval", default=30, help="Seconds between metrics snapshots")
+flags.DEFINE_list("sat_pref", default=["MSG4", "MSG3"],
+                  help="Satellites to download from, most preferred first, only one product is downloaded per slot")
+flags.DEFINE_float("rps", default=None, help="Max requests per second to the API, over all procs, none for no limit")
+flags.DEFINE_integer("max_transfers", default=None, help="Max concurrent downloads, over all procs, none for no limit")
+flags.DEFINE_integer("search_workers", default=8, help="Max concurrent search requests")
+flags.DEFINE_boolean("search_cache", default=True, help="Cache search results on disk, and reuse them on later runs")
+flags.DEFINE_float("search_ttl", default=1, help="Hours a cached search is used for, searches of a range made "
+                                                 "two days after it ended are used for good")
+flags.DEFINE_boolean("journal", default=False, help="Keep a journal of product states, and on start resume what it has unfinished")
+flags.DEFINE_boolean("distributed", default=False, help="Share the date range with the other nodes running on the "
+                                                        "same ext_base_path, by leasing it a day at a time")
+flags.DEFINE_float("lease_ttl", default=60, help="Minutes a day lease lasts if its node stops renewing it")
+flags.DEFINE_integer("leases_in_flight", default=2, help="Days each node has in the pipeline at once when distributed")
+flags.DEFINE_boolean("schedule", default=False, help="Resize the download and extract pools from the queue back pressure")
+flags.DEFINE_integer("dl_min", default=1, help="Min number of download procs when scheduling")
+flags.DEFINE_integer("dl_max", default=None, help="Max number of download procs when scheduling, defaults to --dl")
+flags.DEFINE_integer("ep_min", default=1, help="Min number of extractor procs when scheduling")
+flags.DEFINE_integer("ep_max", default=None, help="Max number of extractor procs when scheduling, defaults to --ep")
+flags.DEFINE_float("schedule_interval", default=60, help="Seconds between scheduler checks")
+flags.DEFINE_float("shm_min_free", default=2, help="Min free GB on the download path before the scheduler sees it as full")
 
 FLAGS = flags.FLAGS
 
@@ -56,12 +122,47 @@ def get_data_path():
     return os.path.join(FLAGS.ext_base_path, "EUMETSAT/UK-EXT")
 
 
+def get_catalogue_path():
+    return os.path.join(get_data_path(), "catalogue.sqlite")
+
+
+def get_node_suffix():
+    """Suffix for the files each node keeps to its self when distributed, sqlite and appends are not safe
+    to share over a network filesystem."""
+    return f"-{socket.gethostname()}" if FLAGS.distributed else ""
+
+
+def get_search_cache_path():
+    return os.path.join(get_data_path(), f"search{get_node_suffix()}.sqlite")
+
+
+def get_journal_path():
+    return os.path.join(get_data_path(), f"journal{get_node_suffix()}.jsonl")
+
+
+def get_lease_path():
+    return os.path.join(get_data_path(), "leases")
+
+
+def get_resample_cache_path():
+    return os.path.join(FLAGS.ext_base_path, FLAGS.resample_cache) if FLAGS.resample_cache else None
+
+
 @dataclass
 class EumetsatToken:
-    def __init__(self, key_path: str = "./eumetsat.key"):
+    def __init__(self, key_path: str = "./eumetsat.key", metrics: Metrics = None):
         with open(key_path, "r") as f:
             self._key = json.load(f)
         self._last_load = datetime(2017, 5, 1, 0, 0, 0)
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != "_lock"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
 
     @property
     def token(self) -> str:
@@ -69,14 +170,18 @@ class EumetsatToken:
 
     @token.getter
     def token(self) -> str:
-        if (self._last_load - datetime.utcnow()) < timedelta(minutes=50):
-            self._last_load = datetime.utcnow()
-            self._token = self._load_token()
+        if (datetime.utcnow() - self._last_load) > timedelta(minutes=50):
+            # Async transfers read it from many executor threads, only one of them refreshes it
+            with self._lock:
+                if (datetime.utcnow() - self._last_load) > timedelta(minutes=50):
+                    self._token = self._load_token()
+                    self._last_load = datetime.utcnow()
         return self._token
 
     def _load_token(self) -> str:
-        token = requests.post("https://api.eumetsat.int/token", data="grant_type=client_credentials",
+        token = requests.post(f"{FLAGS.api_base}/token", data="grant_type=client_credentials",
                               auth=(self._key["username"], self._key["password"]))
+        self.metrics.inc("token_refreshes")
         return token.json()["access_token"]
 
 
@@ -94,70 +199,208 @@ def ok_hour(date):
 
 
 class Extract(Process):
-    def __init__(self, files: JoinableQueue):
+    def __init__(self, files: JoinableQueue, catalogue: Optional[Catalogue] = None, metrics: Metrics = None,
+                 journal: Journal = None):
         Process.__init__(self)
         self.files = files
+        self.catalogue = catalogue
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.journal = journal if journal is not None else Journal(None)
+        self.resampler = ResampleCache(get_resample_cache_path())
+        self.store = None
 
     def run(self):
+        if FLAGS.dask_threads:
+            # Keep the threads of all the extractors within the cores
+            dask.config.set(scheduler="threads", num_workers=FLAGS.dask_threads)
         running = True
         while running:
-            next_task = self.files.get()
-            if next_task is None:
+            paths, running = self.next_batch()
+            if paths:
+                start_time = time.monotonic()
+                self.extract(paths)
+                duration = time.monotonic() - start_time
+                logging.info(f"Extract of {len(paths)} took {duration:3.0f}s")
+                [self.files.task_done() for _ in paths]
+            if not running:
                 logging.info('Tasks Complete')
                 self.files.task_done()
+
+    def next_batch(self) -> tuple[list[str], bool]:
+        """Take up to `--extract_batch` files off the queue, only waiting for the first one.
+
+        Returns:
+            The files, and False if a stop was taken off the queue
+        """
+        paths = []
+        next_task = self.files.get()
+        while next_task is not None:
+            paths.append(next_task)
+            if len(paths) >= FLAGS.extract_batch:
                 break
-            path = next_task
-            start_time = time.monotonic()
-            self.make_pngs(path)
-            duration = time.monotonic() - start_time
-            logging.info(f"Extract took {duration:3.0f}s")
-            self.files.task_done()
+            try:
+                next_task = self.files.get_nowait()
+            except queue.Empty:
+                break
+        return paths, next_task is not None
+
+    def extract(self, zip_paths: list[str]) -> list[bool]:
+        """Extract a batch of products, computing all of them in one dask pass.
 
-    def make_pngs(self, zip_path):
+        A product that fails only drops its self from the batch.
+
+        Returns:
+            If each product was extracted
+        """
         self.logger = build_logger("Extractor")
-        ret = True
+        scenes = {}
+        ok = {zip_path: False for zip_path in zip_paths}
+        try:
+            for zip_path in zip_paths:
+                self.journal.record(J.EXTRACTING, path=zip_path)
+                try:
+                    scenes[zip_path] = self.load(zip_path)
+                except Exception as e:
+                    self.failed(zip_path, e)
+
+            start_time = time.monotonic()
+            # Reading and calibrating happen here too, when the lazy data is computed
+            computed = self.compute(scenes)
+            for _ in computed:
+                self.metrics.observe("extract_seconds", (time.monotonic() - start_time) / len(computed),
+                                     stage="resample")
+
+            for zip_path, res in computed.items():
+                try:
+                    with self.metrics.timer("extract_seconds", stage="save"):
+                        written = self.save(res)
+                    if not written:
+                        self.metrics.inc("skipped", stage="save")
+                        self.journal.record(J.FAILED, path=zip_path, stage="save")
+                        continue
+                    # The null sink keeps nothing, so nothing is marked as done and a later run does it again
+                    if FLAGS.sink != "null":
+                        if self.catalogue is not None:
+                            self.catalogue.mark(res.start_time,
+                                                [d["name"] for d in res.keys() if d["name"] in IMG_LAYERS],
+                                                sat=os.path.basename(zip_path)[:4])
+                        self.journal.record(J.DONE, path=zip_path)
+                    ok[zip_path] = True
+                except Exception as e:
+                    self.failed(zip_path, e)
+        finally:
+            # Delete Zip and Nat file, keep disk space free as they are big
+            for zip_path in zip_paths:
+                zip_folder = os.path.dirname(zip_path)
+                logging.info(f"Removing {zip_folder}")
+                shutil.rmtree(zip_folder, ignore_errors=True)
+        return [ok[zip_path] for zip_path in zip_paths]
+
+    def failed(self, zip_path: str, e: Exception):
+        logging.error(f"Extract of {zip_path} failed: {e}")
+        self.metrics.inc("failures", stage="extract")
+        self.journal.record(J.FAILED, path=zip_path, stage="extract")
+
+    def load(self, zip_path: str) -> Scene:
+        """Open a product and set up its lazy resample."""
         zip_file = os.path.basename(zip_path)
         zip_folder = os.path.dirname(zip_path)
         file_name = zip_file.replace(".zip", ".nat")
-        try:
-            logging.info(f"Unzipping {zip_path}")
-            path = zipfile.ZipFile(zip_path).extract(file_name, path=zip_folder)
+        with self.metrics.timer("extract_seconds", stage="unzip"):
+            if FLAGS.zip_in_place:
+                logging.info(f"Reading {zip_path} in place")
+                path = nat_source(zip_path)
+            else:
+                logging.info(f"Unzipping {zip_path}")
+                path = zipfile.ZipFile(zip_path).extract(file_name, path=zip_folder)
+        with self.metrics.timer("extract_seconds", stage="load"):
             self.logger.info(f"Loading {path}")
             scn = Scene(filenames={READER: [path]})
             scn.load(scn.all_dataset_names())  # Load all the data inc HRV
-            res = scn.resample(area_def, resampler="bilinear")  # cache_dir='/resample_cache/'
+            if FLAGS.crop:
+                # Data is loaded lazily, so only the rows and cols around the area get read and calibrated
+                scn = crop_scene(scn, eumetsat.utils.get_ll_bbox(FLAGS.crop_margin))
+            return self.resampler.resample(scn, area_def)
+
+    def compute(self, scenes: dict[str, Scene]) -> dict[str, Scene]:
+        """Compute the scenes together, falling back to one at a time to find any that fail."""
+        try:
+            return dict(zip(scenes, compute_scenes(list(scenes.values()))))
+        except Exception as e:
+            if len(scenes) == 1:
+                self.failed(next(iter(scenes)), e)
+                return {}
+        computed = {}
+        for zip_path, scn in scenes.items():
+            try:
+                computed[zip_path] = compute_scenes([scn])[0]
+            except Exception as e:
+                self.failed(zip_path, e)
+        return computed
+
+    def save(self, res: Scene) -> bool:
+        """Save a resampled scene to the sink, returns False if it was skipped."""
+        if FLAGS.sink == "tensorstore":
+            return self.write_frame(res)
+        elif FLAGS.sink == "png":
             res.save_datasets(writer="simple_image",
                               filename="{start_time:year=%Y/month=%m/day=%d/time=%H_%M}/format={name}/img.png",
                               format="png", base_dir=get_data_path())
+        return True
 
-        except Exception as e:
-            logging.error(e)
-            ret = False
-        finally:
-            # Delete Zip and Nat file, keep disk space free as they are big
-            logging.info(f"Removing {zip_folder}")
-            shutil.rmtree(zip_folder)
-            return ret
+    def write_frame(self, res: Scene) -> bool:
+        """Write the resampled scene into the TensorStore at the index of its slot.
 
+        The file kvstore does conditional (generation checked) writes, so procs writing different timestamps
+        in the same chunk don't clobber each other.
+
+        Returns:
+            False if the slot is not in the store, so nothing was written
+        """
+        props = FileNameProps.from_str(os.path.basename(FLAGS.ts_path))
+        if self.store is None:
+            self.store = tensorstore.open({'driver': 'n5', 'kvstore': {'driver': 'file', 'path': FLAGS.ts_path}},
+                                          open=True, write=True).result()
+        ts = int(slot_index(res.start_time)) * SLOT_SECONDS
+        idx = props.timestamp_to_idx(ts)
+        if (ts - props.zero_timestamp) % props.freq != 0 or not 0 <= idx < self.store.shape[0]:
+            logging.info(f"Skipping {res.start_time}, not in {FLAGS.ts_path}")
+            return False
+        self.store[idx].write(scene_frame(res)).result()
+        return True
 
-class Gen(Process):
-    # API base endpoint
-    apis_endpoint = "https://api.eumetsat.int/data/search-products/os"
 
-    def __init__(self, task_queue: JoinableQueue, collection_id, start: datetime, end: datetime):
+class Gen(Process):
+    def __init__(self, task_queue: JoinableQueue, collection_id, start: datetime, end: datetime,
+                 catalogue: Optional[Catalogue] = None, metrics: Metrics = None, journal: Journal = None,
+                 known: Optional[set[str]] = None, limiter: RateLimiter = None):
         Process.__init__(self)
         self.task_queue = task_queue
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.journal = journal if journal is not None else Journal(None)
+        self.known = known or set()  # Ids of products already in the journal
         self.items_per_page = 100
         self.collection_id = collection_id
+        self.apis_endpoint = f"{FLAGS.api_base}/data/search-products/os"
+        cache = None
+        if FLAGS.search_cache:
+            cache = SearchCache(get_search_cache_path(), ttl=timedelta(hours=FLAGS.search_ttl))
+        self.search = ProductSearch(self.apis_endpoint, collection_id, self.items_per_page, FLAGS.search_workers,
+                                    cache=cache, metrics=self.metrics, limiter=limiter)
         self.min_date = start
         self.max_date = end
+        self.catalogue = catalogue
         logging.info(f"Find gaps in Gen for {self.min_date} to {self.max_date}")
-        self.gaps = self.find_gaps
+        self.gaps = self.find_gaps if catalogue is None else self.find_catalogue_gaps
         # logging.info(f"gaps {self.gaps}")
+        self.products = []  # Ids of the products found for the gaps, inc those already in the journal
+        self.failed = []  # Search windows that failed, their products are not in `products`
+        self.searched = False  # All the gaps were searched
 
     def run(self):
         try:
             self.loop()
+            self.searched = not self.failed
         except Exception as e:
             logging.error(e)
         finally:
@@ -174,8 +417,8 @@ class Gen(Process):
         misssing = []
         search = []
 
-        _months = pd.date_range(self.min_date, self.max_date, freq="MS")
-        _months = zip(_months[:-1], _months[1:])
+        # Ranges are clipped to the dates, so partial months (e.g. a day unit of a distributed run) are searched too
+        _months = split_range(self.min_date, self.max_date, "MS")
         months = {ts.strftime("year=%Y/month=%m"): (ts, te) for ts, te in _months}
         for mp, tr in months.items():
             time_root = os.path.join(get_data_path(), mp)
@@ -186,8 +429,7 @@ class Gen(Process):
                 misssing.append(tr)
 
         # Days
-        _days = [pd.date_range(x[0], x[1], freq="D") for x in search]
-        _days = [list(zip(dr[:-1], dr[1:])) for dr in _days]
+        _days = [split_range(x[0], x[1], "D") for x in search]
         _days = reduce(lambda a, b: a + b, _days, [])
         days = {ts.strftime("year=%Y/month=%m/day=%d"): (ts, te) for ts, te in _days}
         search = []
@@ -200,8 +442,7 @@ class Gen(Process):
                 misssing.append(tr)
 
         # Time and Layer check
-        _time_feat = [pd.date_range(x[0], x[1], freq="15min") for x in search]
-        _time_feat = [list(zip(dr[:-1], dr[1:])) for dr in _time_feat]
+        _time_feat = [split_range(x[0], x[1], "15min") for x in search]
         _time_feat = reduce(lambda a, b: a + b, _time_feat, [])
         time_feat = {ts.strftime(f"year=%Y/month=%m/day=%d/time=%H_%M"): (ts, te) for ts, te in _time_feat if
                      ok_hour(ts)}
@@ -214,62 +455,63 @@ class Gen(Process):
                     yield tr
                     break
 
+    def slot_times(self) -> pd.DatetimeIndex:
+        """Start times of all the 15 min slots we want in the date range."""
+        times = pd.date_range(self.min_date, self.max_date, freq="15min", inclusive="left")
+        return times[np.isin(times.minute, FLAGS.mins)]
+
+    def find_catalogue_gaps(self):
+        """
+        Find the gaps using the catalogue, yielding a range to download.
+        Runs of missing slots are merged into a single range, up to a month long.
+        """
+        times = self.slot_times()
+        missing = self.catalogue.missing(times)
+        logging.info(f"Catalogue missing {missing.sum()} of {len(times)} slots")
+        yield from gap_ranges(times, missing)
+
     @staticmethod
     def ft(x):
         ds = x["properties"]["date"].split("/")[0]
         date = parse_date(ds)
-        sat_ok = x["id"][:4] in ["MSG3", "MSG4"]
-        return ok_hour(date) and sat_ok
+        return ok_hour(date)
 
     def loop(self):
         for range in self.gaps():
             logging.info(f"{range}")
-            batch_uf = self.get_unfiltered_range(*range)
-            batch = filter(self.ft, batch_uf)
+            try:
+                batch_uf = self.get_unfiltered_range(*range)
+            except SearchError as e:
+                # Still queue what was found, but the range isn't complete so can't be settled
+                logging.error(e)
+                self.failed.extend(e.failed)
+                batch_uf = e.products
+            batch = list(filter(self.ft, select_products(batch_uf, FLAGS.sat_pref)))
+            self.products.extend(el["id"] for el in batch)
+            batch = filter(lambda x: x["id"] not in self.known, batch)
             # put files on queue
             for el in batch:
                 ds = el["properties"]["date"].split("/")[0]
                 date = parse_date(ds)
-                logging.info(
-                    f"Adding File {date.strftime('year=%Y/month=%m/day=%d/time=%H_%M')} to DL Queue")
-                # Stagger when we add a new download so there is a bit of an offset
-                if FLAGS.dl > 1:
-                    time.sleep(random.randint(3, 15))
+                logging.info(f"Adding File {date.strftime('year=%Y/month=%m/day=%d/time=%H_%M')} "
+                             f"from {product_sat(el)} to DL Queue")
+                self.journal.record(J.SEARCHED, el["id"], product=el, sat=product_sat(el))
                 self.task_queue.put(el)
 
     def get_unfiltered_range(self, start_ts: datetime, end_ts: datetime):
-        parameters = {'format': 'json',
-                      'pi': self.collection_id,
-                      "c": self.items_per_page,
-                      "si": 0,
-                      'dtstart': start_ts.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
-                      'dtend': end_ts.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-                      }
-
-        feats = []
-        total = 1
-        while parameters["si"] < total:
-            response = requests.get(self.apis_endpoint, parameters)
-            # Log Failed responses
-            if not response.ok:
-                logging.error(f"Request for {parameters} Failed: {response.text}")
-                break
-            found_data_sets = response.json()
-            feats.extend(found_data_sets["features"])
-            total = found_data_sets.get('totalResults', None)
-            total = total if total is not None else found_data_sets["properties"].get('totalResults', None)
-            if total is None:
-                logging.error("Total Results Key missing")
-            parameters["si"] += self.items_per_page
-        return feats
+        return self.search.search(start_ts, end_ts)
 
 
 class Downloader(Process):
-    def __init__(self, task_queue: JoinableQueue, file_queue: JoinableQueue, t: EumetsatToken):
+    def __init__(self, task_queue: JoinableQueue, file_queue: JoinableQueue, t: EumetsatToken, metrics: Metrics = None,
+                 journal: Journal = None, limiter: RateLimiter = None):
         Process.__init__(self)
         self.task_queue = task_queue
         self.file_queue = file_queue
         self.t = t
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.journal = journal if journal is not None else Journal(None)
+        self.limiter = limiter if limiter is not None else RateLimiter()
 
     def run(self):
         running = True
@@ -283,78 +525,391 @@ class Downloader(Process):
                     running = False
                     break
                 start_time = time.monotonic()
+                self.journal.record(J.DOWNLOADING, next_task["id"])
                 file_path = self._run(next_task)
                 duration = time.monotonic() - start_time
                 logging.info(f"Download took {duration:3.0f}s")
+                record_download(self.metrics, self.name, file_path, duration)
+                self.journal.record(J.DOWNLOADED, next_task["id"], path=file_path)
             except Exception as e:
                 logging.error(f"Error on {next_task}")
                 logging.error(e)
+                self.metrics.inc("failures", stage="download")
+                self.journal.record(J.FAILED, next_task["id"] if next_task else None, stage="download")
             finally:
-                self.task_queue.task_done()
+                # Queue the file before marking the task done, so it is never in neither queue
                 if file_path:
                     self.file_queue.put(file_path)
+                self.task_queue.task_done()
 
     def _run(self, next_task) -> str:
-        date = parse_date(next_task["properties"]["date"].split("/")[0])
-        sip_ents = next_task['properties']['links']['sip-entries']
-        nat_file = filter(lambda x: x['mediaType'] == 'application/octet-stream', sip_ents)
-        dl_url = list(nat_file)[0]['href']
-        data_url = next_task['properties']['links']['data'][0]["href"]
-        folder = os.path.join(COLLECTION_ID.replace(":", "_"), date.strftime("year=%Y/month=%m/day=%d/time=%H_%M"))
+        data_url, folder = product_target(next_task)
         file_path = self.download(data_url, folder)
         return file_path
 
     def download(self, url, base) -> str:
-        res = requests.get(url, {"access_token": self.t.token}, stream=True)
-        res.raise_for_status()
-        filename = re.findall("\"(.*?)\"", res.headers['Content-Disposition'])[0]
-        dir = os.path.join(get_dl_path(), base)
-        os.makedirs(dir, exist_ok=True)
-        path = os.path.join(dir, filename)
-        logging.info(f"{url} -> {path}")
-        with open(path, 'wb') as f:
-            for c in res.iter_content(chunk_size=None):
-                f.write(c)
-        return path
+        with self.limiter.transfer():
+            return self._download(url, base)
+
+    def _download(self, url, base) -> str:
+        transfer = Transfer()
+        attempt = 0
+        while True:
+            try:
+                self.limiter.acquire()
+                with requests.get(url, {"access_token": self.t.token}, headers=transfer.headers(), stream=True) as res:
+                    if res.status_code == TOO_MANY_REQUESTS:
+                        throttle(self.limiter, self.metrics, res.headers, url)
+                        continue
+                    if transfer.complete(res.status_code):
+                        return transfer.finish()
+                    res.raise_for_status()
+                    path = target_path(res.headers['Content-Disposition'], base)
+                    mode = transfer.begin(res.status_code, res.headers, path)
+                    if mode is None:
+                        continue
+                    logging.info(f"{url} -> {path} from byte {transfer.offset}")
+                    with open(transfer.part, mode) as f:
+                        for c in res.iter_content(chunk_size=None):
+                            f.write(c)
+                return transfer.finish()
+            except (requests.RequestException, DownloadError) as e:
+                attempt += 1
+                if attempt > FLAGS.retries:
+                    raise
+                wait = backoff(attempt, FLAGS.backoff)
+                logging.warning(f"Download of {url} failed ({e}), retry {attempt} in {wait:.0f}s")
+                time.sleep(wait)
+
+
+class AsyncDownloader(Process):
+    """Download process running many concurrent transfers on a single asyncio loop.
+
+    All the transfers of the proc share one pooled keep-alive HTTP session, so only the first
+    request to the data endpoint pays for the TCP + TLS handshake. Each proc has its own copy of
+    the token, which is shared by its transfers and refreshed by each proc on its own.
+    """
+
+    def __init__(self, task_queue: JoinableQueue, file_queue: JoinableQueue, t: EumetsatToken, inflight: int,
+                 metrics: Metrics = None, journal: Journal = None, limiter: RateLimiter = None):
+        Process.__init__(self)
+        self.task_queue = task_queue
+        self.file_queue = file_queue
+        self.t = t
+        self.inflight = inflight
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.journal = journal if journal is not None else Journal(None)
+        self.limiter = limiter if limiter is not None else RateLimiter()
+
+    def run(self):
+        asyncio.run(self.loop())
+
+    async def loop(self):
+        loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=self.inflight)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            slots = asyncio.Semaphore(self.inflight)
+            tasks = set()
+            while True:
+                # Only take work off the queue when there is a free transfer slot
+                await slots.acquire()
+                next_task = await loop.run_in_executor(None, self.task_queue.get)
+                if next_task is None:
+                    logging.info('Tasks Complete')
+                    break
+                task = asyncio.create_task(self._run(session, next_task, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+            self.task_queue.task_done()
+
+    async def _run(self, session: aiohttp.ClientSession, next_task, slots: asyncio.Semaphore):
+        file_path = None
+        try:
+            start_time = time.monotonic()
+            self.journal.record(J.DOWNLOADING, next_task["id"])
+            data_url, folder = product_target(next_task)
+            file_path = await self.download(session, data_url, folder)
+            duration = time.monotonic() - start_time
+            logging.info(f"Download took {duration:3.0f}s")
+            record_download(self.metrics, self.name, file_path, duration)
+            self.journal.record(J.DOWNLOADED, next_task["id"], path=file_path)
+        except Exception as e:
+            logging.error(f"Error on {next_task}")
+            logging.error(e)
+            self.metrics.inc("failures", stage="download")
+            self.journal.record(J.FAILED, next_task["id"], stage="download")
+        finally:
+            loop = asyncio.get_running_loop()
+            if file_path:
+                await loop.run_in_executor(None, self.file_queue.put, file_path)
+            self.task_queue.task_done()
+            slots.release()
 
+    async def download(self, session: aiohttp.ClientSession, url, base) -> str:
+        async with self.limiter.transfer_async():
+            return await self._download(session, url, base)
+
+    async def _download(self, session: aiohttp.ClientSession, url, base) -> str:
+        loop = asyncio.get_running_loop()
+
+        async def token() -> str:
+            return await loop.run_in_executor(None, lambda: self.t.token)
+
+        return await download_async(session, url, token, lambda cd: target_path(cd, base), limiter=self.limiter,
+                                    throttle=lambda headers: throttle(self.limiter, self.metrics, headers, url),
+                                    retries=FLAGS.retries, backoff_base=FLAGS.backoff,
+                                    chunk_size=FLAGS.chunk_size * 1024)
+
+
+def throttle(limiter: RateLimiter, metrics: Metrics, headers, url: str):
+    """Hold off all requests after a 429, for as long as the API asks or `--backoff` seconds if it does not say."""
+    wait = retry_after(headers)
+    wait = wait if wait is not None else FLAGS.backoff
+    logging.warning(f"Throttled on {url}, holding off requests for {wait:.0f}s")
+    metrics.inc("throttled")
+    limiter.block(wait)
+
+
+def record_download(metrics: Metrics, proc: str, file_path: str, duration: float):
+    size = os.path.getsize(file_path)
+    metrics.inc("download_bytes", size, proc=proc)
+    metrics.observe("download_seconds", duration, proc=proc)
+    metrics.observe("download_bytes_per_second", size / max(duration, 1e-3), proc=proc)
+
+
+def compute_scenes(scenes: list[Scene]) -> list[Scene]:
+    """Compute all the lazy datasets of the scenes in one dask pass."""
+    keys = [(i, name) for i, scn in enumerate(scenes) for name in scn.keys()]
+    for (i, name), data in zip(keys, dask.persist(*[scenes[i][name] for i, name in keys])):
+        scenes[i][name] = data
+    return scenes
+
+
+def scene_frame(res: Scene) -> np.ndarray:
+    """Stack the layers of a resampled scene into a [500, 500, 12] uint8 frame, enhanced as the png writer does."""
+    layers = [get_enhanced_image(res[l]).finalize(dtype=np.uint8)[0].sel(bands="L") for l in IMG_LAYERS]
+    return np.stack(dask.compute(*[l.data for l in layers]), axis=-1)
+
+
+def product_target(next_task) -> tuple[str, str]:
+    """Get the data url and the download folder (relative to the dl path) of a product."""
+    date = parse_date(next_task["properties"]["date"].split("/")[0])
+    data_url = next_task['properties']['links']['data'][0]["href"]
+    folder = os.path.join(COLLECTION_ID.replace(":", "_"), date.strftime("year=%Y/month=%m/day=%d/time=%H_%M"))
+    return data_url, folder
+
+
+def target_path(content_disposition: str, base: str) -> str:
+    """Make the download folder and return the path to save the file named in the `Content-Disposition` header."""
+    filename = re.findall("\"(.*?)\"", content_disposition)[0]
+    dir = os.path.join(get_dl_path(), base)
+    os.makedirs(dir, exist_ok=True)
+    return os.path.join(dir, filename)
+
+
+
+def resume(journal: Journal, products: dict[str, dict], url_q: JoinableQueue, file_q: JoinableQueue):
+    """Queue the unfinished products from the journal.
+
+    Products that were downloaded and are still on disk go straight to the extractors, the rest are downloaded
+    again (resuming any `.part` file left behind).
+    """
+    pending = J.unfinished(products)
+    logging.info(f"Resuming {len(pending)} unfinished products from {journal.path}")
+    for entry in pending:
+        path = entry.get("path")
+        if entry["state"] in (J.DOWNLOADED, J.EXTRACTING) and path and os.path.exists(path):
+            file_q.put(path)
+        elif "product" in entry:
+            url_q.put(entry["product"])
+        else:
+            logging.warning(f"Can't resume {entry['id']}, no search result in the journal")
+
+
+@dataclass
+class Unit:
+    """A leased day whose products are in the pipeline."""
+    lease: Lease
+    gen: Gen
+    keep: ExitStack  # Keeps the lease renewed until the day is settled
+
+
+def start_unit(leases: Leases, lease: Lease, run_gen: Callable[[datetime, datetime], Gen]) -> Unit:
+    """Search a leased day and queue its products, the lease is renewed until the unit is settled."""
+    logging.info(f"Claimed {lease.name}")
+    keep = ExitStack()
+    keep.enter_context(leases.keep(lease))
+    try:
+        g = run_gen(lease.start.to_pydatetime(), lease.end.to_pydatetime())
+    except BaseException:
+        keep.close()
+        raise
+    return Unit(lease, g, keep)
+
+
+def settle_units(leases: Leases, journal: JournalReader, units: list[Unit], final: bool = False) -> list[Unit]:
+    """Finish the units whose products have all been through the pipeline.
+
+    A day is done once every product found for it is journalled done, slots without a product (outages) are known
+    missing so don't hold it up. A day with a failed product, or whose search failed, is released for a later run.
+
+    Args:
+        leases: leases the units are held on
+        journal: follows the journal the workers record the product states in
+        units: units in the pipeline
+        final: the queues are drained, so release any units that are still not settled
+
+    Returns:
+        The units still in the pipeline
+    """
+    products = journal.read()
+    running = []
+    for unit in units:
+        done = J.settled(unit.gen.products, products, complete=unit.gen.searched)
+        if done is None and not final:
+            running.append(unit)
+            continue
+        unit.keep.close()
+        if done:
+            logging.info(f"Finished {unit.lease.name}")
+            leases.complete(unit.lease)
+        else:
+            logging.warning(f"{unit.lease.name} has products, or a search, that failed, leaving it for a later run")
+            leases.release(unit.lease)
+    return running
+
+
+def run_units(leases: Leases, journal: Journal, start: datetime, end: datetime,
+              run_gen: Callable[[datetime, datetime], Gen], url_q: JoinableQueue, file_q: JoinableQueue):
+    """Claim and run the days of the range, keeping `--leases_in_flight` of them in the pipeline at once."""
+    states = JournalReader(journal.path)
+    units = []
+    settled_at = time.monotonic()
+    for unit in leases.units(start, end):
+        lease = leases.claim(unit)
+        if lease is None:
+            continue
+        units.append(start_unit(leases, lease, run_gen))
+        while len(units) >= FLAGS.leases_in_flight:
+            time.sleep(10)
+            running = settle_units(leases, states, units)
+            if len(running) < len(units):
+                settled_at = time.monotonic()
+            elif time.monotonic() - settled_at > FLAGS.lease_ttl * 60:
+                # A product has been lost, e.g. with a crashed proc, so drain the queues and release what is left
+                logging.warning(f"No day settled in {FLAGS.lease_ttl:.0f} minutes, draining the queues")
+                url_q.join()
+                file_q.join()
+                running = settle_units(leases, states, units, final=True)
+            units = running
+
+    # Wait for everything queued to be extracted
+    url_q.join()
+    file_q.join()
+    settle_units(leases, states, units, final=True)
 
 
 def main(argv):
+    if FLAGS.distributed and FLAGS.catalogue:
+        raise app.UsageError("--catalogue can't be shared over a network filesystem, so can't be used with "
+                             "--distributed")
+    if FLAGS.distributed and FLAGS.sink == "null":
+        raise app.UsageError("--sink null never marks a product done, so can't be used with --distributed")
+    if FLAGS.sink == "tensorstore" and not FLAGS.ts_path:
+        raise app.UsageError("--ts_path is required with --sink tensorstore")
     DL_PROCS = FLAGS.dl
     EX_PROCS = FLAGS.ep
+    # Size the queues for the biggest the pools can get
+    DL_MAX = max(FLAGS.dl_max or DL_PROCS, DL_PROCS) if FLAGS.schedule else DL_PROCS
+    EX_MAX = max(FLAGS.ep_max or EX_PROCS, EX_PROCS) if FLAGS.schedule else EX_PROCS
 
     # Define our start and end dates
     start_date = datetime.strptime(FLAGS.st, "%Y-%m-%d")
     end_date = datetime.strptime(FLAGS.et, "%Y-%m-%d")
 
-    # Queue for interprocess communication
-    url_q = JoinableQueue(DL_PROCS + int(DL_PROCS * 0.20))
-    file_q = JoinableQueue(EX_PROCS + int(EX_PROCS * 0.20) + 2)
+    # Queue for interprocess communication, async procs each have `inflight` transfers running
+    dl_slots = DL_MAX * FLAGS.inflight if FLAGS.async_dl else DL_MAX
+    url_q = JoinableQueue(dl_slots + int(dl_slots * 0.20))
+    # and extractors take up to `extract_batch` files at a time
+    file_q_size = EX_MAX * FLAGS.extract_batch + int(EX_MAX * 0.20) + 2
+    file_q = JoinableQueue(file_q_size)
 
     # TODO: use a threadpool and aync maps for this, why are we managing it ourselvs?
+    metrics = Metrics(enabled=FLAGS.metrics_path is not None)
+    # Distributed runs use the journal to tell when a day's products are all through the pipeline
+    journal = Journal(get_journal_path() if FLAGS.journal or FLAGS.distributed else None)
+    products = journal.compact() if journal.enabled else {}
+    catalogue = Catalogue(get_catalogue_path()) if FLAGS.catalogue else None
+    if catalogue is not None and FLAGS.catalogue_scan:
+        times = pd.date_range(start_date, end_date, freq="15min", inclusive="left")
+        logging.info(f"Scanning {len(times)} slots into catalogue")
+        found = catalogue.scan(get_data_path(), times)
+        logging.info(f"Found {found} extracted slots")
+
+    if FLAGS.sink == "tensorstore" and not os.path.exists(FLAGS.ts_path):
+        props = FileNameProps.from_str(os.path.basename(FLAGS.ts_path))
+        logging.info(f"Creating {FLAGS.ts_path} for {props.samples} samples")
+        tensorstore.open(get_n5_spec(FLAGS.ts_path, props.samples, props.freq, create=True)).result()
+
     logging.info("Starting Processes")
     # Start Downloader processes
-    ex = [Extract(file_q) for _ in range(EX_PROCS)]
-    [e.start() for e in ex]
-    [Downloader(url_q, file_q, EumetsatToken()).start() for _ in range(DL_PROCS)]
-
-    logging.info(f"Starting Gen for {start_date} to {end_date}")
-    # Start and join generator
-    g = Gen(url_q, COLLECTION_ID, start_date, end_date)
-    g.run()
+    ex = WorkerPool("extract", lambda: Extract(file_q, catalogue, metrics, journal), file_q,
+                    EX_PROCS, min_size=FLAGS.ep_min, max_size=EX_MAX)
+    token = EumetsatToken(FLAGS.key_path, metrics=metrics)
+    limiter = RateLimiter(FLAGS.rps, max_transfers=FLAGS.max_transfers)
+    if FLAGS.async_dl:
+        dl_factory = lambda: AsyncDownloader(url_q, file_q, token, FLAGS.inflight, metrics, journal, limiter)
+    else:
+        dl_factory = lambda: Downloader(url_q, file_q, token, metrics, journal, limiter)
+    dl = WorkerPool("download", dl_factory, url_q, DL_PROCS, min_size=FLAGS.dl_min, max_size=DL_MAX)
+
+    reporter = None
+    if metrics.enabled:
+        reporter = MetricsReporter(metrics, FLAGS.metrics_path, fmt=FLAGS.metrics_format,
+                                   interval=FLAGS.metrics_interval, queues={"url_q": url_q, "file_q": file_q})
+        reporter.start()
+
+    if FLAGS.schedule:
+        scheduler = Scheduler(dl, ex, file_q, file_q_size, shm_path=FLAGS.dl_base_path,
+                              shm_min_free=FLAGS.shm_min_free * 1e9, interval=FLAGS.schedule_interval,
+                              transfers_per_dl=FLAGS.inflight if FLAGS.async_dl else 1, reporter=reporter)
+        scheduler.start()
+
+    if journal.enabled:
+        resume(journal, products, url_q, file_q)
+
+    def run_gen(start, end) -> Gen:
+        logging.info(f"Starting Gen for {start} to {end}")
+        g = Gen(url_q, COLLECTION_ID, start, end, catalogue, metrics, journal, known=set(products), limiter=limiter)
+        g.run()
+        return g
+
+    if FLAGS.distributed:
+        leases = Leases(get_lease_path(), ttl=timedelta(minutes=FLAGS.lease_ttl))
+        run_units(leases, journal, start_date, end_date, run_gen, url_q, file_q)
+    else:
+        # Start and join generator
+        run_gen(start_date, end_date)
+    if FLAGS.schedule:
+        scheduler.stop()
 
     # Join queue and put `final` message to end downloader
     logging.info(f"Added Termination Singles to DOWNLOAD queue")
-    [url_q.put(None) for _ in range(DL_PROCS)]
+    dl.close()
     logging.info("Joining URL q")
     url_q.join()  # wait for files to download
     logging.info("URL Queue Done")
 
     logging.info(f"Added Termination Singles to Extract queue")
-    [file_q.put(None) for _ in range(EX_PROCS)]
+    ex.close()
     logging.info("Joining Extract q")
-    [e.join() for e in ex]
+    ex.join()
     logging.info("All Procs Done")
+    if reporter is not None:
+        reporter.stop()
 
 
 if __name__ == "__main__":
@@ -11,9 +11,11 @@ from rich.progress import Progress
 
 from eumetsat import IMG_LAYERS
 from eumetsat.datasets.utils import Metadata
+from eumetsat.pipeline.catalogue import Catalogue, slot_time
 from hemera import path_translator
 
 flags.DEFINE_integer("freq", default=900, help="Expected freq (in seconds) to scan for images")
+flags.DEFINE_string("catalogue", default=None, help="Name of the slot catalogue to use in place of scanning the pngs")
 
 FLAGS = flags.FLAGS
 
@@ -33,20 +35,13 @@ def min_max(path:Path, glob_pattern:str) -> (int, int):
     max_value = int(str(items[-1]).split("=")[-1])
     return min_value, max_value
 
-def main(args):
-    img_base_path = Path(path_translator.get_path("data")) / "EUMETSAT/UK-EXT"
-    out_file = img_base_path / "png_metadata.json"
-
-    freq = FLAGS.freq
-    freq_min = freq // 60
-
+def scan_missing(img_base_path: Path, freq_min: int) -> (datetime, datetime, pd.DatetimeIndex, list):
     min_year, max_year = min_max(img_base_path, "year=*")
     min_year_month = min_max(img_base_path / f"year={min_year}", "month=*")[0]
     max_year_month = min_max(img_base_path / f"year={max_year}", "month=*")[1]
 
     search_start = datetime(year=min_year, month=min_year_month, day=1)
     search_end = datetime(year=max_year + max_year_month//12, month=(max_year_month + 1)%12 , day=1)  # Funcky maths to go to the start of the next month
-    pd.date_range(search_start, search_end)
     search_range = pd.date_range(search_start, search_end, freq=f"{freq_min}min", inclusive="left")
 
     logging.info("Scanning now... from %d to %d", min_year, max_year)
@@ -59,7 +54,40 @@ def main(args):
             ok = datepath_ok(test_path)
             if not ok:
                 missing.append(d)
+    return search_start, search_end, search_range, missing
+
+
+def catalogue_missing(catalogue: Catalogue, freq_min: int) -> (datetime, datetime, pd.DatetimeIndex, list):
+    complete = catalogue.complete()
+    if len(complete) == 0:
+        logging.warning("No complete slots in the catalogue %s", catalogue.path)
+        return None, None, pd.DatetimeIndex([]), []
+    first, last = slot_time(complete[[0, -1]])
+    search_start = datetime(year=first.year, month=first.month, day=1)
+    search_end = datetime(year=last.year + last.month // 12, month=last.month % 12 + 1, day=1)
+    search_range = pd.date_range(search_start, search_end, freq=f"{freq_min}min", inclusive="left")
+
+    logging.info("Reading catalogue from %s to %s", search_start, search_end)
+    missing = list(search_range[catalogue.missing(search_range)])
+    return search_start, search_end, search_range, missing
+
+
+def main(args):
+    img_base_path = Path(path_translator.get_path("data")) / "EUMETSAT/UK-EXT"
+    out_file = img_base_path / "png_metadata.json"
+
+    freq = FLAGS.freq
+    freq_min = freq // 60
+
+    if FLAGS.catalogue:
+        catalogue = Catalogue(img_base_path / FLAGS.catalogue)
+        search_start, search_end, search_range, missing = catalogue_missing(catalogue, freq_min)
+    else:
+        search_start, search_end, search_range, missing = scan_missing(img_base_path, freq_min)
 
+    if len(search_range) == 0:
+        logging.warning("Nothing to write the metadata of")
+        return
     logging.info("missing %d of %d", len(missing), len(search_range))
     logging.info("Writing meta")
     metadata = Metadata(
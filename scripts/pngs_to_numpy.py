@@ -1,86 +1,109 @@
-import concurrent
+"""Script to convert PNG dataset to a numpy memmap file.
+
+The `.npy` is preallocated with `open_memmap` and the pngs are decoded straight into it, a window of timestamps at a
+time. Each window maps the file on its own and is flushed and unmapped, in order, once decoded, so only
+`windows_in_flight` windows are held in memory however long the date range is. Missing timestamps are never
+written, so they take no space on filesystems with sparse files and read back as zeros, use `valid_mask` of
+`EMNumpyDataset` to tell them apart.
+
+The file is named as per `FileNameProps`, e.g. `img_z=2019-01-01T00_00_00,e=2020-12-01T00_00_00,f=3600.npy`, with its
+metadata in `<name>.meta.json` next to it.
+"""
 import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
-import imageio as iio
 import numpy as np
 import pandas as pd
+import serde.json
 from absl import flags, app
 from absl import logging
 from hemera import path_translator as T
 
-from eumetsat import IMG_LAYERS
+from eumetsat.datasets.utils import FileNameProps, Metadata, load_metadata, read_png
 
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string("min_date", default="2019-01-01 00:00", help="Min date for image files")
 flags.DEFINE_string("max_date", default="2020-12-01 00:00", help="Max date for image files")
 flags.DEFINE_integer("freq", default=3600, help="Image update frequency in seconds")
+flags.DEFINE_string("png_meta", default="png_metadata.json", help="Name of the png metadata")
+flags.DEFINE_integer("threads", default=32, help="Threads decoding pngs")
+flags.DEFINE_integer("window", default=96, help="Timestamps decoded and flushed at a time")
+flags.DEFINE_integer("windows_in_flight", default=2, help="Windows being decoded at once")
 
 
 def main(args):
     min_date = datetime.fromisoformat(FLAGS.min_date)
     max_date = datetime.fromisoformat(FLAGS.max_date)
 
-    img_base_path = os.path.join(T.get_path("data"), "EUMETSAT/UK-EXT")
+    base_path = Path(T.get_path("data")) / "EUMETSAT/UK-EXT"
+    source_meta = load_metadata(base_path, FLAGS.png_meta)
+    img_base_path = source_meta.data_location
 
     freq = FLAGS.freq
     freq_min = freq // 60
 
     date_rage = pd.date_range(min_date, max_date, freq=f"{freq_min}min")
-    date_dict = {int(ts.timestamp()): ts.strftime("/year=%Y/month=%m/day=%d/time=%H_%M") for ts in date_rage}
-    ts = len(date_dict)
+    not_in_source = {d for d in date_rage if not source_meta.first_example_date <= d <= source_meta.last_example_date}
+    expected_missing = not_in_source | (set(date_rage) & source_meta.missing)
+    date_dict = {int(ts.timestamp()): ts.strftime("year=%Y/month=%m/day=%d/time=%H_%M") for ts in date_rage
+                 if ts not in expected_missing}
+    ts = len(date_rage)
 
     z = int(date_rage[0].timestamp())
 
-    out_file = os.path.join(T.get_path("data"), "EUMETSAT/UK-EXT", f"imgs_z={z},f={freq}sec")
-    img_arry = np.zeros(dtype=np.ubyte, shape=(ts, 500, 500, 12)) #np.memmap(out_file, dtype=np.ubyte, mode='w+', offset=0, shape=(ts, 500, 500, 12))
-
-    def fill_np(date_dict, array):
-        """
-        Fill the numpy array
-        """
-        def _read(kv, img_array, index):
-            k, v = kv
-            t_path = img_base_path + v
-
-            logging.log_every_n(logging.INFO, f"Reading {v}", 100)
-
-            index = (k - z) // freq
-            for i, l in enumerate(IMG_LAYERS):
-                path = t_path + f"/format={l}/img.png"
-                if not os.path.exists(path):
-                    logging.info(f"Reading {v}")
-                    return
-                with iio.imopen(path, "r") as img_file:
-                    img = img_file.read(index=0)[..., 0]
-                # imgs[:, :, i] = img
-                img_array[index, ..., i] = img
-            return
-
-        threads = 32
-
-        dates = list(date_dict.items())
-        pool = concurrent.futures.ThreadPoolExecutor(threads)
-
-        futures = {}
-        for i, kv in enumerate(dates):
-            args = (_read,
-                    kv,
-                    array,
-                    i)
-            futures[pool.submit(*args)] = i
-        concurrent.futures.wait(futures)
-
-        return
-
-    logging.info("Reading now...")
-    fill_np(date_dict, img_arry)
-    print("Start Flush")
-    # img_arry.flush()
-    np.save(out_file, img_arry)
-    print("Done Flush")
-    i = 0
+    fn = FileNameProps(time_zero=min_date, time_end=max_date, freq=freq)
+    out_file = base_path / f"{fn}.npy"
+    tmp_file = base_path / f"{fn}.partial.npy"
+    logging.info("Writing %d of %d samples (%.1f GB) to %s", len(date_dict), ts, ts * 500 * 500 * 12 / 1e9, out_file)
+    # Create the (sparse) file, each window maps it itself
+    np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.ubyte, shape=(ts, 500, 500, 12)).flush()
+
+    def _read(kv, img_array):
+        logging.log_every_n(logging.INFO, f"Reading {kv[1]}", 100)
+        try:
+            read_png(kv, img_base_path=img_base_path, img_array=img_array, z=z, freq=freq)
+        except FileNotFoundError as e:
+            logging.warning(f"File not found {kv[1]} ({e})")
+
+    def flush(window: tuple[np.memmap, list[Future]]):
+        img_array, futures = window
+        for f in futures:
+            f.result()
+        img_array.flush()
+
+    # Decode `windows_in_flight` windows at once, flushing each to disk in order
+    dates = list(date_dict.items())
+    in_flight = deque()
+    with ThreadPoolExecutor(FLAGS.threads) as pool:
+        for pos in range(0, len(dates), FLAGS.window):
+            img_array = np.lib.format.open_memmap(tmp_file, mode="r+")
+            in_flight.append((img_array, [pool.submit(_read, kv, img_array) for kv in dates[pos:pos + FLAGS.window]]))
+            while len(in_flight) >= FLAGS.windows_in_flight:
+                flush(in_flight.popleft())
+        while in_flight:
+            flush(in_flight.popleft())
+    os.replace(tmp_file, out_file)
+
+    # Create metadata file, do this last to indicate success
+    logging.info("Writing meta")
+    metadata = Metadata(
+        metadata_created=datetime.now(),
+        first_example_date=min_date,
+        last_example_date=max_date,
+        example_count=len(date_dict),
+        missing=expected_missing,
+        freq_seconds=freq,
+        data_source=Path(img_base_path),
+        data_location=out_file
+    )
+    with out_file.with_suffix(".meta.json").open("w") as f:
+        f.write(serde.json.to_json(metadata))
+    logging.info("Done")
+
 
 if __name__ == "__main__":
     app.run(main)
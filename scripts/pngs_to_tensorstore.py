@@ -2,14 +2,26 @@
 
 This script loads the PNGs and creates / updates a tensorstore dataset with them
 
+Blocks of timestamps with no pngs at all are not written, they take no space and read back as zeros (the fill
+value). Readers should use `valid_mask` of the dataset, made from the metadata, to tell missing timestamps apart.
+
 Params:
     min_date: the start date to look for pngs (will have all zeros out bounds of the pngs)
     max_date: the end data to look for pngs (will have all zeros out bounds of the pngs)
     png_meta: name of the metadata file, made by running the png_to_meta script. It gives hits for where missing files are etc.
     freq: Frequency in seconds of the images (usually 900 for 15min, or 3600 for 1 hour)
+    update: grow the existing store with the same min_date and freq up to max_date, only writing the timestamps
+        after its end and the ones it is missing that now have pngs. The store is renamed to the new range.
+    block_size, cname, clevel, shuffle: chunk layout and blosc codec of a new store (see `tune_ts_layout.py`),
+        an updated store keeps the layout it was made with
+    decode_workers: threads decoding the pngs into chunk buffers
+    chunks_in_flight: chunks being decoded at once, they are handed to the writer in order
 """
+import os
 import queue
 import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from functools import reduce
 from pathlib import Path
@@ -21,7 +33,8 @@ import tensorstore
 from absl import app, flags, logging
 from rich.progress import DownloadColumn, Progress, TimeElapsedColumn
 
-from eumetsat.datasets.utils import FileNameProps, Metadata, load_metadata, read_png
+from eumetsat.datasets.store import chunker, drop_missing_blocks, find_store, open_store, to_update
+from eumetsat.datasets.utils import FileNameProps, Metadata, get_n5_spec, load_metadata, n5_compression, read_png
 from hemera.path_translator import get_path
 from hemera.standard_logger import logging
 
@@ -30,6 +43,14 @@ flags.DEFINE_string("max_date", default="2018-01-04 23:59", help="Max date for i
 flags.DEFINE_string("png_meta", default="png_metadata.json", help="Name of the png metadata")
 flags.DEFINE_integer("freq", default=3600, help="Freq (in seconds) of the images")
 flags.DEFINE_boolean("overwrite", default=False, help="Overwrite existing file")
+flags.DEFINE_boolean("update", default=False, help="Append to / fill in the existing store with the same start and freq")
+flags.DEFINE_integer("decode_workers", default=os.cpu_count(), help="Threads decoding pngs")
+flags.DEFINE_integer("chunks_in_flight", default=2, help="Chunks decoded at once")
+flags.DEFINE_list("block_size", default=["24", "250", "250", "12"], help="Chunk shape of the store, ts,h,w,c")
+flags.DEFINE_enum("cname", default="blosclz", enum_values=["blosclz", "lz4", "lz4hc", "zstd", "zlib", "raw"],
+                  help="Blosc compressor, raw for none")
+flags.DEFINE_integer("clevel", default=9, help="Blosc compression level")
+flags.DEFINE_enum("shuffle", default="2", enum_values=["0", "1", "2"], help="Blosc shuffle, 0 none, 1 byte, 2 bit")
 FLAGS = flags.FLAGS
 END_MSG = None
 TS_BYTES = 12 * 500 * 500
@@ -41,18 +62,21 @@ class Writer(threading.Thread):
     Class to manage threaded writing and callbacks to update progress bars.
     """
     def __init__(self, write_q: queue.Queue, dataset: tensorstore.TensorStore, p_context: Progress, write_bar,
-                 copy_bar):
+                 copy_bar, free_q: queue.Queue = None):
         """Create Writer Object
 
         Args:
-            write_q: Queue to put data to be written to (tuple of [datetime, chunk_size, chunk (ndarray), slice])
+            write_q: Queue to put data to be written to (tuple of [datetime, chunk_size, chunk buffer (ndarray), slice]),
+                the first chunk_size timestamps of the buffer are written
             dataset: Tensorstore dataset
             p_context: progress bar context (rich Progress context)
             write_bar: write progress bar
             copy_bar: copy progress bar
+            free_q: Queue to hand chunk buffers back on, once tensorstore has copied them
         """
         super().__init__(daemon=True)
         self.write_q = write_q
+        self.free_q = free_q
         self.dataset = dataset
         self.pb_queue = queue.Queue()
         self.p_context = p_context
@@ -79,10 +103,12 @@ class Writer(threading.Thread):
         self.write_q.task_done()
         self.pb_queue.task_done()
 
-    def _copy_update(self, size, bar):
-        """Copy callback. Updates the progress bar."""
+    def _copy_update(self, size, bar, buf: np.ndarray):
+        """Copy callback. Updates the progress bar and frees the whole chunk buffer for reuse."""
         r_chunk_size = size * TS_BYTES
         self.update(bar, r_chunk_size)
+        if self.free_q is not None:
+            self.free_q.put(buf)
 
     def run(self):
         """Main thread for the writer
@@ -104,12 +130,15 @@ class Writer(threading.Thread):
                 self.write_q.task_done()
                 break
 
-            dt, chunk_size, chunk, sli = msg
-            logging.debug("Writing %s, %s, %s", dt, chunk.shape, id(chunk))
+            dt, chunk_size, buf, sli = msg
+            chunk = buf[:chunk_size]
+            logging.debug("Writing %s, %s, %s", dt, chunk.shape, id(buf))
 
             write_future = self.dataset[sli].write(chunk)
             self.pb_queue.put(chunk_size)
-            write_future.copy.add_done_callback(lambda x: self._copy_update(chunk_size, self.copy_bar))
+            # Hand back the whole buffer, not the (maybe short) view of it, so it can take a full chunk next time
+            write_future.copy.add_done_callback(
+                lambda x, size=chunk_size, buf=buf: self._copy_update(size, self.copy_bar, buf))
             write_future.commit.add_done_callback(self._write_update)
             writes.append(write_future)
 
@@ -121,8 +150,35 @@ class Writer(threading.Thread):
         logging.info("Reader exit, [%s, %s]", f"{self.write_q.unfinished_tasks=}", f"{self.pb_queue.unfinished_tasks=}")
 
 
-def chunker(seq, size):
-    return (seq[pos:pos + size] for pos in range(0, len(seq), size))
+def decode_chunk(pool: ThreadPoolExecutor, kvc: list[tuple[int, str]], data: np.ndarray, offset: int,
+                 img_base_path: Path, z: int, freq: int, expected_missing: set, on_done) -> list[Future]:
+    """Submit the pngs of a chunk to be decoded into its buffer.
+
+    Args:
+        pool: decode threads
+        kvc: chunk of (timestamp, path) to decode
+        data: buffer for the chunk, zeroed
+        offset: index of the first timestamp of the chunk
+        img_base_path: base path for the pngs
+        z: timestamp of the first image of the dataset
+        freq: frequency of the images in seconds
+        expected_missing: datetimes known to have no pngs, left as zeros
+        on_done: called as each timestamp is decoded
+
+    Returns:
+        A future for each timestamp
+    """
+    def decode(kv):
+        dt = datetime.utcfromtimestamp(kv[0])
+        if dt not in expected_missing:
+            try:
+                read_png(kv, img_base_path=img_base_path, img_array=data, z=z, freq=freq, offset=offset)
+            except FileNotFoundError as e:
+                logging.error(f"Tried to read {dt}.... not sure why ({e})")
+        on_done()
+        return dt
+
+    return [pool.submit(decode, kv) for kv in kvc]
 
 
 def validate_start(target_start: datetime, source_start: datetime, freq_min: int = 15) -> set[datetime]:
@@ -147,41 +203,15 @@ def validate_end(target_end: datetime, source_end: datetime, freq_min: int = 15)
 def get_spec(path: Path, samples: int, freq: int) -> dict:
     create = not path.exists() or FLAGS.overwrite
     overwrite = FLAGS.overwrite if path.exists() else False
-    return {
-        'driver': 'n5',
-        'context': {
-            "cache_pool": {"total_bytes_limit": 10_000_000},
-            "cache_pool#remote": {"total_bytes_limit": 10_000_000},
-            "data_copy_concurrency": {"limit": 8},
-            "file_io_concurrency": {"limit": 8}
-        },
-        'kvstore': {
-            'driver': 'file',
-            'path': str(path),
-        },
-        'schema': {
-            'dtype': 'uint8',
-            'domain': {
-                "rank": 4,
-                "shape": [samples, 500, 500, 12],
-                "labels": ["ts", "h", "w", "c"],
-            },
-            "dimension_units": [[freq, "s"], [13 / 500, "deg"], [17 / 500, "deg"], ""],
-        },
-        'metadata': {
-            'compression': {
-                'type': 'blosc',
-                "cname": "blosclz",
-                "clevel": 9,
-                "shuffle": 2
-            },
-            'dataType': 'uint8',
-            'blockSize': [24, 250, 250, 12],
-        },
-        "open": not overwrite,
-        "create": create,
-        "delete_existing": overwrite
-    }
+    return get_n5_spec(path, samples, freq, create=create, overwrite=overwrite,
+                       block_size=tuple(int(b) for b in FLAGS.block_size),
+                       compression=n5_compression(FLAGS.cname, FLAGS.clevel, int(FLAGS.shuffle)))
+
+
+def submit_chunk(write_q: queue.Queue, offset: int, r_chunk_size: int, buf: np.ndarray, futures: list[Future]):
+    """Wait for a chunk to be decoded into the start of its buffer and submit it to write."""
+    dt = [f.result() for f in futures][-1]
+    write_q.put((dt, r_chunk_size, buf, slice(offset, offset + r_chunk_size)))
 
 
 def main(argv):
@@ -216,8 +246,26 @@ def main(argv):
 
     # Create the tensorstore dataset (using the standard naming format)
     fn = FileNameProps(time_zero=ts_start, time_end=ts_end, freq=freq)
-    out_path = get_path("data") / f"EUMETSAT/UK-EXT/{fn}.ts.zarr"
-    dataset = tensorstore.open(get_spec(out_path, samples, freq)).result()
+    out_path = base_path / f"{fn}.ts.zarr"
+    if FLAGS.update:
+        store_path = find_store(base_path, ts_start, freq)
+        if store_path is None:
+            raise app.UsageError(f"No store starting at {ts_start} with freq {freq} to update in {base_path}")
+        store_meta = load_metadata(store_path, "img_meta.json")
+        if ts_end < store_meta.last_example_date:
+            raise app.UsageError(f"max_date is before the end of {store_path.name}, updates can only grow a store")
+        todo = to_update(target_date_range, store_meta, expected_missing)
+        date_dict = {k: v for k, v in date_dict.items() if datetime.utcfromtimestamp(k) in todo}
+        logging.info("Updating %s, %d of %d samples to write", store_path.name, len(date_dict), samples)
+        dataset = open_store(store_path, samples, freq)
+    else:
+        store_path = out_path
+        fresh = not out_path.exists() or FLAGS.overwrite
+        dataset = tensorstore.open(get_spec(out_path, samples, freq)).result()
+        if fresh:
+            date_dict = drop_missing_blocks(date_dict, expected_missing, dataset.chunk_layout.write_chunk.shape[0],
+                                            z, freq)
+            logging.info("Skipping %d samples in blocks with no pngs", samples - len(date_dict))
 
     # Set up progress bar
     p = Progress(*Progress.get_default_columns(), TimeElapsedColumn(), DownloadColumn())
@@ -227,33 +275,35 @@ def main(argv):
     write_q = queue.Queue(maxsize=2)
     p.start()
 
+    # Chunk data for reading
+    chunk_size = 24 * 4 * 4  # TODO: magic number, fix it
+    d = chunker(list(date_dict.items()), chunk_size, z, freq)
+
+    # Preallocate the chunk buffers, enough for the chunks being decoded, queued and copied by the writer
+    free_q = queue.Queue()
+    for _ in range(FLAGS.chunks_in_flight + write_q.maxsize + 1):
+        free_q.put(np.zeros((min(chunk_size, samples), 500, 500, 12), dtype=np.uint8))
+
     # Create writer object
-    writer = Writer(write_q=write_q, dataset=dataset, p_context=p, write_bar=write_bar, copy_bar=copy_bar)
+    writer = Writer(write_q=write_q, dataset=dataset, p_context=p, write_bar=write_bar, copy_bar=copy_bar,
+                    free_q=free_q)
     writer.start()
 
-    # Chunk data for reading
-    chunk_size = 24 * 4 * 4  # TODO: magic number, fix it
-    d = chunker(list(date_dict.items()), chunk_size)
-
-    # Enumerate over chunked windows of data reading them into a numpy object and added them to the write queue
-    for i, kvc in enumerate(d):
-        r_chunk_size = len(kvc)
-        data = np.zeros((r_chunk_size, 500, 500, 12), dtype=np.uint8)
-
-        # Read PNGS
-        for x, kv in enumerate(kvc):
-            dt = datetime.utcfromtimestamp(kv[0])
-            if dt not in expected_missing:
-                try:
-                    read_png(kv, img_base_path=img_base_path, img_array=data, z=z, freq=freq, offset=i * chunk_size)
-                except FileNotFoundError as e:
-                    logging.error(f"Tried to read {dt}.... not sure why ({e})")
-            p.update(read_bar, advance=1 * TS_BYTES)
-
-        # Submit chunk to write
-        s = i * chunk_size
-        e = s + r_chunk_size
-        write_q.put((dt, r_chunk_size, data, slice(s, e)))  # noqa
+    # Decode chunks in parallel, keeping `chunks_in_flight` going, and hand them to the writer in order
+    in_flight = deque()
+    with ThreadPoolExecutor(FLAGS.decode_workers) as pool:
+        for offset, kvc in d:
+            r_chunk_size = len(kvc)
+            buf = free_q.get()
+            data = buf[:r_chunk_size]
+            data[:] = 0
+            futures = decode_chunk(pool, kvc, data, offset, img_base_path, z, freq, expected_missing,
+                                   on_done=lambda: p.update(read_bar, advance=1 * TS_BYTES))
+            in_flight.append((offset, r_chunk_size, buf, futures))
+            while len(in_flight) >= FLAGS.chunks_in_flight:
+                submit_chunk(write_q, *in_flight.popleft())
+        while in_flight:
+            submit_chunk(write_q, *in_flight.popleft())
 
     # Add END_MSG and join queue
     write_q.put(END_MSG)
@@ -262,6 +312,12 @@ def main(argv):
     logging.info("Write queue exit")
     p.stop()
 
+    # Name the updated store for its new range, before its metadata is written, so a store is only ever named
+    # for a range that has been written to it
+    if store_path != out_path:
+        logging.info("Renaming %s to %s", store_path.name, out_path.name)
+        os.rename(store_path, out_path)
+
     # Create metadata file, do this last to indicate sucess
     logging.info("Writing meta")
     metadata = Metadata(
@@ -1,7 +1,24 @@
+"""Script to convert PNG dataset to a tf.data dataset.
+
+Params:
+    export: `save` to `Dataset.save` the dataset from a single generator, or `tfrecord` to write a TFRecord shard for
+        each month of the range in parallel worker processes
+    workers: worker processes for the tfrecord export, each decodes and writes a whole shard
+    codec: compression of the tfrecord shards
+
+The tfrecord export is a dir named as per `FileNameProps` with, for each month, `shard=YYYY-MM.tfrecord` holding an
+example (`ts` int64, `image` raw uint8 bytes) for each valid timestamp and `shard=YYYY-MM.index.json` giving every
+timestamp of the month, whether it is valid (has an example) and the codec. `eumetsat.datasets.tfrecords.load_records`
+reads the shards back interleaved in parallel.
+"""
 import concurrent
+import json
+import multiprocessing
 import os
 import os.path
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from pathlib import Path
 
 import imageio.v3 as iio
 import numpy as np
@@ -12,11 +29,19 @@ tf.config.set_visible_devices([], "GPU")
 from eumetsat import IMG_LAYERS
 from absl import flags, app, logging
 from hemera.path_translator import get_path
+from eumetsat.datasets.tfrecords import load_records, serialize_example
+from eumetsat.datasets.utils import FileNameProps, Metadata, load_metadata, read_png
+
+CODECS = {"none": "", "gzip": "GZIP", "zlib": "ZLIB"}  # tfrecord compression types
 
 flags.DEFINE_string("min_date", default="2018-01-01 00:00", help="Min date for image files")
 flags.DEFINE_string("max_date", default="2018-01-03 00:00", help="Max date for image files")
 flags.DEFINE_integer("freq", default=900, help="Numpy data blob")
 flags.DEFINE_boolean("save", default=True, help="Save the dataset")
+flags.DEFINE_string("png_meta", default="png_metadata.json", help="Name of the png metadata, gives the missing images")
+flags.DEFINE_enum("export", default="save", enum_values=["save", "tfrecord"], help="How to write the dataset")
+flags.DEFINE_integer("workers", default=os.cpu_count(), help="Worker processes writing tfrecord shards")
+flags.DEFINE_enum("codec", default="gzip", enum_values=list(CODECS), help="Compression of the tfrecord shards")
 
 FLAGS = flags.FLAGS
 
@@ -75,10 +100,85 @@ def read(min_date, max_date):
     return img_arry
 
 
+def write_shard(path: Path, times: list[int], valid: list[bool], img_base_path: Path, codec: str) -> dict:
+    """Decode and write the valid timestamps of a shard, then its index. Runs in a worker process.
+
+    Args:
+        path: path of the shard, without the extension
+        times: unix timestamps of the shard
+        valid: whether each timestamp has pngs, from the metadata
+        img_base_path: base path for the pngs
+        codec: tfrecord compression type
+
+    Returns:
+        The index of the shard
+    """
+    valid = list(valid)
+    tmp_path = path.with_name(f"{path.name}.tfrecord.partial")
+    with tf.io.TFRecordWriter(str(tmp_path), options=tf.io.TFRecordOptions(compression_type=codec)) as writer:
+        for i, ts in enumerate(times):
+            if not valid[i]:
+                continue
+            dt = datetime.utcfromtimestamp(ts)
+            try:
+                img = read_png((ts, dt.strftime("year=%Y/month=%m/day=%d/time=%H_%M")), img_base_path=img_base_path)
+            except FileNotFoundError as e:
+                logging.warning(f"File not found {dt} ({e})")
+                valid[i] = False
+                continue
+            writer.write(serialize_example(ts, img[0]))
+    os.replace(tmp_path, path.with_name(f"{path.name}.tfrecord"))
+
+    index = {"shard": f"{path.name}.tfrecord", "codec": codec, "timestamps": list(times), "valid": valid,
+             "records": sum(valid)}
+    with path.with_name(f"{path.name}.index.json").open("w") as f:
+        json.dump(index, f)
+    return index
+
+
+def export_records(out_path: Path, ts_start: datetime, ts_end: datetime, freq: int, source_meta: Metadata, img_base_path: Path,
+                   workers: int, codec: str) -> list[dict]:
+    """Write a tfrecord shard for each month of the range, in parallel.
+
+    Returns:
+        The indexes of the shards
+    """
+    times = pd.date_range(ts_start, ts_end, freq=f"{freq}s")
+    valid = source_meta.validity_mask(ts_start, ts_end, freq)
+    out_path.mkdir(parents=True, exist_ok=True)
+    # Spawn, TensorFlow isn't fork safe
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        months = times.to_period("M")
+        for month in months.unique():
+            in_month = months == month
+            shard_times = [int(ts.timestamp()) for ts in times[in_month]]
+            futures.append(pool.submit(write_shard, out_path / f"shard={month}", shard_times, valid[in_month].tolist(),
+                                       img_base_path, codec))
+        indexes = []
+        for f in futures:
+            index = f.result()
+            logging.info(f"Wrote {index['shard']}, {index['records']} of {len(index['timestamps'])} timestamps")
+            indexes.append(index)
+    return indexes
+
+
 def main(args):
     ts_start = datetime.fromisoformat(FLAGS.min_date)
     ts_end = datetime.fromisoformat(FLAGS.max_date)
-
+    source_meta = load_metadata(Path(get_path("data")) / "EUMETSAT/UK-EXT", FLAGS.png_meta)
+
+    if FLAGS.export == "tfrecord":
+        fn = FileNameProps(time_zero=ts_start, time_end=ts_end, freq=FLAGS.freq)
+        out_path = Path(get_path("data")) / "EUMETSAT/UK-EXT" / f"{fn}.tfrecords"
+        indexes = export_records(out_path, ts_start, ts_end, FLAGS.freq, source_meta, source_meta.data_location,
+                                 FLAGS.workers, CODECS[FLAGS.codec])
+        logging.info(f"Wrote {sum(i['records'] for i in indexes)} records in {len(indexes)} shards to {out_path}")
+
+        # Window read back in
+        res = list(load_records(out_path, window=3).take(193))
+        logging.info(f"Read back {len(res)} windows")
+        return
 
     def gen():
         freq = FLAGS.freq
@@ -90,14 +190,12 @@ def main(args):
         for start, end in zip(s0, s1):
             ts_zero = int(start.timestamp())
             im_data = read(start, end)
+            valid = source_meta.validity_mask(start, end, freq)
             idx = np.arange(len(im_data))  # Note we take off window from len so we can have time steps
             idx = idx
             for x in idx:
                 ix = (x * FLAGS.freq) + ts_zero
-                exists = True
-                if im_data[x, 100:104, 100:104].sum() == 0:
-                   exists = False
-                yield np.array(ix, dtype=np.int64), np.array(exists, dtype=bool), im_data[x]
+                yield np.array(ix, dtype=np.int64), np.array(valid[x], dtype=bool), im_data[x]
 
             del im_data
 
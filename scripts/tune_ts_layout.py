@@ -0,0 +1,161 @@
+"""Measure candidate chunk layouts and codecs for the tensorstore image stores.
+
+Copies a sample of the timestamps of an existing store into a scratch store for every candidate layout (chunk
+shape x blosc compressor x level x shuffle), then replays the read access patterns against each of them and
+reports the compression ratio, write throughput and read latency.
+
+Access patterns, each read is `window` consecutive timestamps from a random start:
+    frame: whole frames, all channels (what `batch_from_timesamps_idx` reads)
+    patch: random `patch` x `patch` crops, all channels (as in `samples/tensorstore_reader.py`)
+    channel: whole frames of one random channel
+    patch_channel: random crops of one random channel
+
+e.g.
+    python tune_ts_layout.py --store <path>/img_z=...,e=...,f=3600.ts.zarr --block 24,250,250,12 --block 4,64,64,1 \
+        --cnames lz4,zstd --clevels 5 --shuffles 2 --patterns patch,channel
+"""
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import tensorstore
+from absl import app, flags, logging
+
+from eumetsat.datasets.utils import FileNameProps, get_n5_spec, n5_compression
+
+PATTERNS = ["frame", "patch", "channel", "patch_channel"]
+
+flags.DEFINE_string("store", default=None, help="Store to take the sample from")
+flags.DEFINE_integer("start", default=0, help="Index of the first timestamp of the sample")
+flags.DEFINE_integer("samples", default=48, help="Number of timestamps in the sample")
+flags.DEFINE_multi_string("block", default=["24,250,250,12", "24,125,125,12", "4,64,64,12", "24,64,64,1"],
+                          help="Chunk shapes to try, ts,h,w,c")
+flags.DEFINE_list("cnames", default=["blosclz", "lz4", "zstd"], help="Blosc compressors to try, raw for none")
+flags.DEFINE_list("clevels", default=["5", "9"], help="Compression levels to try")
+flags.DEFINE_list("shuffles", default=["0", "2"], help="Shuffles to try, 0 none, 1 byte, 2 bit")
+flags.DEFINE_list("patterns", default=PATTERNS, help=f"Access patterns to replay, any of {PATTERNS}")
+flags.DEFINE_integer("reads", default=100, help="Reads per access pattern")
+flags.DEFINE_integer("window", default=4, help="Timestamps per read")
+flags.DEFINE_integer("patch", default=32, help="Size of the patches")
+flags.DEFINE_integer("seed", default=42, help="Seed of the reads, the same reads are replayed on every candidate")
+flags.DEFINE_string("work_dir", default=None, help="Scratch dir for the candidate stores, a temp dir if not set")
+flags.DEFINE_string("report", default=None, help="File to write the results to as json")
+FLAGS = flags.FLAGS
+
+
+def candidates(blocks: list[str], cnames: list[str], clevels: list[str], shuffles: list[str]) -> list[dict]:
+    """Every combination of chunk shape and codec, raw is only tried once per chunk shape."""
+    layouts = []
+    for block, cname, clevel, shuffle in itertools.product(blocks, cnames, clevels, shuffles):
+        layout = {"block": tuple(int(b) for b in block.split(",")),
+                  "compression": n5_compression(cname, int(clevel), int(shuffle))}
+        if layout not in layouts:
+            layouts.append(layout)
+    return layouts
+
+
+def layout_name(layout: dict) -> str:
+    c = layout["compression"]
+    codec = "raw" if c["type"] == "raw" else f"{c['cname']}-{c['clevel']}-s{c['shuffle']}"
+    return f"b={'x'.join(map(str, layout['block']))},c={codec}"
+
+
+def reads(pattern: str, samples: int, n: int, window: int, patch: int, rng: np.random.Generator) -> list[tuple]:
+    """Index expressions of `n` random reads of an access pattern."""
+    exprs = []
+    for _ in range(n):
+        t = rng.integers(0, samples - window + 1)
+        expr = [slice(t, t + window), slice(None), slice(None), slice(None)]
+        if pattern in ("patch", "patch_channel"):
+            y, x = rng.integers(0, 500 - patch + 1, size=2)
+            expr[1], expr[2] = slice(y, y + patch), slice(x, x + patch)
+        if pattern in ("channel", "patch_channel"):
+            expr[3] = rng.integers(0, 12)
+        exprs.append(tuple(expr))
+    return exprs
+
+
+def dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def measure(path: Path, data: np.ndarray, freq: int, layout: dict, patterns: dict[str, list[tuple]]) -> dict:
+    """Write the sample under a layout and time the reads of each pattern against it."""
+    spec = get_n5_spec(path, len(data), freq, create=True, overwrite=True, block_size=layout["block"],
+                       compression=layout["compression"])
+    start = time.perf_counter()
+    store = tensorstore.open(spec).result()
+    store.write(data).result()
+    write_seconds = time.perf_counter() - start
+    stored = dir_bytes(path)
+
+    # Reopen without a cache, so every read comes from disk (through the OS page cache) like a fresh reader
+    spec = get_n5_spec(path, len(data), freq)
+    spec["context"]["cache_pool"] = {"total_bytes_limit": 0}
+    del spec["metadata"]
+    store = tensorstore.open(spec, read=True).result()
+    result = {"layout": layout_name(layout), "block": layout["block"], "compression": layout["compression"],
+              "stored_bytes": stored, "ratio": data.nbytes / stored,
+              "write_mb_per_second": data.nbytes / 1e6 / write_seconds, "reads": {}}
+    for pattern, exprs in patterns.items():
+        latency = []
+        for expr in exprs:
+            began = time.perf_counter()
+            store[expr].read().result()
+            latency.append(time.perf_counter() - began)
+        latency = np.array(latency) * 1e3
+        result["reads"][pattern] = {"mean_ms": latency.mean(), "p50_ms": np.percentile(latency, 50),
+                                    "p90_ms": np.percentile(latency, 90), "p99_ms": np.percentile(latency, 99)}
+    return result
+
+
+def main(argv):
+    if FLAGS.store is None:
+        raise app.UsageError("--store is required")
+    unknown = set(FLAGS.patterns) - set(PATTERNS)
+    if unknown:
+        raise app.UsageError(f"Unknown access patterns {sorted(unknown)}, use any of {PATTERNS}")
+
+    source = tensorstore.open({'driver': 'n5', 'kvstore': {'driver': 'file', 'path': FLAGS.store}}, read=True).result()
+    freq = FileNameProps.from_str(os.path.basename(FLAGS.store.rstrip("/"))).freq
+    stop = min(FLAGS.start + FLAGS.samples, source.shape[0])
+    data = source[FLAGS.start:stop].read().result()
+    logging.info(f"Sampled {len(data)} timestamps ({data.nbytes / 1e6:.0f} MB) from {FLAGS.store}")
+
+    window = min(FLAGS.window, len(data))
+    patterns = {}
+    for pattern in FLAGS.patterns:
+        rng = np.random.default_rng(FLAGS.seed)
+        patterns[pattern] = reads(pattern, len(data), FLAGS.reads, window, FLAGS.patch, rng)
+
+    layouts = candidates(FLAGS.block, FLAGS.cnames, FLAGS.clevels, FLAGS.shuffles)
+    work_dir = Path(FLAGS.work_dir or tempfile.mkdtemp(prefix="tune_ts_layout_"))
+    logging.info(f"Trying {len(layouts)} layouts in {work_dir}")
+    results = []
+    for layout in layouts:
+        path = work_dir / f"{layout_name(layout)}.ts.zarr"
+        result = measure(path, data, freq, layout, patterns)
+        shutil.rmtree(path)
+        reads_ms = " ".join(f"{p}={r['p50_ms']:.1f}/{r['p99_ms']:.1f}" for p, r in result["reads"].items())
+        logging.info(f"{result['layout']:<36} ratio={result['ratio']:<5.2f} write={result['write_mb_per_second']:<6.0f}MB/s "
+                     f"read p50/p99 ms {reads_ms}")
+        results.append(result)
+
+    for pattern in FLAGS.patterns:
+        best = min(results, key=lambda r: r["reads"][pattern]["p50_ms"])
+        logging.info(f"Fastest {pattern} reads: {best['layout']} ({best['reads'][pattern]['p50_ms']:.1f} ms p50)")
+    best = max(results, key=lambda r: r["ratio"])
+    logging.info(f"Smallest: {best['layout']} (ratio {best['ratio']:.2f})")
+
+    if FLAGS.report:
+        with open(FLAGS.report, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    app.run(main)
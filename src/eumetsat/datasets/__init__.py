@@ -1,2 +1,3 @@
 from eumetsat.datasets.tensorstore_dataset import EMTensorstoreDataset
 
+from eumetsat.datasets.sampler import SequenceSampler
@@ -1,15 +1,24 @@
 from __future__ import annotations
 
 import abc
-from typing import TYPE_CHECKING
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Sequence
 
-from jaxtyping import Array, Int, UInt8
+import numpy as np
+from jaxtyping import Array, Bool, Int, UInt8
+
+from eumetsat import IMG_LAYERS, IMG_SIZE
+from eumetsat.datasets.utils import load_metadata
 
 if TYPE_CHECKING:
     from eumetsat.datasets.utils import FileNameProps
 
 
 class BaseDataset(abc.ABC):
+    assume_valid: bool = False  # Treat every timestamp as having an image when there is no metadata
 
     @property
     @abc.abstractmethod
@@ -20,9 +29,99 @@ class BaseDataset(abc.ABC):
     def props(self, value):
         pass
 
+    @property
+    @abc.abstractmethod
+    def meta_path(self) -> Path:
+        pass
+
+    @cached_property
+    def valid_mask(self) -> Bool[np.ndarray, "ts"]:
+        """Per index mask of the timestamps with an image, from the metadata.
+
+        Raises:
+            FileNotFoundError: if there is no metadata, unless the dataset was opened with `assume_valid`
+        """
+        if not self.meta_path.exists():
+            if not self.assume_valid:
+                raise FileNotFoundError(f"No metadata at {self.meta_path} to tell the missing timestamps, "
+                                        f"open the dataset with assume_valid=True to treat them all as valid")
+            return np.ones(len(self), dtype=bool)
+        mask = load_metadata(self.meta_path.parent, self.meta_path.name).validity_mask()
+        if len(mask) != len(self):
+            raise ValueError(f"Metadata {self.meta_path} is for {len(mask)} timestamps, not {len(self)}")
+        return mask
+
     def ts_to_idx(self, ts: int) -> int:
-        return ts - int(self.props.time_zero.timestamp())
+        return ts - self.props.zero_timestamp
 
     @abc.abstractmethod
     def batch_from_timesamps_idx(self, ts_index: Int[Array, "batch"]) -> UInt8[Array, "batch 500 500 12"]:
         pass
+
+    def patches_from_timestamps(self, ts: Int[Array, "batch"], ys: Int[Array, "batch"], xs: Int[Array, "batch"],
+                                size: int,
+                                channels: Optional[Sequence[int | str]] = None) -> UInt8[Array, "batch size size c"]:
+        """Read a patch of each example, only fetching the pixels and channels needed.
+
+        Args:
+            ts: timestamp of each patch
+            ys: row offset of each patch
+            xs: column offset of each patch
+            size: height and width of the patches
+            channels: channels to read, as indexes or names from `IMG_LAYERS`, defaults to all
+
+        Returns:
+            ndarray of the patches, channels last
+        """
+        ts, ys, xs = (np.asarray(a, dtype=np.int64) for a in (ts, ys, xs))
+        if not ts.shape == ys.shape == xs.shape or ts.ndim != 1:
+            raise ValueError(f"ts, ys and xs must be 1d and the same length, got {ts.shape}, {ys.shape}, {xs.shape}")
+        if ys.min(initial=0) < 0 or xs.min(initial=0) < 0 or ys.max(initial=0) + size > IMG_SIZE[0] \
+                or xs.max(initial=0) + size > IMG_SIZE[1]:
+            raise ValueError(f"Patches of {size} must be within the {IMG_SIZE} images")
+        index = self.props.timestamp_to_idx(ts)
+        if index.min(initial=0) < 0 or index.max(initial=0) >= len(self):
+            raise ValueError(f"Timestamps must be within the {len(self)} timestamps of the dataset")
+        channels = list(range(len(IMG_LAYERS))) if channels is None else \
+            [IMG_LAYERS.index(c) if isinstance(c, str) else c for c in channels]
+
+        out = np.empty((len(ts), size, size, len(channels)), dtype=np.uint8)
+        self._read_patches(index, ys, xs, size, channels, out)
+        return out
+
+    @abc.abstractmethod
+    def _read_patches(self, index: Int[Array, "batch"], ys: Int[Array, "batch"], xs: Int[Array, "batch"], size: int,
+                      channels: list[int], out: UInt8[Array, "batch size size c"]):
+        """Read the patches at the (validated) indexes into `out`."""
+        pass
+
+    @cached_property
+    def _read_pool(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=4, thread_name_prefix="dataset-read")
+
+    def submit_batch(self, ts_index: Int[Array, "batch"]) -> Future:
+        """Start reading a batch, without waiting for it.
+
+        Returns:
+            A future (anything with a blocking `result()`) of the batch, read on a thread unless overridden
+        """
+        return self._read_pool.submit(self.batch_from_timesamps_idx, ts_index)
+
+    def iter_batches(self, batches: Iterable[Int[Array, "batch"]],
+                     prefetch: int = 2) -> Iterator[UInt8[Array, "batch 500 500 12"]]:
+        """Read batches of timestamps in order, with the reads of the next `prefetch` batches in flight.
+
+        Args:
+            batches: timestamps of each batch
+            prefetch: batches read ahead of the one being consumed, bounds the batches held in memory
+
+        Returns:
+            Iterator of the batches, in the order of `batches`
+        """
+        pending = deque()
+        for ts_index in batches:
+            pending.append(self.submit_batch(ts_index))
+            if len(pending) > prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 
 import numpy as np
 from jaxtyping import Int, UInt8, Array
@@ -12,8 +13,14 @@ class EMNumpyDataset(BaseDataset):
     def props(self) -> FileNameProps:
         return self._props
 
-    def __init__(self, path: str):
+    @property
+    def meta_path(self) -> Path:
+        return self._path.with_suffix(".meta.json")
+
+    def __init__(self, path: str, assume_valid: bool = False):
         f_name = os.path.basename(path)
+        self._path = Path(path)
+        self.assume_valid = assume_valid
         self._props = FileNameProps.from_str(f_name)
         self._imgs = np.load(path, mmap_mode='r')
 
@@ -21,8 +28,13 @@ class EMNumpyDataset(BaseDataset):
         return self._imgs.shape[0]
 
     def ts_to_idx(self, ts: int) -> int:
-        return ts - self.props.time_zero
+        return ts - self.props.zero_timestamp
+
+    def _read_patches(self, index, ys, xs, size, channels, out):
+        # Basic slicing of the memmap only pages in the rows of each patch
+        for i, (t, y, x) in enumerate(zip(index, ys, xs)):
+            out[i] = self._imgs[t, y:y + size, x:x + size][..., channels]
 
     def batch_from_timesamps_idx(self, ts_index: Int[Array, "batch"]) -> UInt8[Array, "batch 500 500 12"]:
-        ts_index = (ts_index - self.props.time_zero) // self.props.freq
+        ts_index = self.props.timestamp_to_idx(ts_index)
         return self._imgs[ts_index]
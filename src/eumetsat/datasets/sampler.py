@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+from jaxtyping import Array, Int
+
+from eumetsat.datasets.abc_dataset import BaseDataset
+
+
+class SequenceSampler:
+    """Sample windows of timestamps that are all present in a dataset.
+
+    A window starting at index `s` is the indexes `s, s + step, ..., s + (window - 1) * step`, window starts are
+    taken every `stride` indexes. The table of valid window starts is built from the dataset's `valid_mask` in one
+    vectorised pass and cached next to the store's metadata, it is rebuilt when the metadata changes.
+    """
+
+    def __init__(self, dataset: BaseDataset, window: int, stride: int = 1, step: int = 1, cache: bool = True):
+        """Create a SequenceSampler
+
+        Args:
+            dataset: dataset to sample from
+            window: timestamps in each window, e.g. 4 for t-3...t
+            stride: indexes between the starts of consecutive windows
+            step: indexes between the timestamps in a window
+            cache: keep the table of valid window starts next to the store's metadata
+        """
+        if window < 1 or stride < 1 or step < 1:
+            raise ValueError(f"window, stride and step must be positive, got {window}, {stride}, {step}")
+        self.dataset = dataset
+        self.window = window
+        self.stride = stride
+        self.step = step
+        self.cache = cache
+        self._starts = None
+
+    @property
+    def cache_path(self) -> Path:
+        meta_path = self.dataset.meta_path
+        return meta_path.with_name(f"{meta_path.stem}.windows_w={self.window},s={self.stride},k={self.step}.npy")
+
+    @staticmethod
+    def valid_starts(mask: np.ndarray, window: int, stride: int = 1, step: int = 1) -> np.ndarray:
+        """Start indexes of the windows with every timestamp valid in `mask`."""
+        span = (window - 1) * step + 1
+        if len(mask) < span:
+            return np.zeros(0, dtype=np.int64)
+        valid = np.lib.stride_tricks.sliding_window_view(mask, span)[::stride, ::step].all(axis=1)
+        return np.flatnonzero(valid).astype(np.int64) * stride
+
+    @property
+    def starts(self) -> Int[np.ndarray, "windows"]:
+        """Start indexes of all the valid windows, in order."""
+        if self._starts is None:
+            self._starts = self._load()
+        return self._starts
+
+    def _load(self) -> np.ndarray:
+        meta_path, cache_path = self.dataset.meta_path, self.cache_path
+        use_cache = self.cache and meta_path.exists()
+        if use_cache and cache_path.exists() and cache_path.stat().st_mtime >= meta_path.stat().st_mtime:
+            return np.load(cache_path)
+        starts = self.valid_starts(self.dataset.valid_mask, self.window, self.stride, self.step)
+        if use_cache:
+            tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+            with tmp_path.open("wb") as f:
+                np.save(f, starts)
+            os.replace(tmp_path, cache_path)
+        return starts
+
+    def __len__(self):
+        return len(self.starts)
+
+    def batches(self, batch_size: int, shuffle: bool = False, seed: Optional[int] = None,
+                drop_remainder: bool = False) -> Iterator[Int[np.ndarray, "batch"]]:
+        """Batches of window start indexes, one epoch.
+
+        Args:
+            batch_size: windows in each batch
+            shuffle: shuffle the windows, otherwise they are in time order
+            seed: seed of the shuffle
+            drop_remainder: drop the last batch if it is short
+        """
+        starts = np.random.default_rng(seed).permutation(self.starts) if shuffle else self.starts
+        stop = len(starts) - len(starts) % batch_size if drop_remainder else len(starts)
+        for pos in range(0, stop, batch_size):
+            yield starts[pos:pos + batch_size]
+
+    def windows(self, starts: Int[Array, "batch"]) -> Int[np.ndarray, "batch window"]:
+        """Indexes of the timestamps of each window."""
+        return np.asarray(starts)[:, None] + np.arange(self.window) * self.step
+
+    def timestamps(self, starts: Int[Array, "batch"]) -> Int[np.ndarray, "batch window"]:
+        """Unix timestamps of each window, to read with the dataset."""
+        props = self.dataset.props
+        return props.zero_timestamp + self.windows(starts) * props.freq
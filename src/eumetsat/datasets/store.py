@@ -0,0 +1,75 @@
+"""Building and updating the tensorstore image stores from the pngs."""
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+import tensorstore
+from absl import logging
+
+from eumetsat.datasets.utils import FileNameProps, Metadata, get_n5_spec
+
+
+def chunker(kvs: list[tuple[int, str]], size: int, z: int, freq: int) -> list[tuple[int, list[tuple[int, str]]]]:
+    """Split sorted (timestamp, path) pairs into chunks of consecutive timestamps.
+
+    Chunks don't cross multiples of `size` in the index, so a full run gives the same chunks as slicing every `size`.
+
+    Returns:
+        list of (index of the first timestamp, chunk)
+    """
+    chunks = []
+    for kv in kvs:
+        idx = (kv[0] - z) // freq
+        if chunks:
+            offset, kvc = chunks[-1]
+            if idx == offset + len(kvc) and idx // size == offset // size:
+                kvc.append(kv)
+                continue
+        chunks.append((idx, [kv]))
+    return chunks
+
+
+def find_store(base_path: Path, ts_start: datetime, freq: int) -> Optional[Path]:
+    """Find the existing store starting at `ts_start` with frequency `freq`, the longest if there are several."""
+    zero = FileNameProps(time_zero=ts_start).zero_timestamp
+    stores = []
+    for path in base_path.glob("img_*.ts.zarr"):
+        props = FileNameProps.from_str(path.name)
+        if props.zero_timestamp == zero and props.freq == freq and (path / "img_meta.json").exists():
+            stores.append((props.samples, path))
+    return max(stores)[1] if stores else None
+
+
+def open_store(path: Path, samples: int, freq: int) -> tensorstore.TensorStore:
+    """Open an existing store and grow (or shrink) its ts dimension to `samples`."""
+    spec = get_n5_spec(path, samples, freq)
+    del spec["schema"]["domain"]["shape"]  # Opened at whatever size it is, a failed update may have resized it
+    del spec["metadata"]  # and with whatever layout it was made with
+    dataset = tensorstore.open(spec).result()
+    if dataset.shape[0] != samples:
+        logging.info("Resizing %s from %d to %d samples", path.name, dataset.shape[0], samples)
+        dataset = dataset.resize(exclusive_max=[samples, None, None, None]).result()
+    return dataset
+
+
+def drop_missing_blocks(date_dict: dict[int, str], expected_missing: set, block: int, z: int,
+                        freq: int) -> dict[int, str]:
+    """Drop the timestamps of the ts blocks that are all missing.
+
+    Those blocks are never written, so they take no space and read back as the fill value (zeros).
+    """
+    def block_of(k):
+        return (k - z) // freq // block
+
+    present = {block_of(k) for k in date_dict if datetime.utcfromtimestamp(k) not in expected_missing}
+    return {k: v for k, v in date_dict.items() if block_of(k) in present}
+
+
+def to_update(target_date_range: pd.DatetimeIndex, store_meta: Metadata, expected_missing: set) -> set[datetime]:
+    """Timestamps to write to a store: those after its end, and those it was missing that now have pngs."""
+    after_end = {ts for ts in target_date_range if ts > store_meta.last_example_date}
+    filled = set(target_date_range) & store_meta.missing
+    return (after_end | filled) - expected_missing
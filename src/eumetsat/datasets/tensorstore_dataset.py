@@ -1,5 +1,5 @@
-import asyncio
 import os
+from pathlib import Path
 
 import tensorstore as ts
 from jaxtyping import Int, UInt8, Array
@@ -13,8 +13,14 @@ class EMTensorstoreDataset(BaseDataset):
     def props(self) -> FileNameProps:
         return self._props
 
-    def __init__(self, path: str):
+    @property
+    def meta_path(self) -> Path:
+        return self._path / "img_meta.json"
+
+    def __init__(self, path: str, assume_valid: bool = False):
         f_name = os.path.basename(path)
+        self._path = Path(path)
+        self.assume_valid = assume_valid
         self._props = FileNameProps.from_str(f_name)
         self._imgs = ts.open(
             {
@@ -32,13 +38,21 @@ class EMTensorstoreDataset(BaseDataset):
         return self._imgs.shape[0]
 
     def ts_to_idx(self, ts: int) -> int:
-        return ts - self.props.time_zero
+        return ts - self.props.zero_timestamp
+
+    def _read_patches(self, index, ys, xs, size, channels, out):
+        # Issue every read at once, TensorStore fetches only the chunks each patch touches
+        reads = [self._imgs[i, y:y + size, x:x + size, channels].read() for i, y, x in zip(index, ys, xs)]
+        for i, read in enumerate(reads):
+            out[i] = read.result()
+
+    def submit_batch(self, ts_index: Int[Array, "batch"]) -> ts.Future:
+        """Start reading a batch, the TensorStore future of the read."""
+        ts_index = self.props.timestamp_to_idx(ts_index)
+        return self._imgs[ts_index].read()
 
     async def a_batch_from_timesamps_idx(self, ts_index: Int[Array, "batch"]) -> UInt8[Array, "batch 500 500 12"]:
-        ts_index = (ts_index - self.props.time_zero) // self.props.freq
-        return await self._imgs[ts_index].read()
+        return await self.submit_batch(ts_index)
 
     def batch_from_timesamps_idx(self, ts_index: Int[Array, "batch"]) -> UInt8[Array, "batch 500 500 12"]:
-        task = self.a_batch_from_timesamps_idx(ts_index)
-        result = asyncio.run(task)
-        return result
+        return self.submit_batch(ts_index).result()
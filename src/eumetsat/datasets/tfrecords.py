@@ -0,0 +1,85 @@
+"""Read the TFRecord exports written by `pngs_to_tfdata.py --export tfrecord`.
+
+An export is a dir named as per `FileNameProps` with, for each month, `shard=YYYY-MM.tfrecord` holding an example
+(`ts` int64, `image` raw uint8 bytes) for each valid timestamp and `shard=YYYY-MM.index.json` giving every timestamp
+of the month, whether it is valid (has an example) and the codec.
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import tensorflow as tf
+
+from eumetsat.datasets.sampler import SequenceSampler
+
+FEATURES = {"ts": tf.io.FixedLenFeature([], tf.int64), "image": tf.io.FixedLenFeature([], tf.string)}
+
+
+def serialize_example(ts: int, img: np.ndarray) -> bytes:
+    """Serialize a [500, 500, 12] uint8 image and its unix timestamp as an example."""
+    example = tf.train.Example(features=tf.train.Features(feature={
+        "ts": tf.train.Feature(int64_list=tf.train.Int64List(value=[ts])),
+        "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[img.tobytes()])),
+    }))
+    return example.SerializeToString()
+
+
+def parse_example(record: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+    """Parse an example back to (ts, image [500, 500, 12])."""
+    example = tf.io.parse_single_example(record, FEATURES)
+    return example["ts"], tf.reshape(tf.io.decode_raw(example["image"], tf.uint8), (500, 500, 12))
+
+
+def load_indexes(path: Path) -> list[dict]:
+    """Indexes of the shards of an export, in time order."""
+    indexes = []
+    for index_path in sorted(path.glob("shard=*.index.json")):
+        with index_path.open() as f:
+            indexes.append(json.load(f))
+    return indexes
+
+
+def record_windows(valid: list[bool], window: int) -> np.ndarray:
+    """Mask over the records of a shard, of those that start a window of `window` consecutive valid timestamps.
+
+    Only the valid timestamps are stored, so the window starting at a record is the next `window` records.
+    """
+    valid = np.asarray(valid, dtype=bool)
+    starts = np.zeros(len(valid), dtype=bool)
+    starts[SequenceSampler.valid_starts(valid, window)] = True
+    return starts[valid]
+
+
+def load_records(path: Path, window: int = 1, deterministic: Optional[bool] = False) -> tf.data.Dataset:
+    """Read a tfrecord export, with its shards interleaved in parallel.
+
+    Args:
+        path: dir of the export
+        window: consecutive timestamps in each element, windows with a timestamp that is not valid in the shard's
+            index are dropped
+        deterministic: keep the elements in order, only needed for tests, see `tf.data.Dataset.interleave`
+
+    Returns:
+        dataset of (ts [window], image [window, 500, 500, 12])
+    """
+    indexes = [index for index in load_indexes(path) if index["records"] >= window]
+    codec = indexes[0]["codec"] if indexes else ""
+    shards = [str(path / index["shard"]) for index in indexes]
+    # Ragged, so each shard gets its own mask of the records that start a window
+    masks = [record_windows(index["valid"], window) for index in indexes]
+    starts = tf.RaggedTensor.from_row_lengths(np.concatenate(masks) if masks else np.zeros(0, dtype=bool),
+                                              np.array([len(m) for m in masks], dtype=np.int64))
+
+    def shard_windows(shard, keep):
+        ds = tf.data.TFRecordDataset(shard, compression_type=codec).map(parse_example)
+        ds = ds.window(window, shift=1, drop_remainder=True)
+        ds = ds.flat_map(lambda ts, img: tf.data.Dataset.zip((ts, img)).batch(window, drop_remainder=True))
+        ds = tf.data.Dataset.zip((tf.data.Dataset.from_tensor_slices(keep), ds))
+        return ds.filter(lambda k, x: k).map(lambda k, x: x)
+
+    ds = tf.data.Dataset.from_tensor_slices((tf.constant(shards, dtype=tf.string), starts))
+    return ds.interleave(shard_windows, cycle_length=tf.data.AUTOTUNE, num_parallel_calls=tf.data.AUTOTUNE,
+                         deterministic=deterministic)
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import calendar
+import re
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 
 import imageio.v3 as iio
 import numpy as np
+import pandas as pd
 import serde
+import serde.json
 
 from eumetsat import IMG_LAYERS
 
@@ -30,6 +34,26 @@ class Metadata:
         ts_index = (ts - int(self.first_example_date.timestamp())) // self.freq_seconds
         return ts_index
 
+    def validity_mask(self, start: datetime = None, end: datetime = None, freq: int = None) -> np.ndarray:
+        """Mask of the timestamps that have an example.
+
+        Timestamps before the first or after the last example date are not valid.
+
+        Args:
+            start: first timestamp of the mask, defaults to the first example date
+            end: last timestamp of the mask (inclusive), defaults to the last example date
+            freq: frequency of the mask in seconds, defaults to the frequency of the metadata
+
+        Returns:
+            bool ndarray, True for the timestamps with an example
+        """
+        start = start if start is not None else self.first_example_date
+        end = end if end is not None else self.last_example_date
+        freq = freq if freq is not None else self.freq_seconds
+        times = pd.date_range(start, end, freq=f"{freq}s")
+        in_range = (times >= pd.Timestamp(self.first_example_date)) & (times <= pd.Timestamp(self.last_example_date))
+        return np.asarray(in_range & ~times.isin(list(self.missing)))
+
 
 def load_metadata(data_base_path: Path, metadata_name: str = "metadata.json") -> Metadata:
     """Load Metadata from json file.
@@ -54,19 +78,39 @@ class FileNameProps:
 
     @classmethod
     def from_str(cls, name:str) -> FileNameProps:
-        "Name format is `img_z=2020T00,e=2020T00,f=000.xyz"
-        name_kv = name.split("_")[-1].split(".")[0] # split out the _ and .
+        "Name format is `img_z=2020-01-01T00_00_00,e=2020-01-01T00_00_00,f=000.xyz`, older names use unix timestamps"
+        name_kv = re.search(r"(?:^|_)([a-z]+=.*)$", name).group(1).split(".")[0]  # split out the prefix and .
         name_kv = name_kv.split(",") #make it a list of kv
         name_kv = dict([(kv.split("=")[0], kv.split("=")[1]) for kv in name_kv])
 
-        ts_zero = str(name_kv["z"]).replace("_", ":")
-        ts_end = str(name_kv["e"]).replace("_", ":")
+        ts_zero = cls._parse_time(name_kv["z"])
+        ts_end = cls._parse_time(name_kv["e"])
         freq = int(name_kv["f"])
-
-        ts_zero = datetime.fromisoformat(ts_zero)
-        ts_end = datetime.fromisoformat(ts_end)
         return cls(time_zero=ts_zero, time_end=ts_end, freq=freq)
 
+    @staticmethod
+    def _parse_time(value: str) -> datetime | int:
+        if value.isdigit():
+            return int(value)
+        return datetime.fromisoformat(value.replace("_", ":"))
+
+    @staticmethod
+    def _timestamp(value: datetime | int) -> int:
+        return value if isinstance(value, int) else calendar.timegm(value.timetuple())
+
+    @property
+    def zero_timestamp(self) -> int:
+        """Unix timestamp of the first sample."""
+        return self._timestamp(self.time_zero)
+
+    @property
+    def samples(self) -> int:
+        """Number of samples from zero to end inclusive."""
+        return (self._timestamp(self.time_end) - self.zero_timestamp) // self.freq + 1
+
+    def timestamp_to_idx(self, ts: int) -> int:
+        return (ts - self.zero_timestamp) // self.freq
+
     @property
     def file_name(self) -> str:
         z = self.time_zero.isoformat().replace(":", "_")
@@ -77,6 +121,72 @@ class FileNameProps:
         return self.file_name
 
 
+def n5_compression(cname: str = "blosclz", clevel: int = 9, shuffle: int = 2) -> dict:
+    """Build the N5 compression metadata for a blosc codec.
+
+    Args:
+        cname: blosc compressor (blosclz, lz4, lz4hc, zstd or zlib), or `raw` for no compression
+        clevel: compression level, 0-9
+        shuffle: 0 for none, 1 for byte shuffle (a no-op on uint8) and 2 for bit shuffle
+
+    Returns:
+        compression dict for the N5 metadata
+    """
+    if cname == "raw":
+        return {"type": "raw"}
+    return {"type": "blosc", "cname": cname, "clevel": clevel, "shuffle": shuffle}
+
+
+def get_n5_spec(path: Path, samples: int, freq: int, create: bool = False, overwrite: bool = False,
+                block_size: tuple[int, ...] = (24, 250, 250, 12), compression: dict = None) -> dict:
+    """Build the TensorStore spec for an N5 image store.
+
+    Args:
+        path: path of the store
+        samples: number of timestamps in the store
+        freq: frequency in seconds of the timestamps
+        create: create the store if it does not exist
+        overwrite: delete and recreate an existing store
+        block_size: chunk shape of the store
+        compression: N5 compression metadata, defaults to blosc blosclz level 9
+
+    Returns:
+        spec dict to pass to `tensorstore.open`
+    """
+    if compression is None:
+        compression = n5_compression()
+    return {
+        'driver': 'n5',
+        'context': {
+            "cache_pool": {"total_bytes_limit": 10_000_000},
+            "cache_pool#remote": {"total_bytes_limit": 10_000_000},
+            "data_copy_concurrency": {"limit": 8},
+            "file_io_concurrency": {"limit": 8}
+        },
+        'kvstore': {
+            'driver': 'file',
+            'path': str(path),
+        },
+        'schema': {
+            'dtype': 'uint8',
+            'domain': {
+                "rank": 4,
+                "shape": [samples, 500, 500, 12],
+                "labels": ["ts", "h", "w", "c"],
+            },
+            "dimension_units": [[freq, "s"], [13 / 500, "deg"], [17 / 500, "deg"], ""],
+        },
+        'metadata': {
+            'compression': compression,
+            'dataType': 'uint8',
+            'blockSize': list(block_size),
+        },
+        "open": not overwrite,
+        "create": create,
+        "delete_existing": overwrite
+    }
+
+
 def read_png(kv: tuple[int, str], img_base_path: Path, img_array: np.ndarray = None, z: int = 0, freq: int = 3600, offset: int = 0) -> np.ndarray:
     """Read pngs into a ndarray
 
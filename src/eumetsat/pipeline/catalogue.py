@@ -0,0 +1,145 @@
+"""Persistent catalogue of the extracted image slots.
+
+Each 15 min slot is keyed by its index since the unix epoch, and stores a bit mask of the image layers
+(in `IMG_LAYERS` order) that have been extracted for it, and the satellite they came from. This lets us find gaps with a set difference over
+a numpy array rather than stat-ing 12 pngs per slot on the (network) filesystem.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from eumetsat import IMG_LAYERS
+
+SLOT_SECONDS = 15 * 60
+FULL_MASK = (1 << len(IMG_LAYERS)) - 1
+
+
+def slot_index(times) -> np.ndarray:
+    """Get the slot index of a datetime or sequence of (naive UTC) datetimes."""
+    seconds = np.asarray(times, dtype="datetime64[s]").astype(np.int64)
+    return seconds // SLOT_SECONDS
+
+
+def slot_time(slots) -> pd.DatetimeIndex:
+    """Inverse of `slot_index`, the start time of each slot."""
+    return pd.to_datetime(np.asarray(slots, dtype=np.int64) * SLOT_SECONDS, unit="s")
+
+
+def layer_mask(layers: Iterable[str]) -> int:
+    mask = 0
+    for l in layers:
+        mask |= 1 << IMG_LAYERS.index(l)
+    return mask
+
+
+def gap_ranges(times: pd.DatetimeIndex, missing: np.ndarray, max_slots: int = 31 * 96) -> list[tuple[datetime, datetime]]:
+    """Merge missing slots into ranges to search for.
+
+    Slots next to each other in `times` that are both missing end up in the same range,
+    ranges are capped at `max_slots` slots.
+
+    Args:
+        times: start times of the expected slots, sorted
+        missing: boolean mask of the missing slots in `times`
+        max_slots: max number of slots in a range
+
+    Returns:
+        List of (start, end) tuples, end is the end of the last slot in the range
+    """
+    pos = np.flatnonzero(missing)
+    if len(pos) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(pos) != 1) + 1
+    ranges = []
+    for run in np.split(pos, breaks):
+        for s in range(0, len(run), max_slots):
+            part = run[s:s + max_slots]
+            ranges.append((times[part[0]], times[part[-1]] + pd.Timedelta(seconds=SLOT_SECONDS)))
+    return ranges
+
+
+class Catalogue:
+    """SQLite backed catalogue of extracted slots.
+
+    Safe to share between processes, each process opens its own connection on first use.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._conn = None
+        self._pid = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS slots (slot INTEGER PRIMARY KEY, layers INTEGER NOT NULL, "
+                               "sat TEXT)")
+            self._migrate(self._conn)
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """Bring a catalogue made by an older version up to date."""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(slots)")}
+        if "sat" not in columns:
+            with conn:
+                conn.execute("ALTER TABLE slots ADD COLUMN sat TEXT")
+
+    def mark(self, time: datetime, layers: Iterable[str] = IMG_LAYERS, sat: Optional[str] = None):
+        """Record the layers extracted for the slot `time` is in, and the satellite they came from."""
+        self.mark_slots([int(slot_index(time))], layer_mask(layers), sat)
+
+    def mark_slots(self, slots: Sequence[int], mask: int = FULL_MASK, sat: Optional[str] = None):
+        with self.db as db:
+            db.executemany("INSERT INTO slots (slot, layers, sat) VALUES (?, ?, ?) "
+                           "ON CONFLICT(slot) DO UPDATE SET layers = layers | excluded.layers, "
+                           "sat = coalesce(excluded.sat, sat)",
+                           [(int(s), mask, sat) for s in slots])
+
+    def satellite(self, time: datetime) -> Optional[str]:
+        """The satellite the slot `time` is in was extracted from, if known."""
+        row = self.db.execute("SELECT sat FROM slots WHERE slot = ?", (int(slot_index(time)),)).fetchone()
+        return row[0] if row is not None else None
+
+    def complete(self) -> np.ndarray:
+        """Sorted array of the slot indexes with all the layers extracted."""
+        rows = self.db.execute("SELECT slot FROM slots WHERE layers = ? ORDER BY slot", (FULL_MASK,)).fetchall()
+        return np.array([r[0] for r in rows], dtype=np.int64)
+
+    def missing(self, times) -> np.ndarray:
+        """Boolean mask of the `times` whose slots are not complete."""
+        return np.isin(slot_index(times), self.complete(), invert=True)
+
+    def scan(self, data_path: str | Path, times) -> int:
+        """Add slots to the catalogue by looking for their pngs on disk.
+
+        Used to build the catalogue for data extracted before it existed, only the slots not already
+        complete are looked for.
+
+        Args:
+            data_path: base path of the extracted pngs
+            times: slot times to look for
+
+        Returns:
+            The number of complete slots found
+        """
+        times = pd.DatetimeIndex(times)
+        data_path = Path(data_path)
+        found = []
+        for t in times[self.missing(times)]:
+            time_root = data_path / t.strftime("year=%Y/month=%m/day=%d/time=%H_%M")
+            if all((time_root / f"format={l}/img.png").exists() for l in IMG_LAYERS):
+                found.append(int(slot_index(t)))
+        self.mark_slots(found)
+        return len(found)
@@ -0,0 +1,159 @@
+"""Crash safe journal of where each product is in the pipeline.
+
+Every state change is appended to a json lines file, and synced to disk, as it happens. On restart the journal
+is replayed to get the last state of each product, so the unfinished ones can be queued again without searching.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+SEARCHED = "searched"
+DOWNLOADING = "downloading"
+DOWNLOADED = "downloaded"
+EXTRACTING = "extracting"
+DONE = "done"
+FAILED = "failed"
+
+
+class Journal:
+    """Append only journal of product states.
+
+    Safe to share between processes, each process opens the file on first use and writes each record
+    with a single `O_APPEND` write. A journal with no path drops everything, so workers can always record.
+    """
+
+    def __init__(self, path: Optional[str | Path]):
+        self.path = Path(path) if path is not None else None
+        self._fd = None
+        self._pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def fd(self) -> int:
+        if self._fd is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def record(self, state: str, product_id: Optional[str] = None, path: Optional[str] = None, **data):
+        """Record a product state change.
+
+        Args:
+            state: new state of the product
+            product_id: id of the product, can be left out once the product has been downloaded to `path`
+            path: path of the downloaded product
+            **data: anything else to keep, e.g. the product search result
+        """
+        if not self.enabled:
+            return
+        entry = {"state": state, "time": time.time(), "id": product_id, "path": path, **data}
+        line = json.dumps({k: v for k, v in entry.items() if v is not None}) + "\n"
+        os.write(self.fd, line.encode())
+        os.fsync(self.fd)
+
+    def replay(self) -> dict[str, dict]:
+        """Replay the journal to get the latest state of each product.
+
+        Returns:
+            Dict of product id to the product entry, made by merging all its records in order
+        """
+        if not self.enabled:
+            return {}
+        return JournalReader(self.path).read()
+
+    def compact(self) -> dict[str, dict]:
+        """Rewrite the journal with one record per product, dropping the search results of finished products.
+
+        Only call this before any workers are started.
+
+        Returns:
+            The replayed journal, as per `replay`
+        """
+        products = self.replay()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as f:
+            for entry in products.values():
+                if entry["state"] == DONE:
+                    entry = {k: v for k, v in entry.items() if k != "product"}
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        if self._fd is not None:  # Still open on the old file
+            os.close(self._fd)
+            self._fd = None
+        return products
+
+
+class JournalReader:
+    """Follows a journal, reading only the records appended since the last `read`.
+
+    For polling the product states while the workers are still writing them, without replaying the whole journal
+    each time. The journal must not be compacted while it is being followed.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.products = {}
+        self._path_ids = {}
+        self._offset = 0
+
+    def read(self) -> dict[str, dict]:
+        """Merge in the new records.
+
+        Returns:
+            Dict of product id to the product entry, as per `Journal.replay`
+        """
+        if not self.path.exists():
+            return self.products
+        with self.path.open("rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Only whole lines, the last one may still be being written
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:  # Torn write from a crash
+                continue
+            product_id = entry.get("id") or self._path_ids.get(entry.get("path"))
+            if product_id is None:
+                continue
+            entry["id"] = product_id
+            self.products.setdefault(product_id, {}).update(entry)
+            if "path" in entry:
+                self._path_ids[entry["path"]] = product_id
+        self._offset += end
+        return self.products
+
+
+def unfinished(products: dict[str, dict]) -> list[dict]:
+    """Get the entries of the products that are not done, oldest first."""
+    return sorted((e for e in products.values() if e["state"] != DONE), key=lambda e: e["time"])
+
+
+def settled(product_ids: list[str], products: dict[str, dict], complete: bool = True) -> Optional[bool]:
+    """Check if a set of products has finished going through the pipeline.
+
+    Args:
+        product_ids: ids of the products
+        products: latest entry of each product, as per `Journal.replay`
+        complete: the ids are all the products wanted, if not (e.g. a search failed) they can never all be done
+
+    Returns:
+        True if all of them are done, False if any failed or the set isn't complete, or None if any are still in
+        the pipeline
+    """
+    states = [products.get(i, {}).get("state") for i in product_ids]
+    if any(s not in (DONE, FAILED) for s in states):
+        return None
+    return complete and all(s == DONE for s in states)
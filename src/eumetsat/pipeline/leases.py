@@ -0,0 +1,187 @@
+"""Leases on units of work, so many nodes can share a backfill through the shared output filesystem.
+
+The date range is split into day units, matching the `year=/month=/day=` layout of the extracted data. A node
+claims a unit by creating its lease file with `O_EXCL`, which only one node can do, and keeps renewing the lease
+while it works on the unit. A unit whose lease has expired, e.g. because the node holding it died, can be taken
+over by another node. Finished units get a `.done` marker, so they are not claimed again.
+
+Expiry uses wall clock time, so the nodes' clocks need to be in sync (to well within the lease ttl).
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from absl import logging
+
+
+def split_range(start: datetime, end: datetime, freq: str) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """Split a range at the `freq` boundaries in it, e.g. into months, with the first and last parts clipped to it."""
+    edges = pd.date_range(start, end, freq=freq).union([pd.Timestamp(start), pd.Timestamp(end)])
+    return list(zip(edges[:-1], edges[1:]))
+
+
+@dataclass
+class Lease:
+    name: str
+    start: pd.Timestamp
+    end: pd.Timestamp
+    token: str  # Unique to this claim, so a lease taken over by another node is not renewed or released by us
+
+
+class Leases:
+    """Claim, renew and complete leases on day units of a date range."""
+
+    def __init__(self, root: str | Path, ttl: timedelta = timedelta(hours=1), owner: Optional[str] = None):
+        """Create Leases
+
+        Args:
+            root: dir on the shared filesystem to keep the lease files in
+            ttl: how long a lease lasts without being renewed
+            owner: name of this node, for the logs, defaults to the host name and pid
+        """
+        self.root = Path(root)
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+
+    def units(self, start: datetime, end: datetime) -> list[Lease]:
+        """The day units of a range, unclaimed."""
+        return [Lease(s.strftime("year=%Y/month=%m/day=%d"), s, e, token="")
+                for s, e in split_range(start, end, "D")]
+
+    def path(self, lease: Lease) -> Path:
+        return self.root / f"{lease.name}.lease"
+
+    def done_path(self, lease: Lease) -> Path:
+        return self.root / f"{lease.name}.done"
+
+    def is_done(self, lease: Lease) -> bool:
+        return self.done_path(lease).exists()
+
+    def _record(self, token: str) -> bytes:
+        expires = time.time() + self.ttl.total_seconds()
+        return json.dumps({"owner": self.owner, "token": token, "expires": expires}).encode()
+
+    def _read(self, path: Path) -> Optional[dict]:
+        try:
+            return json.loads(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            # Being written, or left empty by a node that crashed while writing it, so live for a ttl from then
+            try:
+                expires = path.stat().st_mtime + self.ttl.total_seconds()
+            except FileNotFoundError:
+                return None
+            return {"owner": "?", "token": "?", "expires": expires}
+
+    def _create(self, path: Path, token: str) -> bool:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        try:
+            os.write(fd, self._record(token))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return True
+
+    def claim(self, unit: Lease) -> Optional[Lease]:
+        """Try to claim a unit.
+
+        Returns:
+            The lease, or None if the unit is done or another node holds a live lease on it
+        """
+        if self.is_done(unit):
+            return None
+        path = self.path(unit)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex
+        if not self._create(path, token):
+            held = self._read(path)
+            if held is not None and held["expires"] > time.time():
+                return None
+            # Expired, move it out of the way. Only one node can rename it, the rest get FileNotFoundError.
+            stale = path.with_name(f"{path.name}.{token}.stale")
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return None
+            moved = self._read(stale)
+            os.unlink(stale)
+            if moved is not None and moved["expires"] > time.time():
+                # It was renewed, or taken over, between us reading and moving it, so put it back
+                self._put_back(path, moved)
+                return None
+            logging.info(f"Taking over expired lease on {unit.name} from {held['owner'] if held else '?'}")
+            if not self._create(path, token):
+                return None
+        return Lease(unit.name, unit.start, unit.end, token)
+
+    def _put_back(self, path: Path, record: dict):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return
+        try:
+            os.write(fd, json.dumps(record).encode())
+        finally:
+            os.close(fd)
+
+    def holds(self, lease: Lease) -> bool:
+        held = self._read(self.path(lease))
+        return held is not None and held["token"] == lease.token
+
+    def renew(self, lease: Lease) -> bool:
+        """Push back the expiry of a lease we still hold.
+
+        Returns:
+            False if the lease was lost, e.g. it expired and was taken over
+        """
+        path = self.path(lease)
+        if not self.holds(lease):
+            return False
+        tmp_path = path.with_name(f"{path.name}.{lease.token}.tmp")
+        tmp_path.write_bytes(self._record(lease.token))
+        os.replace(tmp_path, path)
+        return True
+
+    def release(self, lease: Lease):
+        """Give up a lease without finishing the unit, so any node can claim it."""
+        if self.holds(lease):
+            self.path(lease).unlink(missing_ok=True)
+
+    def complete(self, lease: Lease):
+        """Mark the unit done and drop the lease."""
+        self.done_path(lease).write_text(json.dumps({"owner": self.owner, "time": time.time()}))
+        self.release(lease)
+
+    @contextmanager
+    def keep(self, lease: Lease):
+        """Renew the lease in the background while in the block."""
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.ttl.total_seconds() / 3):
+                if not self.renew(lease):
+                    logging.warning(f"Lost the lease on {lease.name}")
+                    return
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            done.set()
+            thread.join()
@@ -0,0 +1,180 @@
+"""Per stage metrics for the download / extract pipeline.
+
+Worker procs record events on a `Metrics` object, these are sent over a multiprocessing queue to a
+`MetricsReporter` thread in the main proc. The reporter aggregates them and periodically writes a snapshot,
+as json or in the Prometheus text format, for a local scraper to pick up.
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Optional
+
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Metrics:
+    """Handle to record metrics from any proc.
+
+    A disabled `Metrics` drops everything, so workers can always record without checking.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self._q = multiprocessing.Queue() if enabled else None
+
+    @property
+    def enabled(self) -> bool:
+        return self._q is not None
+
+    def _send(self, kind: str, name: str, value: float, labels: dict):
+        if self._q is not None:
+            self._q.put_nowait((kind, name, float(value), tuple(sorted(labels.items()))))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add to a counter."""
+        self._send("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        """Add an observation to a summary, e.g. a latency."""
+        self._send("summary", name, value, labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe how long the block takes, in seconds."""
+        start = time.monotonic()
+        yield
+        self.observe(name, time.monotonic() - start, **labels)
+
+
+class MetricsReporter(threading.Thread):
+    """Aggregates metrics and writes snapshots of them.
+
+    Counters are totals since the start, summaries keep the count and sum of all observations
+    and quantiles over the last `window` of them. The depth of the given queues is sampled as a gauge.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, fmt: str = "json", interval: float = 30,
+                 queues: Optional[dict] = None, window: int = 1000, prefix: str = "eumetsat"):
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.queues = queues or {}
+        self.window = window
+        self.prefix = prefix
+        self.start_time = time.time()
+        self.counters = defaultdict(float)
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.recent = defaultdict(lambda: deque(maxlen=self.window))
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def drain(self, timeout: float = 0):
+        """Pull all pending events off the metrics queue."""
+        try:
+            while True:
+                kind, name, value, labels = self.metrics._q.get(timeout=timeout)
+                with self._lock:
+                    if kind == "counter":
+                        self.counters[(name, labels)] += value
+                    else:
+                        self.sums[(name, labels)] += value
+                        self.counts[(name, labels)] += 1
+                        self.recent[(name, labels)].append(value)
+        except queue.Empty:
+            pass
+
+    def run(self):
+        next_write = time.monotonic() + self.interval
+        while not self._done.is_set():
+            self.drain(timeout=min(1., self.interval))
+            if time.monotonic() >= next_write:
+                self.write()
+                next_write = time.monotonic() + self.interval
+
+    def stop(self):
+        """Stop the reporter and write a final snapshot."""
+        self._done.set()
+        self.join()
+        self.drain()
+        self.write()
+
+    def recent_mean(self, name: str, total: bool = False) -> Optional[float]:
+        """Mean of the recent observations of a summary.
+
+        Args:
+            name: name of the summary
+            total: sum the means of each label set rather than taking the mean over all of them,
+                e.g. to get the total latency over all the stages
+
+        Returns:
+            The mean, or None if there are no observations
+        """
+        with self._lock:
+            means = [np.mean(v) for (n, _), v in self.recent.items() if n == name and len(v)]
+            if not means:
+                return None
+            if total:
+                return float(np.sum(means))
+            return float(np.mean(np.concatenate([v for (n, _), v in self.recent.items() if n == name])))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            summaries = []
+            for key, count in self.counts.items():
+                name, labels = key
+                recent = np.array(self.recent[key])
+                summaries.append({"name": name, "labels": dict(labels), "count": count, "sum": self.sums[key],
+                                  "quantiles": {str(q): float(np.quantile(recent, q)) for q in QUANTILES}})
+            counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in self.counters.items()]
+
+        gauges = []
+        for q_name, q in self.queues.items():
+            gauges.append({"name": "queue_depth", "labels": {"queue": q_name}, "value": q.qsize()})
+        return {"time": time.time(), "uptime": time.time() - self.start_time,
+                "counters": counters, "summaries": summaries, "gauges": gauges}
+
+    def prometheus(self, snapshot: dict) -> str:
+        def fmt_labels(labels: dict) -> str:
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+        lines = []
+        for kind, metrics in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            suffix = "_total" if kind == "counter" else ""
+            for name in sorted({m["name"] for m in metrics}):
+                lines.append(f"# TYPE {self.prefix}_{name}{suffix} {kind}")
+                for m in metrics:
+                    if m["name"] == name:
+                        lines.append(f"{self.prefix}_{name}{suffix}{fmt_labels(m['labels'])} {m['value']}")
+
+        for name in sorted({m["name"] for m in snapshot["summaries"]}):
+            lines.append(f"# TYPE {self.prefix}_{name} summary")
+            for m in snapshot["summaries"]:
+                if m["name"] != name:
+                    continue
+                for q, v in m["quantiles"].items():
+                    lines.append(f"{self.prefix}_{name}{fmt_labels({**m['labels'], 'quantile': q})} {v}")
+                lines.append(f"{self.prefix}_{name}_sum{fmt_labels(m['labels'])} {m['sum']}")
+                lines.append(f"{self.prefix}_{name}_count{fmt_labels(m['labels'])} {m['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Write a snapshot, via a temp file so readers never see a partial one."""
+        snapshot = self.snapshot()
+        data = self.prometheus(snapshot) if self.fmt == "prom" else json.dumps(snapshot, indent=1)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,208 @@
+"""Local stand in for the EUMETSAT API, to benchmark the ingest pipeline without the live service.
+
+Serves the token, search-products and data endpoints that `download.py` uses. The products are zipped `.nat`
+files, either a copy of a real sample product or random bytes of the given size. Latency, bandwidth, failures
+and throttling can be injected to see how the pipeline copes with them.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from eumetsat import COLLECTION_ID
+
+SEARCH_PATH = "/data/search-products/os"
+DATA_PATH = "/data/download/products/"
+
+
+@dataclass
+class MockConfig:
+    collection_id: str = COLLECTION_ID
+    sats: Sequence[str] = ("MSG4",)  # Satellites with a product in every slot
+    product_bytes: int = 2 ** 20  # Size of the random .nat files
+    sample: Optional[str] = None  # Real .nat file to serve for every product, rather than random bytes
+    compress: bool = False  # Deflate the .nat in the zip, real products are stored
+    latency: float = 0  # Seconds before each response
+    bandwidth: Optional[float] = None  # Bytes/s of each transfer, none for no limit
+    fail_rate: float = 0  # Fraction of transfers that fail, half with a 500 and half dropped part way
+    throttle_rate: float = 0  # Fraction of requests answered with a 429
+    retry_after: int = 1  # Retry-After of the 429s, in seconds
+    seed: int = 0
+
+
+def product_id(sat: str, end: pd.Timestamp) -> str:
+    return f"{sat}-SEVI-MSG15-0100-NA-{end:%Y%m%d%H%M%S}.000000000Z-NA"
+
+
+class MockApi(ThreadingHTTPServer):
+    """The mock API server, run it in a background thread with `start`."""
+
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig = MockConfig(), address: tuple[str, int] = ("127.0.0.1", 0)):
+        super().__init__(address, MockHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        if config.sample is not None:
+            with open(config.sample, "rb") as f:
+                self.nat = f.read()
+        else:
+            self.nat = np.random.default_rng(config.seed).bytes(config.product_bytes)
+        self.requests = {"token": 0, "search": 0, "data": 0}
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chance(self, p: float) -> bool:
+        with self._rng_lock:
+            return self.rng.random() < p
+
+    def products(self, start: pd.Timestamp, end: pd.Timestamp) -> list[dict]:
+        """Products of the slots starting in the range, one per satellite."""
+        products = []
+        for slot in pd.date_range(start.ceil("15min"), end, freq="15min", inclusive="left"):
+            sensing_start, sensing_end = slot + pd.Timedelta(seconds=9), slot + pd.Timedelta(minutes=12, seconds=43)
+            for sat in self.config.sats:
+                pid = product_id(sat, sensing_end)
+                products.append({
+                    "id": pid,
+                    "type": "Feature",
+                    "properties": {
+                        "date": f"{sensing_start:%Y-%m-%dT%H:%M:%S.%f}"[:-3] + "Z/"
+                                + f"{sensing_end:%Y-%m-%dT%H:%M:%S.%f}"[:-3] + "Z",
+                        "links": {"data": [{"href": f"{self.url}{DATA_PATH}{pid}"}]},
+                    },
+                })
+        return products
+
+    @lru_cache(maxsize=8)
+    def product_zip(self, pid: str) -> tuple[bytes, str]:
+        """Zipped product and the base64 md5 of it."""
+        buf = io.BytesIO()
+        compression = zipfile.ZIP_DEFLATED if self.config.compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(buf, "w", compression=compression) as zf:
+            zf.writestr(f"{pid}.nat", self.nat)
+        data = buf.getvalue()
+        return data, base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    def start(self) -> MockApi:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: MockApi
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, obj: dict, status: int = 200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def throttled(self) -> bool:
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+        if config.throttle_rate and self.server.chance(config.throttle_rate):
+            self.send_response(429)
+            self.send_header("Retry-After", str(config.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+        return False
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != "/token":
+            return self.send_error(404)
+        self.server.requests["token"] += 1
+        if not self.throttled():
+            self.send_json({"access_token": "mock-token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == SEARCH_PATH:
+            self.server.requests["search"] += 1
+            if not self.throttled():
+                self.search(parse_qs(url.query))
+        elif url.path.startswith(DATA_PATH):
+            self.server.requests["data"] += 1
+            if not self.throttled():
+                self.data(url.path[len(DATA_PATH):])
+        else:
+            self.send_error(404)
+
+    def search(self, query: dict):
+        if query.get("pi", [None])[0] != self.server.config.collection_id:
+            return self.send_json({"totalResults": 0, "features": []})
+        start = pd.Timestamp(query["dtstart"][0]).tz_convert(None)
+        end = pd.Timestamp(query["dtend"][0]).tz_convert(None)
+        si, count = int(query.get("si", [0])[0]), int(query.get("c", [10])[0])
+        products = self.server.products(start, end)
+        self.send_json({"type": "FeatureCollection", "totalResults": len(products),
+                        "features": products[si:si + count]})
+
+    def data(self, pid: str):
+        config = self.server.config
+        fail = config.fail_rate and self.server.chance(config.fail_rate)
+        if fail and self.server.chance(0.5):
+            return self.send_error(500)
+        data, md5 = self.server.product_zip(pid)
+
+        start = 0
+        m = re.match(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        else:
+            self.send_response(200)
+            self.send_header("Content-MD5", md5)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Length", str(len(data) - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Disposition", f'attachment; filename="{pid}.zip"')
+        self.end_headers()
+
+        # Drop part way through the body, so the client has to resume
+        end = start + (len(data) - start) // 2 if fail else len(data)
+        chunk = 2 ** 16
+        for pos in range(start, end, chunk):
+            began = time.monotonic()
+            block = data[pos:min(pos + chunk, end)]
+            self.wfile.write(block)
+            if config.bandwidth:
+                time.sleep(max(0., len(block) / config.bandwidth - (time.monotonic() - began)))
+        if end < len(data):
+            self.close_connection = True
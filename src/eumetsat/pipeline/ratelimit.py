@@ -0,0 +1,105 @@
+"""Rate limiting of the requests made to the EUMETSAT API, shared by all the worker procs.
+
+Requests are paced by a token bucket, and the number of product transfers running at once is capped by a
+semaphore. The state lives in shared memory, so one `RateLimiter` made in the main proc covers every proc
+started after it. When the API answers 429 every proc holds off until its `Retry-After` has passed.
+"""
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+TOO_MANY_REQUESTS = 429
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from a `Retry-After` header, given either as seconds or as a HTTP date."""
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Token bucket of requests per second and a cap on the concurrent transfers, shared between procs."""
+
+    def __init__(self, rps: Optional[float] = None, burst: Optional[float] = None,
+                 max_transfers: Optional[int] = None):
+        """Create a RateLimiter
+
+        Args:
+            rps: requests per second, none for no limit
+            burst: requests that can be made at once after being idle, defaults to one second's worth
+            max_transfers: max concurrent transfers, none for no limit
+        """
+        self.rps = rps
+        self.burst = burst or max(rps or 1, 1)
+        self._lock = multiprocessing.Lock()
+        self._tokens = multiprocessing.RawValue("d", self.burst)
+        self._updated = multiprocessing.RawValue("d", time.monotonic())
+        self._blocked_until = multiprocessing.RawValue("d", 0)
+        self._transfers = multiprocessing.BoundedSemaphore(max_transfers) if max_transfers else None
+
+    def reserve(self) -> float:
+        """Take a token from the bucket, going into debt if it is empty.
+
+        Returns:
+            Seconds to wait before making the request
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._blocked_until.value - now
+            if self.rps:
+                tokens = min(self.burst, self._tokens.value + (now - self._updated.value) * self.rps) - 1
+                self._tokens.value = tokens
+                self._updated.value = now
+                wait = max(wait, -tokens / self.rps)
+        return max(wait, 0.)
+
+    def acquire(self):
+        """Wait until a request can be made."""
+        time.sleep(self.reserve())
+
+    async def acquire_async(self):
+        await asyncio.sleep(self.reserve())
+
+    def block(self, seconds: float):
+        """Hold off all requests, in every proc, for `seconds`."""
+        with self._lock:
+            self._blocked_until.value = max(self._blocked_until.value, time.monotonic() + seconds)
+
+    @contextmanager
+    def transfer(self):
+        """Hold one of the transfer slots."""
+        if self._transfers is None:
+            yield
+            return
+        self._transfers.acquire()
+        try:
+            yield
+        finally:
+            self._transfers.release()
+
+    @asynccontextmanager
+    async def transfer_async(self, poll: float = 0.1):
+        # Polled, so waiting for a slot does not tie up an executor thread
+        if self._transfers is None:
+            yield
+            return
+        while not self._transfers.acquire(block=False):
+            await asyncio.sleep(poll)
+        try:
+            yield
+        finally:
+            self._transfers.release()
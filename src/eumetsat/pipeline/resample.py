@@ -0,0 +1,53 @@
+"""Bilinear resampling with the coefficients cached on disk.
+
+The SEVIRI full disk geometry and the target area never change, so the bilinear neighbour and weight tables
+only need to be worked out once per source geometry (one for HRV and one for the standard channels).
+Satpy saves them as zarr in the cache dir, keyed by a hash of the source and target areas, and on later
+products only loads them and applies them as a gather.
+"""
+import fcntl
+import os
+from typing import Optional
+
+from pyresample.geometry import AreaDefinition, StackedAreaDefinition
+from satpy import Scene
+
+
+def crop_scene(scn: Scene, ll_bbox: tuple[float, float, float, float]) -> Scene:
+    """Crop the datasets of a scene to a lon lat bounding box, leaving any on a stacked area as they are.
+
+    Full disk HRV is on a `StackedAreaDefinition` (its two parts are shifted), which satpy can't slice, so it is
+    kept whole and only its resample skips the rows and cols outside the area.
+    """
+    stacked = [k for k in scn.keys() if isinstance(scn[k].attrs.get("area"), StackedAreaDefinition)]
+    if not stacked:
+        return scn.crop(ll_bbox=ll_bbox)
+    cropped = [k for k in scn.keys() if k not in stacked]
+    new_scn = scn.crop(ll_bbox=ll_bbox, dataset_ids=cropped) if cropped else scn.copy(datasets=[])
+    for k in stacked:
+        new_scn[k] = scn[k]
+    return new_scn
+
+
+class ResampleCache:
+    """Resample scenes, sharing the bilinear coefficients between processes through `cache_dir`.
+
+    Satpy writes the cache in place, so the resample call is made holding a lock on the cache dir.
+    This only keeps the other processes waiting while the coefficients are first computed, once they are
+    cached the call just opens them (the data its self is resampled lazily, after the lock is dropped).
+    """
+
+    def __init__(self, cache_dir: Optional[str]):
+        self.cache_dir = cache_dir
+
+    def resample(self, scn: Scene, area_def: AreaDefinition, **kwargs) -> Scene:
+        if not self.cache_dir:
+            return scn.resample(area_def, resampler="bilinear", **kwargs)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return scn.resample(area_def, resampler="bilinear", cache_dir=self.cache_dir, **kwargs)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,169 @@
+"""Adaptive sizing of the downloader and extractor pools.
+
+The `Scheduler` watches how full the extract queue is, the free space on the RAM disk and the stage latencies,
+and grows or shrinks each `WorkerPool` a step at a time within its bounds.
+"""
+from __future__ import annotations
+
+import math
+import shutil
+import threading
+from dataclasses import dataclass
+from multiprocessing import JoinableQueue, Process
+from typing import Callable, Optional
+
+from absl import logging
+
+from eumetsat.pipeline.metrics import MetricsReporter
+
+
+class WorkerPool:
+    """Pool of worker procs that can be resized while running.
+
+    Workers exit when they take a `None` off their queue, so the pool shrinks by queueing one.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Process], queue: JoinableQueue,
+                 size: int, min_size: int = 1, max_size: Optional[int] = None):
+        self.name = name
+        self.factory = factory
+        self.queue = queue
+        self.min_size = min_size
+        self.max_size = max(size, max_size or size)
+        self.procs = []
+        self.stops = 0
+        for _ in range(size):
+            self._start()
+
+    def _start(self):
+        p = self.factory()
+        p.start()
+        self.procs.append(p)
+
+    @property
+    def size(self) -> int:
+        """Number of workers running, less those that have been asked to stop."""
+        return len(self.procs) - self.stops
+
+    def grow(self) -> bool:
+        if self.size >= self.max_size:
+            return False
+        self._start()
+        return True
+
+    def shrink(self) -> bool:
+        if self.size <= self.min_size:
+            return False
+        try:
+            self.queue.put_nowait(None)
+        except Exception:  # Queue is full, try again next time
+            return False
+        self.stops += 1
+        return True
+
+    def close(self):
+        """Queue a stop for each worker still running.
+
+        Workers that have exited cleanly took a stop off the queue, any that crashed did not,
+        so only the workers still alive, less the stops not yet taken, need one.
+        """
+        exited_ok = sum(1 for p in self.procs if p.exitcode == 0)
+        alive = sum(1 for p in self.procs if p.is_alive())
+        pending = self.stops - exited_ok
+        for _ in range(alive - pending):
+            self.queue.put(None)
+        self.stops += max(alive - pending, 0)
+
+    def join(self):
+        [p.join() for p in self.procs]
+
+
+@dataclass
+class Bounds:
+    high: float = 0.75  # Extract queue fill above which we are extract bound
+    low: float = 0.25  # Extract queue fill below which we are download bound
+
+
+def decide(file_fill: float, shm_ok: bool, ex: int, dl_rate: Optional[float] = None,
+           ex_latency: Optional[float] = None, bounds: Bounds = Bounds()) -> tuple[int, int]:
+    """Decide how to change the size of the pools.
+
+    Args:
+        file_fill: how full the extract queue is, 0 to 1
+        shm_ok: there is enough free space on the download RAM disk
+        ex: number of extractors
+        dl_rate: products downloaded per second, over all downloaders
+        ex_latency: seconds to extract a product
+
+    Returns:
+        Tuple of (downloader change, extractor change), each one of -1, 0 or 1
+    """
+    needed = math.ceil(dl_rate * ex_latency) if dl_rate is not None and ex_latency is not None else None
+    if file_fill >= bounds.high or not shm_ok:
+        return -1, 1
+    if file_fill <= bounds.low:
+        # An empty queue only means the extractors keep up, only drop one if fewer would still keep up
+        return 1, -1 if needed is not None and needed < ex else 0
+    if needed is not None:
+        # Neither side is backed up, move the extractors towards the number needed to keep up with the downloads
+        return 0, (needed > ex) - (needed < ex)
+    return 0, 0
+
+
+class Scheduler(threading.Thread):
+    """Periodically resize the pools from the queue back pressure."""
+
+    def __init__(self, downloaders: WorkerPool, extractors: WorkerPool, file_q: JoinableQueue, file_q_size: int,
+                 shm_path: str, shm_min_free: float, interval: float = 60, transfers_per_dl: int = 1,
+                 reporter: Optional[MetricsReporter] = None):
+        """Create a Scheduler
+
+        Args:
+            downloaders: pool of downloaders
+            extractors: pool of extractors
+            file_q: queue of downloaded files waiting to be extracted
+            file_q_size: max size of `file_q`
+            shm_path: path of the download RAM disk
+            shm_min_free: min free bytes on the RAM disk, below this it is treated as full
+            interval: seconds between checks
+            transfers_per_dl: concurrent transfers per downloader
+            reporter: metrics reporter to get stage latencies from, if there is one
+        """
+        super().__init__(daemon=True)
+        self.downloaders = downloaders
+        self.extractors = extractors
+        self.file_q = file_q
+        self.file_q_size = file_q_size
+        self.shm_path = shm_path
+        self.shm_min_free = shm_min_free
+        self.interval = interval
+        self.transfers_per_dl = transfers_per_dl
+        self.reporter = reporter
+        self._done = threading.Event()
+
+    def step(self):
+        file_fill = self.file_q.qsize() / self.file_q_size
+        shm_ok = shutil.disk_usage(self.shm_path).free >= self.shm_min_free
+
+        dl_rate, ex_latency = None, None
+        if self.reporter is not None:
+            dl_latency = self.reporter.recent_mean("download_seconds")
+            ex_latency = self.reporter.recent_mean("extract_seconds", total=True)
+            if dl_latency:
+                dl_rate = self.downloaders.size * self.transfers_per_dl / dl_latency
+
+        dl_change, ex_change = decide(file_fill, shm_ok, self.extractors.size,
+                                      dl_rate=dl_rate, ex_latency=ex_latency)
+        changed = [pool.grow() if change > 0 else pool.shrink()
+                   for pool, change in ((self.downloaders, dl_change), (self.extractors, ex_change)) if change]
+        if any(changed):
+            logging.info(f"Scheduler {file_fill=:.2f} {shm_ok=}: "
+                         f"{self.downloaders.size} downloaders, {self.extractors.size} extractors")
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.step()
+
+    def stop(self):
+        self._done.set()
+        self.join()
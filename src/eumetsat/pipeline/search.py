@@ -0,0 +1,251 @@
+"""Concurrent, cached product search against the EUMETSAT OpenSearch API.
+
+A search range is split into fixed, aligned windows (a day by default). The first page of every window is
+requested in parallel, and as soon as a first page gives the `totalResults` of its window the rest of its pages
+are requested too. The products of each window are kept in a local SQLite cache, so later runs over the same
+range are served from disk.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import pandas as pd
+import requests
+from absl import logging
+
+from eumetsat.pipeline.catalogue import slot_index
+from eumetsat.pipeline.metrics import Metrics
+from eumetsat.pipeline.ratelimit import TOO_MANY_REQUESTS, RateLimiter, retry_after
+
+Window = tuple[pd.Timestamp, pd.Timestamp]
+
+
+class SearchError(Exception):
+    """Raised when the search of some windows failed, with the products found in the rest."""
+
+    def __init__(self, failed: list[Window], products: list[dict]):
+        super().__init__(f"Search failed for {len(failed)} windows, the first from {failed[0][0]} to {failed[0][1]}")
+        self.failed = failed
+        self.products = products
+
+
+def product_time(product: dict) -> pd.Timestamp:
+    """Sensing start time of a product, as a naive UTC timestamp."""
+    ts = pd.Timestamp(product["properties"]["date"].split("/")[0])
+    return ts.tz_convert(None) if ts.tzinfo is not None else ts
+
+
+def product_sat(product: dict) -> str:
+    """Satellite of a product, e.g. MSG4."""
+    return product["id"][:4]
+
+
+def select_products(products: Iterable[dict], sat_pref: Sequence[str]) -> list[dict]:
+    """Pick one product for each 15 min slot, from the most preferred satellite that covers it.
+
+    Args:
+        products: search results
+        sat_pref: satellites to use, most preferred first, products from any others are dropped
+
+    Returns:
+        The selected products, in slot order
+    """
+    rank = {sat: i for i, sat in enumerate(sat_pref)}
+    best = {}
+    for p in products:
+        if product_sat(p) not in rank:
+            continue
+        slot = int(slot_index(product_time(p)))
+        if slot not in best or rank[product_sat(p)] < rank[product_sat(best[slot])]:
+            best[slot] = p
+    return [best[slot] for slot in sorted(best)]
+
+
+def total_results(page: dict) -> int:
+    total = page.get("totalResults", None)
+    total = total if total is not None else page["properties"].get("totalResults", None)
+    if total is None:
+        raise KeyError("Total Results Key missing")
+    return total
+
+
+def shard_ranges(start: datetime, end: datetime, shard: timedelta) -> list[Window]:
+    """Split a range into windows of `shard`, aligned to the epoch so the same windows are used on every run.
+
+    The first and last windows are widened to the alignment, so together they cover the range.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    edges = pd.date_range(start.floor(shard), end.ceil(shard), freq=shard)
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class SearchCache:
+    """SQLite cache of the products found in each search window.
+
+    A window's listing is fresh if it was fetched in the last `ttl`, or if it was fetched `settle` after the
+    window ended, by when the archive has all of the window's products and the listing will not change.
+    """
+
+    def __init__(self, path: str | Path, ttl: timedelta = timedelta(hours=1), settle: timedelta = timedelta(days=2)):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.settle = settle
+        self._conn = None
+        self._pid = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS windows (collection TEXT NOT NULL, start TEXT NOT NULL, "
+                               "end TEXT NOT NULL, fetched REAL NOT NULL, products TEXT NOT NULL, "
+                               "PRIMARY KEY (collection, start, end))")
+            self._pid = os.getpid()
+        return self._conn
+
+    def fresh(self, end: pd.Timestamp, fetched: float) -> bool:
+        fetched_at = pd.Timestamp(fetched, unit="s")
+        return fetched_at - end >= self.settle or time.time() - fetched < self.ttl.total_seconds()
+
+    def get(self, collection: str, window: Window) -> Optional[list[dict]]:
+        """Get the products of a window, if there is a fresh listing of it."""
+        row = self.db.execute("SELECT fetched, products FROM windows WHERE collection = ? AND start = ? AND end = ?",
+                              (collection, window[0].isoformat(), window[1].isoformat())).fetchone()
+        if row is None or not self.fresh(window[1], row[0]):
+            return None
+        return json.loads(row[1])
+
+    def put(self, collection: str, window: Window, products: list[dict]):
+        with self.db as db:
+            db.execute("INSERT OR REPLACE INTO windows (collection, start, end, fetched, products) "
+                       "VALUES (?, ?, ?, ?, ?)",
+                       (collection, window[0].isoformat(), window[1].isoformat(), time.time(), json.dumps(products)))
+
+
+class ProductSearch:
+    """Search for the products of a collection over a time range."""
+
+    def __init__(self, endpoint: str, collection_id: str, items_per_page: int = 100, workers: int = 8,
+                 shard: timedelta = timedelta(days=1), cache: Optional[SearchCache] = None, metrics: Metrics = None,
+                 limiter: RateLimiter = None):
+        """Create a ProductSearch
+
+        Args:
+            endpoint: OpenSearch endpoint
+            collection_id: id of the collection to search
+            items_per_page: products asked for in each request
+            workers: max concurrent requests
+            shard: size of the windows the range is split into, each is searched and cached on its own
+            cache: cache of the window listings, none to always search
+            metrics: to record search latency and failures on
+            limiter: rate limiter shared with the downloaders
+        """
+        self.endpoint = endpoint
+        self.collection_id = collection_id
+        self.items_per_page = items_per_page
+        self.workers = workers
+        self.shard = shard
+        self.cache = cache
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def page(self, window: Window, si: int) -> dict:
+        parameters = {'format': 'json',
+                      'pi': self.collection_id,
+                      "c": self.items_per_page,
+                      "si": si,
+                      'dtstart': window[0].strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                      'dtend': window[1].strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+                      }
+        while True:
+            self.limiter.acquire()
+            with self.metrics.timer("search_seconds"):
+                response = self.session.get(self.endpoint, params=parameters)
+            if response.status_code != TOO_MANY_REQUESTS:
+                break
+            hold = retry_after(response.headers)
+            hold = hold if hold is not None else 1
+            logging.warning(f"Search throttled, holding off requests for {hold:.0f}s")
+            self.metrics.inc("throttled")
+            self.limiter.block(hold)
+        if not response.ok:
+            raise requests.HTTPError(f"Request for {parameters} Failed: {response.text}", response=response)
+        return response.json()
+
+    def fetch(self, windows: list[Window]) -> dict[Window, list[dict]]:
+        """Search the windows, with all their pages requested concurrently.
+
+        Each window only keeps the products that start in it, so a product overlapping two windows is only listed
+        once. Windows with a failed request are left out, rather than returned with missing products.
+        """
+        pages = defaultdict(dict)
+        failed = set()
+        with ThreadPoolExecutor(self.workers) as pool:
+            pending = {pool.submit(self.page, w, 0): (w, 0) for w in windows}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    w, si = pending.pop(f)
+                    try:
+                        page = f.result()
+                        pages[w][si] = page["features"]
+                        if si == 0:
+                            for next_si in range(self.items_per_page, total_results(page), self.items_per_page):
+                                pending[pool.submit(self.page, w, next_si)] = (w, next_si)
+                    except Exception as e:
+                        logging.error(e)
+                        self.metrics.inc("failures", stage="search")
+                        failed.add(w)
+
+        found = {}
+        for w in windows:
+            if w in failed:
+                continue
+            products = [p for si in sorted(pages[w]) for p in pages[w][si]]
+            found[w] = [p for p in products if w[0] <= product_time(p) < w[1]]
+        return found
+
+    def search(self, start: datetime, end: datetime) -> list[dict]:
+        """Get the products that start in the range, in time order.
+
+        Raises:
+            SearchError: if any window failed, the windows that didn't are still cached and their products are on
+                the error, so a caller can use them but knows the range is not complete
+        """
+        windows = shard_ranges(start, end, self.shard)
+        found = {}
+        if self.cache is not None:
+            for w in windows:
+                products = self.cache.get(self.collection_id, w)
+                if products is not None:
+                    found[w] = products
+        todo = [w for w in windows if w not in found]
+        logging.info(f"Searching {len(todo)} of {len(windows)} windows, {len(found)} cached")
+
+        fetched = self.fetch(todo)
+        if self.cache is not None:
+            for w, products in fetched.items():
+                self.cache.put(self.collection_id, w, products)
+        found.update(fetched)
+
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        products = [p for w in windows for p in found.get(w, [])]
+        products = sorted((p for p in products if start <= product_time(p) < end), key=product_time)
+        failed = [w for w in todo if w not in fetched]
+        if failed:
+            raise SearchError(failed, products)
+        return products
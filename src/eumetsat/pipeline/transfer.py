@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import os
+import random
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Mapping, Optional
+
+import aiohttp
+from absl import logging
+
+from eumetsat.pipeline.ratelimit import TOO_MANY_REQUESTS, RateLimiter, retry_after
+
+
+class DownloadError(Exception):
+    """Raised when a transfer does not match what the server said it would send."""
+
+
+def parse_content_range(content_range: str) -> tuple[int, Optional[int]]:
+    """Parse a `Content-Range` header.
+
+    Args:
+        content_range: header value, in the form `bytes <start>-<end>/<total>`, total may be `*`
+
+    Returns:
+        Tuple of (start byte, total size or None if unknown)
+    """
+    match = re.fullmatch(r"bytes (\d+)-\d+/(\d+|\*)", content_range.strip())
+    if match is None:
+        raise DownloadError(f"Bad Content-Range: {content_range}")
+    start, total = match.groups()
+    return int(start), None if total == "*" else int(total)
+
+
+def content_md5(headers: Mapping[str, str]) -> Optional[str]:
+    """Get the hex md5 of the body from the `Content-MD5` or `Digest` headers, if the server sent one."""
+    b64 = headers.get("Content-MD5")
+    if b64 is None:
+        digests = dict(d.strip().split("=", 1) for d in headers.get("Digest", "").split(",") if "=" in d)
+        b64 = {k.lower(): v for k, v in digests.items()}.get("md5")
+    return base64.b64decode(b64).hex() if b64 else None
+
+
+def file_md5(path: str, block_size: int = 8 * 1024 * 1024) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def backoff(attempt: int, base: float, cap: float = 300) -> float:
+    """Exponential backoff with jitter, in seconds, for the given (1 based) retry attempt."""
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+
+
+@dataclass
+class Transfer:
+    """State of a resumable download, kept across retries.
+
+    Data is written to `<path>.part` and only moved to `path` once its size (and md5 if known) is checked,
+    so a partial product never makes it to the extractors. A retry picks up from the end of the `.part` file
+    with a HTTP Range request.
+    """
+    path: Optional[str] = None
+    total: Optional[int] = None
+    md5: Optional[str] = None
+
+    @property
+    def part(self) -> str:
+        return f"{self.path}.part"
+
+    @property
+    def offset(self) -> int:
+        """Number of bytes already downloaded."""
+        if self.path is None or not os.path.exists(self.part):
+            return 0
+        return os.path.getsize(self.part)
+
+    def headers(self) -> dict[str, str]:
+        """Request headers for the next attempt."""
+        offset = self.offset
+        return {"Range": f"bytes={offset}-"} if offset else {}
+
+    def complete(self, status: int) -> bool:
+        """Check if the server is telling us, with a 416 to a resume request, that there is nothing left to get."""
+        return status == 416 and self.offset > 0
+
+    def begin(self, status: int, headers: Mapping[str, str], path: str) -> Optional[str]:
+        """Start writing a response.
+
+        Args:
+            status: HTTP status code of the response
+            headers: response headers
+            path: path the product should be saved to, used on the first response
+
+        Returns:
+            The mode to open the `.part` file with, or None if the response should be dropped and requested again
+            with a Range, this happens when a `.part` is left from an earlier run.
+        """
+        if self.path is None:
+            self.path = path
+            if self.offset and headers.get("Accept-Ranges") == "bytes":
+                return None
+
+        if status == 206:
+            start, total = parse_content_range(headers["Content-Range"])
+            if start != self.offset:
+                raise DownloadError(f"Asked for range from {self.offset} got {start}")
+            self.total = total if total is not None else self.total
+            return "ab"
+
+        # Full body, the server ignored the range (or there was none) so start again
+        length = headers.get("Content-Length")
+        self.total = int(length) if length is not None else None
+        self.md5 = content_md5(headers) or self.md5
+        return "wb"
+
+    def finish(self) -> str:
+        """Check the `.part` file and move it into place.
+
+        Raises:
+            DownloadError: if the size or md5 does not match, a short file is kept so the next attempt can resume it.
+        """
+        size = os.path.getsize(self.part)
+        if self.total is not None and size < self.total:
+            raise DownloadError(f"Short transfer {size} of {self.total} bytes for {self.path}")
+        if self.total is not None and size > self.total:
+            os.remove(self.part)
+            raise DownloadError(f"Transfer too long {size} of {self.total} bytes for {self.path}")
+        if self.md5 is not None and file_md5(self.part) != self.md5:
+            os.remove(self.part)
+            raise DownloadError(f"Checksum mismatch for {self.path}")
+        os.replace(self.part, self.path)
+        return self.path
+
+
+async def download_async(session: aiohttp.ClientSession, url: str, token: Callable[[], Awaitable[str]],
+                         target: Callable[[str], str], limiter: Optional[RateLimiter] = None,
+                         throttle: Optional[Callable[[Mapping[str, str]], None]] = None, retries: int = 5,
+                         backoff_base: float = 5, chunk_size: int = 2 ** 20) -> str:
+    """Download a product on an asyncio loop, resuming and retrying failed transfers.
+
+    Args:
+        session: HTTP session to make the requests on, shared by all the transfers of the loop
+        url: data url of the product
+        token: coroutine function giving the current access token
+        target: path to save the product to, given the `Content-Disposition` header of the response
+        limiter: rate limiter acquired before every request
+        throttle: called with the headers of a 429 response before the request is made again, by default the
+            limiter holds off for the `Retry-After` or `backoff_base` seconds
+        retries: times to retry (resume) a failed transfer
+        backoff_base: base retry backoff in seconds
+        chunk_size: bytes read from the response at a time
+
+    Returns:
+        Path of the downloaded product
+    """
+    limiter = limiter if limiter is not None else RateLimiter()
+    if throttle is None:
+        def throttle(headers):
+            wait = retry_after(headers)
+            limiter.block(wait if wait is not None else backoff_base)
+
+    transfer = Transfer()
+    attempt = 0
+    while True:
+        try:
+            access_token = await token()
+            await limiter.acquire_async()
+            async with session.get(url, params={"access_token": access_token}, headers=transfer.headers()) as res:
+                if res.status == TOO_MANY_REQUESTS:
+                    throttle(res.headers)
+                    continue
+                if transfer.complete(res.status):
+                    return transfer.finish()
+                res.raise_for_status()
+                path = target(res.headers["Content-Disposition"])
+                mode = transfer.begin(res.status, res.headers, path)
+                if mode is None:
+                    continue
+                logging.info(f"{url} -> {path} from byte {transfer.offset}")
+                # Writes go to the RAM disk, so they are cheap enough to do on the loop
+                with open(transfer.part, mode) as f:
+                    async for c in res.content.iter_chunked(chunk_size):
+                        f.write(c)
+            return transfer.finish()
+        except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+            attempt += 1
+            if attempt > retries:
+                raise
+            wait = backoff(attempt, backoff_base)
+            logging.warning(f"Download of {url} failed ({e}), retry {attempt} in {wait:.0f}s")
+            await asyncio.sleep(wait)
@@ -0,0 +1,59 @@
+"""Read the SEVIRI `.nat` file straight out of the downloaded product zip.
+
+Satpy readers accept an `FSFile` (a file on an fsspec filesystem) in place of a path, so rather than extracting
+the `.nat` next to the zip we give the reader a filesystem that reads the member where it is:
+    - stored (uncompressed) members are read as a byte range of the zip file via a `reference` filesystem,
+      on a RAM disk this is a plain memory copy of the pages the reader asks for
+
+Compressed members are not read in place, the reader seeks back and forth through the file and every backward
+seek in a deflate stream starts the decompression again from the start of the member. They are extracted next to
+the zip instead, as if `--zip_in_place` was not set. Real products are stored, so this is only a fallback.
+"""
+import os
+import struct
+import zipfile
+from typing import Optional, Union
+
+import fsspec
+from absl import logging
+from satpy.readers.core.remote import FSFile
+
+LOCAL_HEADER_SIG = b"PK\x03\x04"
+
+
+def member_data_offset(zip_path: str, info: zipfile.ZipInfo) -> int:
+    """Byte offset of the start of a members data in the zip file.
+
+    The offset in the central directory points at the members local header, which has a variable length
+    file name and extra field before the data.
+    """
+    with open(zip_path, "rb") as f:
+        f.seek(info.header_offset)
+        header = f.read(zipfile.sizeFileHeader)
+    if header[:4] != LOCAL_HEADER_SIG:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename} in {zip_path}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + zipfile.sizeFileHeader + name_len + extra_len
+
+
+def nat_source(zip_path: str, suffix: str = ".nat", extract_dir: Optional[str] = None) -> Union[FSFile, str]:
+    """Get a source for the `.nat` member of a product zip, to pass to a satpy `Scene`.
+
+    Args:
+        zip_path: path to the product zip
+        suffix: suffix of the member to read
+        extract_dir: dir to extract a compressed member to, defaults to the dir of the zip
+
+    Returns:
+        FSFile named after the member, so satpy can match the reader file pattern against it, or the path
+        of the extracted member if it is compressed
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        info = next(i for i in zf.infolist() if i.filename.endswith(suffix))
+        if info.compress_type != zipfile.ZIP_STORED:
+            logging.warning(f"{info.filename} in {zip_path} is compressed, extracting it rather than reading in place")
+            return zf.extract(info, path=extract_dir or os.path.dirname(zip_path))
+
+    offset = member_data_offset(zip_path, info)
+    fs = fsspec.filesystem("reference", fo={info.filename: [zip_path, offset, info.file_size]})
+    return FSFile(info.filename, fs)
@@ -23,6 +23,16 @@ class _DataSpecs:
 
 dataspec = _DataSpecs()
 
+
+def get_ll_bbox(margin: float = 0.) -> tuple[float, float, float, float]:
+    """Get the lon lat bounding box of the area, as (min lon, min lat, max lon, max lat) in degrees.
+
+    Args:
+        margin: degrees to grow the box by on each side, e.g. to keep the pixels needed to resample the edges
+    """
+    return (dataspec.min_lon - margin, dataspec.min_lat - margin,
+            dataspec.max_lon + margin, dataspec.max_lat + margin)
+
 def get_area_def() -> AreaDefinition:
     area_extent = AREA_EXTENT
     area_id = "UK"
@@ -0,0 +1,78 @@
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import serde.json
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.datasets.numpy_dataset import EMNumpyDataset
+from eumetsat.datasets.utils import Metadata
+
+FLAGS = flags.FLAGS
+
+
+class TestEMNumpyDataset(parameterized.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name) / "img_z=2018-01-01T00_00_00,e=2018-01-01T05_00_00,f=3600.npy"
+        imgs = np.zeros((6, 500, 500, 12), dtype=np.uint8)
+        imgs[:] = np.arange(6, dtype=np.uint8)[:, None, None, None]
+        imgs[..., 3] = np.arange(500, dtype=np.uint16)[None, :, None] % 256
+        self.imgs = imgs
+        np.save(self.path, imgs)
+        self.ds = EMNumpyDataset(str(self.path))
+        self.z = self.ds.props.zero_timestamp
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    @parameterized.parameters(0, 1, 4)
+    def test_iter_batches(self, prefetch):
+        batches = [np.array([0, 1]), np.array([5]), np.array([2, 3, 4])]
+        got = list(self.ds.iter_batches([self.z + b * 3600 for b in batches], prefetch=prefetch))
+
+        self.assertLen(got, 3)
+        for b, batch in zip(batches, got):
+            self.assertEqual(batch[:, 0, 0, 0].tolist(), b.tolist())
+
+    @parameterized.parameters((None,), ([3, 0],), (["IR_016", "HRV"],))
+    def test_patches(self, channels):
+        ts, ys, xs = np.array([1, 4]), np.array([0, 468]), np.array([100, 7])
+        got = self.ds.patches_from_timestamps(self.z + ts * 3600, ys, xs, 32, channels)
+
+        c = list(range(12)) if channels is None else [3, 0]
+        self.assertEqual(got.shape, (2, 32, 32, len(c)))
+        for i, (t, y, x) in enumerate(zip(ts, ys, xs)):
+            np.testing.assert_array_equal(got[i], self.imgs[t, y:y + 32, x:x + 32][..., c])
+
+    def test_patches_out_of_bounds(self):
+        with self.assertRaises(ValueError):
+            self.ds.patches_from_timestamps([self.z], [480], [0], 32)
+        # Before the first and after the last timestamp
+        for ts in (self.z - 3600, self.z + 6 * 3600):
+            with self.assertRaises(ValueError):
+                self.ds.patches_from_timestamps([ts], [0], [0], 32)
+
+    def write_meta(self, last: datetime, missing: set[datetime]):
+        metadata = Metadata(metadata_created=datetime.now(), data_source=Path("pngs"), data_location=self.path,
+                            first_example_date=datetime(2018, 1, 1), last_example_date=last,
+                            example_count=6 - len(missing), missing=missing, freq_seconds=3600)
+        self.ds.meta_path.write_text(serde.json.to_json(metadata))
+
+    def test_valid_mask(self):
+        # No metadata
+        with self.assertRaises(FileNotFoundError):
+            self.ds.valid_mask
+        self.assertEqual(EMNumpyDataset(str(self.path), assume_valid=True).valid_mask.tolist(), [True] * 6)
+
+        self.write_meta(datetime(2018, 1, 1, 5), {datetime(2018, 1, 1, 2)})
+        ds = EMNumpyDataset(str(self.path))
+        self.assertEqual(ds.valid_mask.tolist(), [True, True, False, True, True, True])
+
+    def test_valid_mask_wrong_length(self):
+        self.write_meta(datetime(2018, 1, 1, 7), set())
+        with self.assertRaises(ValueError):
+            EMNumpyDataset(str(self.path)).valid_mask
@@ -1,8 +1,14 @@
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tensorstore
 from absl import flags
 from absl.testing import parameterized
 
 from eumetsat.datasets.tensorstore_dataset import EMTensorstoreDataset
-from hemera import path_translator
+from eumetsat.datasets.utils import get_n5_spec
 
 FLAGS = flags.FLAGS
 
@@ -11,5 +17,36 @@ FLAGS = flags.FLAGS
 class TestEMTesnorstoreDataset(parameterized.TestCase):
 
     def test_extract(self):
+        # Needs the real data, only the other tests run without hemera
+        path_translator = pytest.importorskip("hemera.path_translator")
         path = path_translator.get_path("data") / "EUMETSAT" / "UK-EXT" / "img_z=1514764800,e=1515110340,f=3600.ts"
-        ext = EMTensorstoreDataset(path)
\ No newline at end of file
+        ext = EMTensorstoreDataset(path)
+
+    def test_iter_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "img_z=2018-01-01T00_00_00,e=2018-01-01T05_00_00,f=3600.ts.zarr"
+            store = tensorstore.open(get_n5_spec(path, 6, 3600, create=True)).result()
+            for i in range(6):
+                store[i, 0, 0, 0].write(i).result()
+            ds = EMTensorstoreDataset(path)
+            z = ds.props.zero_timestamp
+
+            batches = [np.array([0, 1]), np.array([5]), np.array([2, 3, 4])]
+            got = list(ds.iter_batches([z + b * 3600 for b in batches], prefetch=2))
+
+            self.assertEqual([b[:, 0, 0, 0].tolist() for b in got], [b.tolist() for b in batches])
+            self.assertEqual(ds.batch_from_timesamps_idx(np.array([z + 3600]))[:, 0, 0, 0].tolist(), [1])
+
+    def test_patches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "img_z=2018-01-01T00_00_00,e=2018-01-01T05_00_00,f=3600.ts.zarr"
+            store = tensorstore.open(get_n5_spec(path, 6, 3600, create=True)).result()
+            imgs = np.random.default_rng(0).integers(0, 255, (2, 500, 500, 12), dtype=np.uint8)
+            store[2:4].write(imgs).result()
+            ds = EMTensorstoreDataset(path)
+
+            ts, ys, xs = np.array([3, 2]), np.array([240, 0]), np.array([5, 468])
+            got = ds.patches_from_timestamps(ds.props.zero_timestamp + ts * 3600, ys, xs, 32, ["WV_062", 11])
+
+            for i, (t, y, x) in enumerate(zip(ts, ys, xs)):
+                np.testing.assert_array_equal(got[i], imgs[t - 2, y:y + 32, x:x + 32][..., [5, 11]])
@@ -0,0 +1,77 @@
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import serde.json
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.datasets.numpy_dataset import EMNumpyDataset
+from eumetsat.datasets.sampler import SequenceSampler
+from eumetsat.datasets.utils import Metadata
+
+FLAGS = flags.FLAGS
+
+
+class TestSequenceSampler(parameterized.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.dir.name) / "img_z=2018-01-01T00_00_00,e=2018-01-01T09_00_00,f=3600.npy"
+        np.save(self.path, np.zeros((10, 1, 1, 12), dtype=np.uint8))
+        self.write_meta({datetime(2018, 1, 1, 3), datetime(2018, 1, 1, 7)})
+        self.ds = EMNumpyDataset(str(self.path))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_meta(self, missing):
+        meta = Metadata(metadata_created=datetime(2018, 2, 1), data_source=Path("src"), data_location=self.path,
+                        first_example_date=datetime(2018, 1, 1), last_example_date=datetime(2018, 1, 1, 9),
+                        example_count=10 - len(missing), missing=missing, freq_seconds=3600)
+        self.path.with_suffix(".meta.json").write_text(serde.json.to_json(meta))
+
+    @parameterized.parameters((1, 1, 1, [0, 1, 2, 4, 5, 6, 8, 9]),
+                              (3, 1, 1, [0, 4]),
+                              (2, 2, 1, [0, 4, 8]),
+                              (2, 1, 2, [0, 2, 4, 6]),
+                              (3, 2, 2, [0, 2, 4]),
+                              (11, 1, 1, []))
+    def test_valid_starts(self, window, stride, step, true):
+        sampler = SequenceSampler(self.ds, window, stride=stride, step=step, cache=False)
+
+        self.assertEqual(sampler.starts.tolist(), true)
+        for w in sampler.windows(sampler.starts):
+            self.assertTrue(self.ds.valid_mask[w].all())
+
+    def test_batches(self):
+        sampler = SequenceSampler(self.ds, 1, cache=False)
+
+        self.assertEqual([b.tolist() for b in sampler.batches(3)], [[0, 1, 2], [4, 5, 6], [8, 9]])
+        self.assertLen(list(sampler.batches(3, drop_remainder=True)), 2)
+        shuffled = np.concatenate(list(sampler.batches(3, shuffle=True, seed=1)))
+        self.assertEqual(sorted(shuffled.tolist()), sampler.starts.tolist())
+        self.assertNotEqual(shuffled.tolist(), sampler.starts.tolist())
+
+    def test_timestamps(self):
+        sampler = SequenceSampler(self.ds, 3, step=2, cache=False)
+        z = self.ds.props.zero_timestamp
+
+        self.assertEqual(sampler.timestamps(np.array([1])).tolist(), [[z + 3600, z + 3 * 3600, z + 5 * 3600]])
+
+    def test_cache(self):
+        sampler = SequenceSampler(self.ds, 3)
+        self.assertEqual(sampler.starts.tolist(), [0, 4])
+        self.assertTrue(sampler.cache_path.exists())
+
+        # Served from the cache
+        np.save(sampler.cache_path, np.array([1, 2, 3]))
+        self.assertEqual(SequenceSampler(self.ds, 3).starts.tolist(), [1, 2, 3])
+
+        # Rebuilt once the metadata is newer
+        self.write_meta({datetime(2018, 1, 1, 7)})
+        meta_path = self.ds.meta_path
+        os.utime(meta_path, (meta_path.stat().st_atime, sampler.cache_path.stat().st_mtime + 1))
+        self.assertEqual(SequenceSampler(EMNumpyDataset(str(self.path)), 3).starts.tolist(), [0, 1, 2, 3, 4])
@@ -0,0 +1,88 @@
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import tensorstore
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.datasets.store import chunker, drop_missing_blocks, find_store, open_store, to_update
+from eumetsat.datasets.utils import FileNameProps, Metadata, get_n5_spec
+
+FLAGS = flags.FLAGS
+
+Z = int(datetime(2018, 1, 1).timestamp())
+
+
+def kvs(idxs) -> list[tuple[int, str]]:
+    return [(Z + i * 3600, f"t={i}") for i in idxs]
+
+
+def metadata(last: datetime, missing: set[datetime]) -> Metadata:
+    return Metadata(metadata_created=datetime.now(), data_source=Path("src"), data_location=Path("dst"),
+                    first_example_date=datetime(2018, 1, 1), last_example_date=last, example_count=0,
+                    missing=missing, freq_seconds=3600)
+
+
+class TestStore(parameterized.TestCase):
+
+    def test_chunker(self):
+        chunks = chunker(kvs(range(10)), 4, Z, 3600)
+        self.assertEqual([(o, len(c)) for o, c in chunks], [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual([kv for _, c in chunks for kv in c], kvs(range(10)))
+
+    def test_chunker_gaps(self):
+        # Gaps split a run, giving short chunks in the middle of it, and chunks never cross a multiple of size
+        chunks = chunker(kvs([0, 1, 3, 4, 5, 6, 9]), 4, Z, 3600)
+        self.assertEqual([(o, [kv[1] for kv in c]) for o, c in chunks],
+                         [(0, ["t=0", "t=1"]), (3, ["t=3"]), (4, ["t=4", "t=5", "t=6"]), (9, ["t=9"])])
+
+    def test_drop_missing_blocks(self):
+        date_dict = dict(kvs(range(12)))
+        # Block 1 (4-7) is all missing, block 2 (8-11) only partly
+        expected_missing = {datetime.utcfromtimestamp(Z + i * 3600) for i in (4, 5, 6, 7, 9)}
+        kept = drop_missing_blocks(date_dict, expected_missing, 4, Z, 3600)
+        self.assertEqual([v for v in kept.values()], [f"t={i}" for i in (0, 1, 2, 3, 8, 9, 10, 11)])
+
+        # The chunks of what is left skip the dropped block, and don't cross the block boundaries
+        chunks = chunker(list(kept.items()), 4, Z, 3600)
+        self.assertEqual([(o, len(c)) for o, c in chunks], [(0, 4), (8, 4)])
+
+    def test_find_store(self):
+        base = Path(tempfile.mkdtemp())
+        for end, meta in ((datetime(2018, 1, 2), True), (datetime(2018, 1, 3), True), (datetime(2018, 1, 4), False)):
+            path = base / f"{FileNameProps(time_zero=datetime(2018, 1, 1), time_end=end, freq=3600)}.ts.zarr"
+            path.mkdir()
+            if meta:
+                (path / "img_meta.json").touch()
+        other = base / f"{FileNameProps(time_zero=datetime(2018, 1, 1), time_end=datetime(2018, 2, 1), freq=900)}.ts.zarr"
+        other.mkdir()
+        (other / "img_meta.json").touch()
+
+        # The longest store with metadata, at the same start and freq
+        found = find_store(base, datetime(2018, 1, 1), 3600)
+        self.assertEqual(FileNameProps.from_str(found.name).time_end, datetime(2018, 1, 3))
+        self.assertIsNone(find_store(base, datetime(2018, 1, 5), 3600))
+
+    def test_to_update(self):
+        target = pd.date_range("2018-01-01 00:00", "2018-01-01 09:00", freq="60min")
+        meta = metadata(datetime(2018, 1, 1, 5), {pd.Timestamp("2018-01-01 02:00"), pd.Timestamp("2018-01-01 03:00")})
+        expected_missing = {pd.Timestamp("2018-01-01 03:00"), pd.Timestamp("2018-01-01 08:00")}
+        todo = to_update(target, meta, expected_missing)
+        self.assertEqual(sorted(todo), [pd.Timestamp(f"2018-01-01 {h:02}:00") for h in (2, 6, 7, 9)])
+
+    def test_open_store(self):
+        path = Path(tempfile.mkdtemp()) / "img_z=2018-01-01T00_00_00,e=2018-01-01T05_00_00,f=3600.ts.zarr"
+        store = tensorstore.open(get_n5_spec(path, 6, 3600, create=True, block_size=(4, 250, 250, 12))).result()
+        store[5, 0, 0, 0].write(5).result()
+
+        grown = open_store(path, 10, 3600)
+        self.assertEqual(grown.shape, (10, 500, 500, 12))
+        self.assertEqual(grown.chunk_layout.write_chunk.shape[0], 4)  # Keeps the layout it was made with
+        self.assertEqual(grown[5, 0, 0, 0].read().result(), 5)
+        grown[9, 0, 0, 0].write(9).result()
+
+        reopened = open_store(path, 10, 3600)
+        np.testing.assert_array_equal(reopened[:, 0, 0, 0].read().result(), [0, 0, 0, 0, 0, 5, 0, 0, 0, 9])
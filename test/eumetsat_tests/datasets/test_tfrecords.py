@@ -0,0 +1,59 @@
+import json
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+from absl import flags
+from absl.testing import parameterized
+
+tf = pytest.importorskip("tensorflow")
+
+from eumetsat.datasets.tfrecords import load_records, record_windows, serialize_example
+
+FLAGS = flags.FLAGS
+
+Z = int(datetime(2018, 1, 1).timestamp())
+
+
+def write_shard(path: Path, name: str, times: list[int], valid: list[bool], codec: str = "GZIP"):
+    """Write a shard and its index as `pngs_to_tfdata.py` does, each image is filled with its index."""
+    with tf.io.TFRecordWriter(str(path / f"{name}.tfrecord"), options=tf.io.TFRecordOptions(compression_type=codec)) as w:
+        for ts, v in zip(times, valid):
+            if v:
+                w.write(serialize_example(ts, np.full((500, 500, 12), (ts - Z) // 3600, dtype=np.uint8)))
+    index = {"shard": f"{name}.tfrecord", "codec": codec, "timestamps": times, "valid": valid, "records": sum(valid)}
+    with (path / f"{name}.index.json").open("w") as f:
+        json.dump(index, f)
+
+
+class TestTfRecords(parameterized.TestCase):
+
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp()) / "img_z=2018-01-01T00_00_00,e=2018-01-01T11_00_00,f=3600.tfrecords"
+        self.path.mkdir()
+        times = [Z + i * 3600 for i in range(12)]
+        # Hour 3 has no pngs, hour 8 was listed as valid but its pngs were not found
+        valid = [i not in (3, 8) for i in range(12)]
+        write_shard(self.path, "shard=2018-01-a", times[:6], valid[:6])
+        write_shard(self.path, "shard=2018-01-b", times[6:], valid[6:])
+
+    def test_record_windows(self):
+        # Records are the valid timestamps 0, 1, 2, 4, 5, windows of 2 start at 0, 1 and 4
+        self.assertEqual(record_windows([True, True, True, False, True, True], 2).tolist(),
+                         [True, True, False, True, False])
+
+    @parameterized.parameters((1, [[0], [1], [2], [4], [5], [6], [7], [9], [10], [11]]),
+                              (2, [[0, 1], [1, 2], [4, 5], [6, 7], [9, 10], [10, 11]]),
+                              (3, [[0, 1, 2], [9, 10, 11]]))
+    def test_load_records(self, window, true):
+        got = [(ts.numpy(), img.numpy()) for ts, img in load_records(self.path, window, deterministic=True)]
+        self.assertEqual(sorted(((ts - Z) // 3600).tolist() for ts, _ in got), true)
+        for ts, img in got:
+            self.assertEqual(img.shape, (window, 500, 500, 12))
+            np.testing.assert_array_equal(img[:, 0, 0, 0], (ts - Z) // 3600)
+
+    def test_load_records_empty(self):
+        path = Path(tempfile.mkdtemp())
+        self.assertEmpty(list(load_records(path, 2)))
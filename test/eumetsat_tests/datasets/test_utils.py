@@ -1,7 +1,10 @@
+from datetime import datetime
+from pathlib import Path
+
 from absl import flags
 from absl.testing import parameterized
 
-from eumetsat.datasets.utils import FileNameProps
+from eumetsat.datasets.utils import FileNameProps, Metadata, get_n5_spec, n5_compression
 
 FLAGS = flags.FLAGS
 
@@ -20,3 +23,45 @@ class test_path_translater(parameterized.TestCase):
         self.assertEqual(ext.time_zero, true["z"])
         self.assertEqual(ext.time_end, true["e"])
         self.assertEqual(ext.freq, true["f"])
+
+    def test_file_name_round_trip(self):
+        props = FileNameProps(time_zero=datetime(2018, 1, 1), time_end=datetime(2018, 1, 4, 23), freq=3600)
+        ext = FileNameProps.from_str(f"{props}.ts.zarr")
+
+        self.assertEqual(ext, props)
+        self.assertEqual(ext.zero_timestamp, 1514764800)
+        self.assertEqual(ext.samples, 96)
+        self.assertEqual(ext.timestamp_to_idx(1514764800 + 7200), 2)
+
+
+class test_n5_spec(parameterized.TestCase):
+
+    @parameterized.parameters(("zstd", 5, 2, {"type": "blosc", "cname": "zstd", "clevel": 5, "shuffle": 2}),
+                              ("raw", 9, 0, {"type": "raw"}))
+    def test_compression(self, cname, clevel, shuffle, true):
+        self.assertEqual(n5_compression(cname, clevel, shuffle), true)
+
+    def test_layout(self):
+        spec = get_n5_spec(Path("x.ts.zarr"), 96, 3600, block_size=(4, 64, 64, 1), compression=n5_compression("lz4"))
+
+        self.assertEqual(spec["schema"]["domain"]["shape"], [96, 500, 500, 12])
+        self.assertEqual(spec["metadata"]["blockSize"], [4, 64, 64, 1])
+        self.assertEqual(spec["metadata"]["compression"]["cname"], "lz4")
+        self.assertEqual(get_n5_spec(Path("x.ts.zarr"), 96, 3600)["metadata"]["compression"], n5_compression())
+
+
+class test_metadata(parameterized.TestCase):
+
+    def setUp(self):
+        self.meta = Metadata(metadata_created=datetime(2018, 2, 1), data_source=Path("src"), data_location=Path("dst"),
+                             first_example_date=datetime(2018, 1, 1), last_example_date=datetime(2018, 1, 1, 5),
+                             example_count=4, missing={datetime(2018, 1, 1, 2), datetime(2018, 1, 1, 3)},
+                             freq_seconds=3600)
+
+    def test_validity_mask(self):
+        self.assertEqual(self.meta.validity_mask().tolist(), [True, True, False, False, True, True])
+
+    def test_validity_mask_range(self):
+        mask = self.meta.validity_mask(datetime(2017, 12, 31, 23), datetime(2018, 1, 1, 7), freq=7200)
+
+        self.assertEqual(mask.tolist(), [False, True, False, True, False])
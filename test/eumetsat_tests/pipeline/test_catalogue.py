@@ -0,0 +1,69 @@
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat import IMG_LAYERS
+from eumetsat.pipeline.catalogue import FULL_MASK, Catalogue, gap_ranges, slot_index, slot_time
+
+FLAGS = flags.FLAGS
+
+
+class TestCatalogue(parameterized.TestCase):
+
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp())
+        self.catalogue = Catalogue(self.path / "catalogue.sqlite")
+
+    def test_slot_index(self):
+        self.assertEqual(slot_index(datetime(1970, 1, 1, 0, 14)), 0)
+        self.assertEqual(slot_index(datetime(1970, 1, 1, 0, 15)), 1)
+        times = pd.date_range("2020-01-01", periods=4, freq="15min")
+        np.testing.assert_array_equal(slot_time(slot_index(times)), times)
+
+    def test_mark(self):
+        times = pd.date_range("2020-01-01", periods=4, freq="15min")
+        self.catalogue.mark(datetime(2020, 1, 1, 0, 0, 9))
+        self.catalogue.mark(datetime(2020, 1, 1, 0, 30, 9), IMG_LAYERS[:6])
+        np.testing.assert_array_equal(self.catalogue.missing(times), [False, True, True, True])
+
+        # Layers are added to the slot
+        self.catalogue.mark(datetime(2020, 1, 1, 0, 30, 9), IMG_LAYERS[6:])
+        np.testing.assert_array_equal(self.catalogue.missing(times), [False, True, False, True])
+
+    def test_scan(self):
+        times = pd.date_range("2020-01-01", periods=4, freq="15min")
+        for l in IMG_LAYERS:
+            png = self.path / f"year=2020/month=01/day=01/time=00_15/format={l}/img.png"
+            png.parent.mkdir(parents=True)
+            png.touch()
+        self.assertEqual(self.catalogue.scan(self.path, times), 1)
+        np.testing.assert_array_equal(self.catalogue.missing(times), [True, False, True, True])
+
+    def test_gap_ranges(self):
+        times = pd.date_range("2020-01-01", periods=6, freq="15min")
+        missing = np.array([True, True, False, True, True, True])
+        self.assertEqual(gap_ranges(times, missing, max_slots=2),
+                         [(times[0], times[2]), (times[3], times[5]), (times[5], times[5] + pd.Timedelta("15min"))])
+
+    def test_satellite(self):
+        t = datetime(2020, 1, 1, 0, 0, 9)
+        self.catalogue.mark(t, IMG_LAYERS[:6], sat="MSG4")
+        self.catalogue.mark(t, IMG_LAYERS[6:])
+        self.assertEqual(self.catalogue.satellite(t), "MSG4")
+        self.assertIsNone(self.catalogue.satellite(datetime(2020, 1, 1, 0, 15)))
+
+    def test_migrate(self):
+        path = self.path / "old.sqlite"
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE slots (slot INTEGER PRIMARY KEY, layers INTEGER NOT NULL)")
+            conn.execute("INSERT INTO slots VALUES (?, ?)", (int(slot_index(datetime(2020, 1, 1))), FULL_MASK))
+        catalogue = Catalogue(path)
+        self.assertFalse(catalogue.missing([datetime(2020, 1, 1)])[0])
+        catalogue.mark(datetime(2020, 1, 1, 0, 15), sat="MSG3")
+        self.assertEqual(catalogue.satellite(datetime(2020, 1, 1, 0, 15)), "MSG3")
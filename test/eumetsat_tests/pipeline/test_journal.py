@@ -0,0 +1,101 @@
+import json
+import tempfile
+from pathlib import Path
+
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline import journal as J
+from eumetsat.pipeline.journal import Journal, JournalReader
+
+FLAGS = flags.FLAGS
+
+
+class TestJournal(parameterized.TestCase):
+
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp()) / "journal.jsonl"
+        self.journal = Journal(self.path)
+
+    def test_replay(self):
+        self.journal.record(J.SEARCHED, "a", product={"id": "a"})
+        self.journal.record(J.SEARCHED, "b", product={"id": "b"})
+        self.journal.record(J.DOWNLOADING, "a")
+        self.journal.record(J.DOWNLOADED, "a", path="/shm/a.zip")
+        # Extractors only know the path
+        self.journal.record(J.EXTRACTING, path="/shm/a.zip")
+
+        products = self.journal.replay()
+        self.assertEqual(products["a"]["state"], J.EXTRACTING)
+        self.assertEqual(products["a"]["product"], {"id": "a"})
+        self.assertEqual(products["a"]["path"], "/shm/a.zip")
+        self.assertEqual(products["b"]["state"], J.SEARCHED)
+
+        self.journal.record(J.DONE, path="/shm/a.zip")
+        self.assertEqual([e["id"] for e in J.unfinished(self.journal.replay())], ["b"])
+
+    def test_torn_line(self):
+        self.journal.record(J.SEARCHED, "a")
+        with self.path.open("a") as f:
+            f.write('{"state": "downlo')
+        self.assertEqual(list(self.journal.replay()), ["a"])
+
+    def test_reader(self):
+        reader = JournalReader(self.path)
+        self.assertEqual(reader.read(), {})
+        self.journal.record(J.SEARCHED, "a")
+        self.journal.record(J.DOWNLOADED, "a", path="/shm/a.zip")
+        self.assertEqual(reader.read()["a"]["state"], J.DOWNLOADED)
+
+        # A record being written is left until it is whole
+        with self.path.open("a") as f:
+            f.write('{"state": "done", "path": "/shm/a.zip"')
+        self.assertEqual(reader.read()["a"]["state"], J.DOWNLOADED)
+        with self.path.open("a") as f:
+            f.write("}\n")
+        self.assertEqual(reader.read()["a"]["state"], J.DONE)
+        self.assertEqual(reader.read(), self.journal.replay())
+
+    def test_compact(self):
+        self.journal.record(J.SEARCHED, "a", product={"id": "a"})
+        self.journal.record(J.DOWNLOADED, "a", path="/shm/a.zip")
+        self.journal.record(J.DONE, path="/shm/a.zip")
+        self.journal.record(J.SEARCHED, "b", product={"id": "b"})
+        self.journal.record(J.FAILED, "b", stage="download")
+
+        products = self.journal.compact()
+        lines = [json.loads(l) for l in self.path.read_text().splitlines()]
+        self.assertLen(lines, 2)
+        self.assertNotIn("product", lines[0])
+        self.assertEqual(lines[1]["product"], {"id": "b"})
+        self.assertEqual(self.journal.replay()["b"], products["b"])
+
+        # Still appends after compacting
+        self.journal.record(J.DOWNLOADING, "b")
+        self.assertEqual(self.journal.replay()["b"]["state"], J.DOWNLOADING)
+
+    def test_compact_fresh(self):
+        # First run with a new --ext_base_path
+        journal = Journal(self.path.parent / "new" / "journal.jsonl")
+        self.assertEqual(journal.compact(), {})
+        journal.record(J.SEARCHED, "a")
+        self.assertEqual(journal.replay()["a"]["state"], J.SEARCHED)
+
+    def test_disabled(self):
+        journal = Journal(None)
+        journal.record(J.SEARCHED, "a")
+        self.assertFalse(journal.enabled)
+        self.assertEqual(journal.replay(), {})
+
+    def test_settled(self):
+        self.journal.record(J.DOWNLOADED, "a", path="/dl/a.zip")
+        self.journal.record(J.DOWNLOADED, "b", path="/dl/b.zip")
+        self.journal.record(J.DONE, path="/dl/a.zip")
+        self.assertIsNone(J.settled(["a", "b"], self.journal.replay()))
+        self.assertTrue(J.settled(["a"], self.journal.replay()))
+        self.assertTrue(J.settled([], self.journal.replay()))
+        # Not all of them were found
+        self.assertFalse(J.settled(["a"], self.journal.replay(), complete=False))
+
+        self.journal.record(J.FAILED, path="/dl/b.zip", stage="extract")
+        self.assertFalse(J.settled(["a", "b"], self.journal.replay()))
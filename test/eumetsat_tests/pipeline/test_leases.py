@@ -0,0 +1,109 @@
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline import journal as J
+from eumetsat.pipeline.journal import Journal
+from eumetsat.pipeline.leases import Leases, split_range
+from eumetsat.pipeline.search import SearchError
+from eumetsat_tests.pipeline.test_search import FakeSearch, make_product
+
+FLAGS = flags.FLAGS
+
+
+class TestLeases(parameterized.TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.node_a = Leases(self.root, owner="a")
+        self.node_b = Leases(self.root, owner="b")
+        self.unit = self.node_a.units(datetime(2020, 1, 1), datetime(2020, 1, 2))[0]
+
+    def test_units(self):
+        units = self.node_a.units(datetime(2020, 1, 31), datetime(2020, 2, 2))
+        self.assertEqual([u.name for u in units], ["year=2020/month=01/day=31", "year=2020/month=02/day=01"])
+        self.assertEqual(units[1].start, pd.Timestamp("2020-02-01"))
+        self.assertEqual(units[1].end, pd.Timestamp("2020-02-02"))
+
+    def test_split_range(self):
+        parts = split_range(datetime(2020, 1, 15), datetime(2020, 3, 1), "MS")
+        self.assertEqual(parts, [(pd.Timestamp("2020-01-15"), pd.Timestamp("2020-02-01")),
+                                 (pd.Timestamp("2020-02-01"), pd.Timestamp("2020-03-01"))])
+
+    def test_claim(self):
+        lease = self.node_a.claim(self.unit)
+        self.assertIsNotNone(lease)
+        self.assertIsNone(self.node_b.claim(self.unit))
+        self.assertTrue(self.node_a.renew(lease))
+
+        self.node_a.release(lease)
+        self.assertIsNotNone(self.node_b.claim(self.unit))
+
+    def test_complete(self):
+        lease = self.node_a.claim(self.unit)
+        self.node_a.complete(lease)
+        self.assertTrue(self.node_b.is_done(self.unit))
+        self.assertFalse(self.node_a.path(lease).exists())
+        self.assertIsNone(self.node_b.claim(self.unit))
+
+    def test_expired(self):
+        lease = self.node_a.claim(self.unit)
+        path = self.node_a.path(lease)
+        held = json.loads(path.read_text())
+        path.write_text(json.dumps({**held, "expires": time.time() - 1}))
+
+        taken = self.node_b.claim(self.unit)
+        self.assertIsNotNone(taken)
+        # The old holder has lost it
+        self.assertFalse(self.node_a.renew(lease))
+        self.node_a.release(lease)
+        self.assertTrue(self.node_b.holds(taken))
+        self.assertEqual(list(path.parent.glob("*.stale")), [])
+
+    def test_empty(self):
+        # A node crashed between creating the lease file and writing it
+        path = self.node_a.path(self.unit)
+        path.parent.mkdir(parents=True)
+        path.touch()
+        self.assertIsNone(self.node_b.claim(self.unit))
+
+        old = time.time() - 2 * 3600
+        os.utime(path, (old, old))
+        self.assertIsNotNone(self.node_b.claim(self.unit))
+
+    def test_failed_search(self):
+        # Half the day's search fails, the products found are all done but the day mustn't be
+        lease = self.node_a.claim(self.unit)
+        products = [make_product(t) for t in pd.date_range("2020-01-01 00:00:09", "2020-01-02", freq="15min")]
+        search = FakeSearch(products, shard=timedelta(hours=12))
+        page = search.page
+        search.page = lambda w, si: page(w, si) if w[0].hour == 0 else 1 / 0
+        journal = Journal(self.root / "journal.jsonl")
+        searched = True
+        try:
+            found = search.search(lease.start, lease.end)
+        except SearchError as e:
+            searched, found = False, e.products
+        for p in found:
+            journal.record(J.DONE, p["id"])
+
+        self.assertLen(found, 48)
+        self.assertFalse(J.settled([p["id"] for p in found], journal.replay(), complete=searched))
+        self.node_a.release(lease)
+        self.assertFalse(self.node_b.is_done(self.unit))
+        self.assertIsNotNone(self.node_b.claim(self.unit))
+
+    def test_keep(self):
+        node = Leases(self.root, ttl=timedelta(seconds=0.3), owner="a")
+        lease = node.claim(self.unit)
+        with node.keep(lease):
+            time.sleep(0.5)
+            self.assertIsNone(self.node_b.claim(self.unit))
+        self.assertTrue(node.holds(lease))
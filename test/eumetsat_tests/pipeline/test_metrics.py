@@ -0,0 +1,57 @@
+import json
+import os
+import queue
+import tempfile
+
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline.metrics import Metrics, MetricsReporter
+
+FLAGS = flags.FLAGS
+
+
+class TestMetrics(parameterized.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+        self.path = os.path.join(tempfile.mkdtemp(), "metrics")
+        self.q = queue.Queue()
+        self.q.put(1)
+
+        self.metrics.inc("download_bytes", 100, proc="dl-1")
+        self.metrics.inc("download_bytes", 50, proc="dl-1")
+        for v in range(1, 5):
+            self.metrics.observe("extract_seconds", v, stage="load")
+
+    def test_snapshot(self):
+        reporter = MetricsReporter(self.metrics, self.path, queues={"url_q": self.q})
+        reporter.drain(timeout=0.5)
+        reporter.write()
+        with open(self.path) as f:
+            snapshot = json.load(f)
+
+        self.assertEqual(snapshot["counters"], [{"name": "download_bytes", "labels": {"proc": "dl-1"}, "value": 150}])
+        self.assertEqual(snapshot["gauges"], [{"name": "queue_depth", "labels": {"queue": "url_q"}, "value": 1}])
+        summary = snapshot["summaries"][0]
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["sum"], 10)
+        self.assertEqual(summary["quantiles"]["0.5"], 2.5)
+
+    def test_prometheus(self):
+        reporter = MetricsReporter(self.metrics, self.path, fmt="prom")
+        reporter.drain(timeout=0.5)
+        reporter.write()
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('eumetsat_download_bytes_total{proc="dl-1"} 150.0', lines)
+        self.assertIn('eumetsat_extract_seconds{quantile="0.5",stage="load"} 2.5', lines)
+        self.assertIn('eumetsat_extract_seconds_count{stage="load"} 4', lines)
+
+    def test_disabled(self):
+        metrics = Metrics(enabled=False)
+        metrics.inc("failures", stage="extract")
+        with metrics.timer("extract_seconds"):
+            pass
+        self.assertFalse(metrics.enabled)
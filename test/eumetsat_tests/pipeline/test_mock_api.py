@@ -0,0 +1,67 @@
+import io
+import zipfile
+
+import requests
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat import COLLECTION_ID
+from eumetsat.pipeline.mock_api import SEARCH_PATH, MockApi, MockConfig
+
+FLAGS = flags.FLAGS
+
+
+class TestMockApi(parameterized.TestCase):
+
+    def start(self, **kwargs) -> MockApi:
+        api = MockApi(MockConfig(product_bytes=1000, **kwargs)).start()
+        self.addCleanup(api.stop)
+        return api
+
+    def search(self, api: MockApi, si: int = 0) -> dict:
+        return requests.get(f"{api.url}{SEARCH_PATH}", {"format": "json", "pi": COLLECTION_ID, "c": 10, "si": si,
+                                                         "dtstart": "2020-01-01T00:00:00.000000Z",
+                                                         "dtend": "2020-01-01T06:00:00.000000Z"}).json()
+
+    def test_token(self):
+        api = self.start()
+        res = requests.post(f"{api.url}/token", data="grant_type=client_credentials", auth=("user", "pass"))
+        self.assertEqual(res.json()["access_token"], "mock-token")
+
+    def test_search(self):
+        api = self.start(sats=("MSG3", "MSG4"))
+        page = self.search(api)
+        self.assertEqual(page["totalResults"], 48)
+        self.assertLen(page["features"], 10)
+        self.assertLen(self.search(api, si=40)["features"], 8)
+        self.assertEqual(page["features"][0]["properties"]["date"], "2020-01-01T00:00:09.000Z/2020-01-01T00:12:43.000Z")
+
+    def test_data(self):
+        api = self.start()
+        product = self.search(api)["features"][0]
+        url = product["properties"]["links"]["data"][0]["href"]
+        res = requests.get(url, {"access_token": "mock-token"})
+        self.assertIn(f'filename="{product["id"]}.zip"', res.headers["Content-Disposition"])
+        with zipfile.ZipFile(io.BytesIO(res.content)) as zf:
+            self.assertEqual(zf.read(f"{product['id']}.nat"), api.nat)
+
+        part = requests.get(url, headers={"Range": "bytes=100-"})
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part.content, res.content[100:])
+
+    def test_failures(self):
+        api = self.start(fail_rate=1.)
+        url = self.search(api)["features"][0]["properties"]["links"]["data"][0]["href"]
+        statuses = set()
+        for _ in range(10):
+            try:
+                statuses.add(requests.get(url).status_code)
+            except requests.RequestException:
+                statuses.add("dropped")
+        self.assertEqual(statuses, {500, "dropped"})
+
+    def test_throttle(self):
+        api = self.start(throttle_rate=1., retry_after=3)
+        res = requests.get(f"{api.url}{SEARCH_PATH}")
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(res.headers["Retry-After"], "3")
@@ -0,0 +1,55 @@
+import multiprocessing
+import time
+from email.utils import formatdate
+
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline.ratelimit import RateLimiter, retry_after
+
+FLAGS = flags.FLAGS
+
+
+def take(limiter: RateLimiter, n: int):
+    for _ in range(n):
+        limiter.acquire()
+
+
+class TestRateLimiter(parameterized.TestCase):
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after({"Retry-After": "120"}), 120)
+        self.assertAlmostEqual(retry_after({"Retry-After": formatdate(time.time() + 60, usegmt=True)}), 60, delta=2)
+        self.assertIsNone(retry_after({}))
+        self.assertIsNone(retry_after({"Retry-After": "soon"}))
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        self.assertEqual(sum(limiter.reserve() for _ in range(100)), 0)
+
+    def test_reserve(self):
+        limiter = RateLimiter(rps=10, burst=2)
+        waits = [limiter.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1, delta=0.01)
+        self.assertAlmostEqual(waits[3], 0.2, delta=0.01)
+
+    def test_block(self):
+        limiter = RateLimiter()
+        limiter.block(5)
+        self.assertAlmostEqual(limiter.reserve(), 5, delta=0.1)
+
+    def test_shared(self):
+        # The bucket is shared, so 2 procs taking 5 tokens each at 20/s take ~0.5s
+        limiter = RateLimiter(rps=20, burst=1)
+        start = time.monotonic()
+        procs = [multiprocessing.Process(target=take, args=(limiter, 5)) for _ in range(2)]
+        [p.start() for p in procs]
+        [p.join() for p in procs]
+        self.assertGreater(time.monotonic() - start, 0.4)
+
+    def test_transfer(self):
+        limiter = RateLimiter(max_transfers=1)
+        with limiter.transfer():
+            self.assertFalse(limiter._transfers.acquire(block=False))
+        self.assertTrue(limiter._transfers.acquire(block=False))
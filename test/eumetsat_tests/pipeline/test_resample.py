@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+from absl import flags
+from absl.testing import parameterized
+from pyresample.geometry import AreaDefinition, StackedAreaDefinition
+from satpy import Scene
+
+from eumetsat.pipeline.resample import ResampleCache, crop_scene
+
+FLAGS = flags.FLAGS
+
+
+def small_scene() -> Scene:
+    src = AreaDefinition.from_extent("src", "EPSG:4326", (40, 40), (-20., 40., 10., 70.))
+    data = da.from_array(np.arange(1600, dtype=np.float32).reshape(40, 40), chunks=20)
+    scn = Scene()
+    scn["VIS006"] = xr.DataArray(data, dims=("y", "x"), attrs={"area": src, "name": "VIS006"})
+    return scn
+
+
+def stacked_scene() -> Scene:
+    """Small scene with a HRV like channel on a stacked area, at 3x the resolution of the others."""
+    scn = small_scene()
+    lower = AreaDefinition.from_extent("lower", "EPSG:4326", (60, 120), (-20., 40., 20., 60.))
+    upper = AreaDefinition.from_extent("upper", "EPSG:4326", (60, 120), (-30., 60., 10., 80.))
+    data = da.from_array(np.arange(120 * 120, dtype=np.float32).reshape(120, 120), chunks=60)
+    scn["HRV"] = xr.DataArray(data, dims=("y", "x"), attrs={"area": StackedAreaDefinition(lower, upper),
+                                                            "name": "HRV"})
+    return scn
+
+
+class TestResampleCache(parameterized.TestCase):
+
+    def test_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        target = AreaDefinition.from_extent("UK", "EPSG:4326", (10, 10), (-12., 48., 5., 61.))
+
+        cold = ResampleCache(cache_dir).resample(small_scene(), target)["VIS006"].values
+        cached = [f for f in os.listdir(cache_dir) if f.startswith("bil_lut")]
+        self.assertLen(cached, 1)
+
+        warm = ResampleCache(cache_dir).resample(small_scene(), target)["VIS006"].values
+        no_cache = ResampleCache(None).resample(small_scene(), target)["VIS006"].values
+        np.testing.assert_allclose(cold, warm)
+        np.testing.assert_allclose(no_cache, warm)
+
+
+class TestCropScene(parameterized.TestCase):
+
+    def test_crop(self):
+        cropped = crop_scene(small_scene(), (-12., 48., 5., 61.))
+        self.assertLess(cropped["VIS006"].shape, (40, 40))
+        self.assertEqual(cropped["VIS006"].shape, small_scene().crop(ll_bbox=(-12., 48., 5., 61.))["VIS006"].shape)
+
+    def test_crop_stacked(self):
+        scn = stacked_scene()
+        with self.assertRaises((ValueError, NotImplementedError)):
+            scn.crop(ll_bbox=(-12., 48., 5., 61.))
+
+        cropped = crop_scene(scn, (-12., 48., 5., 61.))
+        self.assertLess(cropped["VIS006"].shape, (40, 40))
+        self.assertEqual(cropped["HRV"].shape, (120, 120))
+        self.assertIsInstance(cropped["HRV"].attrs["area"], StackedAreaDefinition)
+
+        target = AreaDefinition.from_extent("UK", "EPSG:4326", (10, 10), (-12., 48., 5., 61.))
+        res = ResampleCache(None).resample(cropped, target)
+        self.assertEqual(res["HRV"].shape, (10, 10))
+        self.assertEqual(res["VIS006"].shape, (10, 10))
@@ -0,0 +1,53 @@
+from multiprocessing import JoinableQueue, Process
+
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline.scheduler import WorkerPool, decide
+
+FLAGS = flags.FLAGS
+
+
+class Worker(Process):
+    def __init__(self, q: JoinableQueue):
+        super().__init__()
+        self.q = q
+
+    def run(self):
+        while True:
+            task = self.q.get()
+            self.q.task_done()
+            if task is None:
+                break
+
+
+class TestScheduler(parameterized.TestCase):
+
+    @parameterized.parameters((0.9, True, 2, None, None, (-1, 1)),  # Extract bound
+                              (0.5, False, 2, None, None, (-1, 1)),  # RAM disk full
+                              (0.1, True, 2, None, None, (1, 0)),  # Download bound
+                              (0.0, True, 2, None, None, (1, 0)),  # Empty queue, extractors not measured
+                              (0.0, True, 4, 0.1, 20, (1, -1)),  # Extractors idle, 2 keep up
+                              (0.0, True, 2, 0.1, 20, (1, 0)),  # Empty queue, but all of them are needed
+                              (0.5, True, 2, None, None, (0, 0)),
+                              (0.5, True, 2, 0.1, 40, (0, 1)),  # Need 4 extractors to keep up
+                              (0.5, True, 6, 0.1, 40, (0, -1)))
+    def test_decide(self, file_fill, shm_ok, ex, dl_rate, ex_latency, true):
+        self.assertEqual(decide(file_fill, shm_ok, ex, dl_rate=dl_rate, ex_latency=ex_latency), true)
+
+    def test_pool(self):
+        q = JoinableQueue(10)
+        pool = WorkerPool("test", lambda: Worker(q), q, 2, min_size=1, max_size=3)
+        self.assertTrue(pool.grow())
+        self.assertFalse(pool.grow())
+        self.assertEqual(pool.size, 3)
+
+        self.assertTrue(pool.shrink())
+        self.assertTrue(pool.shrink())
+        self.assertFalse(pool.shrink())
+        self.assertEqual(pool.size, 1)
+
+        pool.close()
+        q.join()
+        pool.join()
+        self.assertEqual([p.exitcode for p in pool.procs], [0, 0, 0])
@@ -0,0 +1,95 @@
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline.search import ProductSearch, SearchCache, SearchError, select_products, shard_ranges
+
+FLAGS = flags.FLAGS
+
+
+def make_product(ts: pd.Timestamp, sat: str = "MSG4") -> dict:
+    end = ts + pd.Timedelta(minutes=12)
+    return {"id": f"{sat}-{end:%Y%m%d%H%M%S}",
+            "properties": {"date": f"{ts:%Y-%m-%dT%H:%M:%S.000Z}/{end:%Y-%m-%dT%H:%M:%S.000Z}"}}
+
+
+class FakeSearch(ProductSearch):
+    """Serves pages from a list of products rather than the API."""
+
+    def __init__(self, products, **kwargs):
+        super().__init__("http://localhost", "collection", items_per_page=10, **kwargs)
+        self.products = products
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def page(self, window, si):
+        with self._lock:
+            self.requests.append((window, si))
+        # The API matches products overlapping the window
+        matches = [p for p in self.products
+                   if p["properties"]["date"] < f"{window[1]:%Y-%m-%dT%H:%M:%S}"
+                   and p["properties"]["date"].split("/")[1] > f"{window[0]:%Y-%m-%dT%H:%M:%S}"]
+        return {"totalResults": len(matches), "features": matches[si:si + self.items_per_page]}
+
+
+class TestSearch(parameterized.TestCase):
+
+    def setUp(self):
+        times = pd.date_range("2020-01-01 00:00:09", "2020-01-03", freq="15min")
+        self.products = [make_product(t) for t in times]
+
+    def test_shard_ranges(self):
+        windows = shard_ranges(datetime(2020, 1, 1, 6), datetime(2020, 1, 3), timedelta(days=1))
+        self.assertEqual(windows, [(pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-02")),
+                                   (pd.Timestamp("2020-01-02"), pd.Timestamp("2020-01-03"))])
+
+    def test_search(self):
+        search = FakeSearch(self.products, workers=4)
+        found = search.search(datetime(2020, 1, 1, 6), datetime(2020, 1, 2, 6))
+        self.assertLen(found, 96)
+        self.assertEqual(found, self.products[24:24 + 96])
+        # 2 windows of 10 pages each
+        self.assertLen(search.requests, 20)
+
+    def test_cache(self):
+        cache = SearchCache(Path(tempfile.mkdtemp()) / "search.sqlite")
+        search = FakeSearch(self.products, cache=cache)
+        first = search.search(datetime(2020, 1, 1), datetime(2020, 1, 2))
+        search.requests.clear()
+        self.assertEqual(search.search(datetime(2020, 1, 1, 12), datetime(2020, 1, 2)), first[48:])
+        self.assertEmpty(search.requests)
+
+    def test_cache_fresh(self):
+        cache = SearchCache(Path(tempfile.mkdtemp()) / "search.sqlite", ttl=timedelta(hours=1))
+        end = pd.Timestamp.now("UTC").tz_convert(None)
+        self.assertTrue(cache.fresh(end, time.time()))
+        self.assertFalse(cache.fresh(end, time.time() - 2 * 3600))
+        # Listed long after the window ended
+        self.assertTrue(cache.fresh(end - pd.Timedelta(days=30), time.time() - 20 * 24 * 3600))
+
+    def test_failed_window_not_cached(self):
+        cache = SearchCache(Path(tempfile.mkdtemp()) / "search.sqlite")
+        search = FakeSearch(self.products, cache=cache)
+        page = search.page
+        search.page = lambda w, si: page(w, si) if w[0].day == 1 else 1 / 0
+
+        with self.assertRaises(SearchError) as e:
+            search.search(datetime(2020, 1, 1), datetime(2020, 1, 3))
+        self.assertEqual(e.exception.products, self.products[:96])
+        self.assertEqual(e.exception.failed, [(pd.Timestamp("2020-01-02"), pd.Timestamp("2020-01-03"))])
+        self.assertIsNotNone(cache.get("collection", (pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-02"))))
+        self.assertIsNone(cache.get("collection", (pd.Timestamp("2020-01-02"), pd.Timestamp("2020-01-03"))))
+
+    def test_select_products(self):
+        t0, t1 = pd.Timestamp("2020-01-01 00:00:09"), pd.Timestamp("2020-01-01 00:15:10")
+        msg3 = [make_product(t0, "MSG3"), make_product(t1, "MSG3")]
+        msg4 = [make_product(t0, "MSG4")]
+        msg2 = [make_product(t1 + pd.Timedelta("15min"), "MSG2")]
+        self.assertEqual(select_products(msg3 + msg4 + msg2, ["MSG4", "MSG3"]), [msg4[0], msg3[1]])
+        self.assertEqual(select_products(msg4 + msg3, ["MSG3", "MSG4"]), msg3)
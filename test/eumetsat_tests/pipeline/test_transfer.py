@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+
+import aiohttp
+import pandas as pd
+from absl import flags
+from absl.testing import parameterized
+
+from eumetsat.pipeline.mock_api import MockApi, MockConfig
+from eumetsat.pipeline.transfer import DownloadError, Transfer, content_md5, download_async, parse_content_range
+
+FLAGS = flags.FLAGS
+
+
+class TestTransfer(parameterized.TestCase):
+
+    @parameterized.parameters(("bytes 0-99/100", (0, 100)),
+                              ("bytes 50-99/100", (50, 100)),
+                              ("bytes 50-99/*", (50, None)))
+    def test_parse_content_range(self, header, true):
+        self.assertEqual(parse_content_range(header), true)
+
+    def test_parse_content_range_bad(self):
+        with self.assertRaises(DownloadError):
+            parse_content_range("bytes */100")
+
+    def test_content_md5(self):
+        md5 = hashlib.md5(b"data")
+        b64 = base64.b64encode(md5.digest()).decode()
+        self.assertEqual(content_md5({"Content-MD5": b64}), md5.hexdigest())
+        self.assertEqual(content_md5({"Digest": f"SHA-256=abc, MD5={b64}"}), md5.hexdigest())
+        self.assertIsNone(content_md5({}))
+
+    def test_resume(self):
+        path = os.path.join(tempfile.mkdtemp(), "product.zip")
+        body = b"0123456789"
+        t = Transfer()
+
+        # First attempt drops after 4 bytes
+        self.assertEqual(t.begin(200, {"Content-Length": "10"}, path), "wb")
+        with open(t.part, "wb") as f:
+            f.write(body[:4])
+        with self.assertRaises(DownloadError):
+            t.finish()
+        self.assertEqual(t.headers(), {"Range": "bytes=4-"})
+
+        # Second attempt gets the rest
+        self.assertEqual(t.begin(206, {"Content-Range": "bytes 4-9/10"}, path), "ab")
+        with open(t.part, "ab") as f:
+            f.write(body[4:])
+        self.assertEqual(t.finish(), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), body)
+        self.assertFalse(os.path.exists(t.part))
+
+    def test_resume_existing_part(self):
+        path = os.path.join(tempfile.mkdtemp(), "product.zip")
+        with open(f"{path}.part", "wb") as f:
+            f.write(b"0123")
+        t = Transfer()
+        self.assertIsNone(t.begin(200, {"Content-Length": "10", "Accept-Ranges": "bytes"}, path))
+        self.assertEqual(t.headers(), {"Range": "bytes=4-"})
+
+    def test_bad_checksum(self):
+        path = os.path.join(tempfile.mkdtemp(), "product.zip")
+        t = Transfer()
+        b64 = base64.b64encode(hashlib.md5(b"other").digest()).decode()
+        t.begin(200, {"Content-Length": "4", "Content-MD5": b64}, path)
+        with open(t.part, "wb") as f:
+            f.write(b"data")
+        with self.assertRaises(DownloadError):
+            t.finish()
+        self.assertFalse(os.path.exists(t.part))
+
+
+class TestDownloadAsync(parameterized.TestCase):
+
+    def start(self, **kwargs) -> tuple[MockApi, list[str]]:
+        api = MockApi(MockConfig(product_bytes=300_000, retry_after=0, **kwargs)).start()
+        self.addCleanup(api.stop)
+        products = api.products(pd.Timestamp("2020-01-01 00:00"), pd.Timestamp("2020-01-01 01:00"))
+        return api, [p["properties"]["links"]["data"][0]["href"] for p in products]
+
+    def download(self, urls: list[str], base: str, inflight: int = 4) -> list[str]:
+        tokens = []
+
+        async def token() -> str:
+            tokens.append(1)
+            return "mock-token"
+
+        def target(content_disposition: str) -> str:
+            return os.path.join(base, re.findall("\"(.*?)\"", content_disposition)[0])
+
+        async def run():
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=inflight)) as session:
+                return await asyncio.gather(*[download_async(session, url, token, target, retries=20,
+                                                             backoff_base=0.01, chunk_size=2 ** 14)
+                                              for url in urls])
+
+        paths = asyncio.run(run())
+        self.assertGreaterEqual(len(tokens), len(urls))
+        return paths
+
+    def assertProducts(self, api: MockApi, urls: list[str], paths: list[str]):
+        for url, path in zip(urls, paths):
+            pid = url.rsplit("/", 1)[-1]
+            self.assertEqual(os.path.basename(path), f"{pid}.zip")
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), api.product_zip(pid)[0])
+            self.assertFalse(os.path.exists(f"{path}.part"))
+
+    def test_download(self):
+        api, urls = self.start()
+        paths = self.download(urls, tempfile.mkdtemp())
+        self.assertProducts(api, urls, paths)
+        self.assertEqual(api.requests["data"], len(urls))
+
+    @parameterized.parameters({"fail_rate": 0.5}, {"throttle_rate": 0.5})
+    def test_download_retries(self, **kwargs):
+        api, urls = self.start(seed=3, **kwargs)
+        paths = self.download(urls, tempfile.mkdtemp())
+        self.assertProducts(api, urls, paths)
+        self.assertGreater(api.requests["data"], len(urls))
+
+    def test_download_resumes_part(self):
+        api, urls = self.start()
+        base = tempfile.mkdtemp()
+        pid = urls[0].rsplit("/", 1)[-1]
+        with open(os.path.join(base, f"{pid}.zip.part"), "wb") as f:
+            f.write(api.product_zip(pid)[0][:1000])
+        paths = self.download(urls[:1], base)
+        self.assertProducts(api, urls[:1], paths)
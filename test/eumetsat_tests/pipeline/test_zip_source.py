@@ -0,0 +1,38 @@
+import os
+import tempfile
+import zipfile
+
+from absl import flags
+from absl.testing import parameterized
+from satpy.readers.core.remote import FSFile
+
+from eumetsat.pipeline.zip_source import nat_source
+
+FLAGS = flags.FLAGS
+
+NAT_NAME = "MSG4-SEVI-MSG15-0100-NA-20200101121241.606000000Z-NA.nat"
+
+
+class TestZipSource(parameterized.TestCase):
+
+    @parameterized.parameters(zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+    def test_nat_source(self, compression):
+        data = os.urandom(100_000)
+        zip_path = os.path.join(tempfile.mkdtemp(), "product.zip")
+        with zipfile.ZipFile(zip_path, "w", compression=compression) as zf:
+            zf.writestr("manifest.xml", b"<xml/>")
+            zf.writestr(NAT_NAME, data)
+
+        src = nat_source(zip_path)
+        if compression == zipfile.ZIP_STORED:
+            self.assertIsInstance(src, FSFile)
+            self.assertEqual(str(src), NAT_NAME)
+        else:
+            # Compressed members are extracted next to the zip
+            self.assertEqual(src, os.path.join(os.path.dirname(zip_path), NAT_NAME))
+            src = FSFile(src)
+        with src.open("rb") as f:
+            f.seek(500)
+            self.assertEqual(f.read(10), data[500:510])
+            f.seek(0)
+            self.assertEqual(f.read(), data)
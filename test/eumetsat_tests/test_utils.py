@@ -2,7 +2,7 @@ from absl import flags
 from absl.testing import parameterized
 
 import eumetsat
-from eumetsat.utils import dataspec
+from eumetsat.utils import dataspec, get_ll_bbox
 
 FLAGS = flags.FLAGS
 
@@ -24,3 +24,7 @@ class test_utils(parameterized.TestCase):
         assert dataspec.min_lat == eumetsat.AREA_EXTENT[1]
         assert dataspec.max_lon == eumetsat.AREA_EXTENT[2]
         assert dataspec.min_lon == eumetsat.AREA_EXTENT[0]
+
+    def test_ll_bbox(self):
+        assert get_ll_bbox() == (-12., 48., 5., 61.)
+        assert get_ll_bbox(1.) == (-13., 47., 6., 62.)